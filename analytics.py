@@ -0,0 +1,336 @@
+from datetime import datetime
+from math import ceil
+
+import numpy as np
+from sqlalchemy import func, select
+
+from db.dialect import epoch_seconds
+from db.entities import TrafficRecord, TrafficCam
+from repository import session_scope, handle_exceptions, range_cache
+
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+DEFAULT_PERCENTILES = (50, 85, 95)
+
+# bucket sizes offered to charts, in seconds; coarser series use whole days
+TIMESERIES_STEPS = (60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400)
+DEFAULT_TIMESERIES_POINTS = 1000
+# with LTTB the range is bucketed this many times finer than the requested points
+LTTB_OVERSAMPLE = 8
+
+
+def filter_range(query, start_datetime, end_datetime, cam_id=None, city=None):
+    query = query.where(
+        TrafficRecord.start_time >= start_datetime,
+        TrafficRecord.end_time <= end_datetime
+    )
+    if cam_id is not None:
+        query = query.where(TrafficRecord.traffic_cam_id == cam_id)
+    if city is not None:
+        query = query.join(TrafficCam).where(TrafficCam.city == city)
+    return query
+
+
+def load_columns(session, start_datetime, end_datetime, cam_id=None, city=None):
+    """
+    Fetch the records of a range in one query and return them as NumPy column arrays.
+    Uses the same range semantics as the repository (start >= start_datetime, end <= end_datetime).
+    """
+    query = select(
+        TrafficRecord.traffic_cam_id,
+        TrafficRecord.start_time,
+        TrafficRecord.vehicle_count,
+        TrafficRecord.average_speed
+    )
+    rows = session.execute(filter_range(query, start_datetime, end_datetime, cam_id, city)).all()
+    cams, starts, vehicles, speeds = zip(*rows) if rows else ((), (), (), ())
+    return {
+        "cam": np.array(cams, dtype=np.int64),
+        "start": np.array(starts, dtype="datetime64[s]"),
+        "vehicles": np.array(vehicles, dtype=np.int64),
+        "speed": np.array(speeds, dtype=np.float64),
+    }
+
+
+def day_and_hour(starts):
+    """
+    Split datetime64 values into day numbers (days since epoch) and hour of day.
+    """
+    days = starts.astype("datetime64[D]")
+    hours = (starts - days).astype("timedelta64[h]").astype(np.int64)
+    return days.astype(np.int64), hours
+
+
+def group_sum(keys, weights):
+    """
+    Sum `weights` per distinct key. Returns the sorted distinct keys and their sums.
+    """
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    sums = np.bincount(inverse, weights=weights, minlength=len(unique_keys))
+    return unique_keys, sums
+
+
+def grouped_percentiles(groups, values, percentiles):
+    """
+    Linear-interpolated percentiles of `values` within each group, computed for all groups at once.
+    Returns the sorted distinct groups and an array of shape (groups, len(percentiles)).
+    """
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    unique_groups, starts, counts = np.unique(groups[order], return_index=True, return_counts=True)
+
+    result = np.empty((len(unique_groups), len(percentiles)))
+    for i, q in enumerate(percentiles):
+        position = starts + (counts - 1) * (q / 100.0)
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        fraction = position - low
+        result[:, i] = sorted_values[low] + (sorted_values[high] - sorted_values[low]) * fraction
+    return unique_groups, result
+
+
+def load_buckets(session, start_datetime, end_datetime, resolution, cam_id=None, city=None):
+    """
+    Aggregate the records of a range into buckets of `resolution` seconds in SQL, and return the
+    per-bucket sums as NumPy column arrays ordered by time. Buckets start at multiples of
+    `resolution` since the epoch; buckets without records are absent.
+    """
+    epoch = epoch_seconds(TrafficRecord.start_time)
+    bucket = (epoch - epoch % resolution).label("bucket")
+    query = select(
+        bucket,
+        func.count(TrafficRecord.id),
+        func.sum(TrafficRecord.vehicle_count),
+        func.sum(TrafficRecord.average_speed * TrafficRecord.vehicle_count),
+        func.sum(TrafficRecord.average_speed)
+    )
+    query = filter_range(query, start_datetime, end_datetime, cam_id, city).group_by(bucket).order_by(bucket)
+
+    rows = session.execute(query).all()
+    times, records, vehicles, weighted_speed, speed = zip(*rows) if rows else ((), (), (), (), ())
+    return {
+        "time": np.array(times, dtype=np.int64),
+        "records": np.array(records, dtype=np.int64),
+        "vehicles": np.array(vehicles, dtype=np.int64),
+        "weighted_speed": np.array(weighted_speed, dtype=np.float64),
+        "speed": np.array(speed, dtype=np.float64),
+    }
+
+
+def timeseries_resolution(start_datetime, end_datetime, points, minimum=None):
+    """
+    Smallest bucket size of TIMESERIES_STEPS, or number of whole days, of at least `minimum`
+    seconds that splits the range into no more than `points` buckets.
+    """
+    span = (end_datetime - start_datetime).total_seconds()
+    needed = max(span / points, minimum or 0, 1)
+    for step in TIMESERIES_STEPS:
+        if step >= needed:
+            return step
+    return ceil(needed / 86400) * 86400
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: indices of `threshold` points of the series (x, y) that keep
+    its visual shape, the first and last points included.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    # the points between the first and last are split into threshold - 2 buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    edges[-1] = n - 1
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        low, high = edges[i], edges[i + 1]
+        next_high = edges[i + 2] if i + 2 < len(edges) else n
+        next_x, next_y = x[high:next_high].mean(), y[high:next_high].mean()
+        # twice the area of the triangles (previous point, candidate, average of the next bucket)
+        area = np.abs((x[previous] - next_x) * (y[low:high] - y[previous])
+                      - (x[previous] - x[low:high]) * (next_y - y[previous]))
+        previous = low + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+
+# ========== Computations on loaded columns ==========
+
+def compute_peak_hours(columns):
+    """
+    Vectorized equivalent of repository.get_peak_hours: for every day find the hour(s) with
+    most vehicles, then report the hour(s) that were the daily peak most often together with
+    the average vehicle count of those peaks.
+    """
+    if not len(columns["start"]):
+        return []
+    days, hours = day_and_hour(columns["start"])
+    buckets, sums = group_sum(days * 24 + hours, columns["vehicles"])
+    bucket_days, bucket_hours = buckets // 24, buckets % 24
+
+    # buckets are sorted, so each day is a contiguous run
+    day_starts = np.flatnonzero(np.r_[True, np.diff(bucket_days) != 0])
+    day_max = np.maximum.reduceat(sums, day_starts)
+    day_index = np.cumsum(np.r_[False, np.diff(bucket_days) != 0])
+    is_peak = sums == day_max[day_index]
+
+    peak_hours, peak_vehicles = bucket_hours[is_peak], sums[is_peak]
+    freq = np.bincount(peak_hours, minlength=24)
+    totals = np.bincount(peak_hours, weights=peak_vehicles, minlength=24)
+
+    return [
+        {
+            "hour": f"{hour:02d}:00 - {hour + 1:02d}:00",
+            "vehicle_count": int(totals[hour] // freq[hour])
+        }
+        for hour in np.flatnonzero(freq == freq.max()).tolist()
+    ]
+
+
+def compute_hourly_profile(columns):
+    """
+    Typical traffic per hour of day: mean vehicles per day that has data in that hour, and the
+    vehicle-weighted mean speed.
+    """
+    days, hours = day_and_hour(columns["start"])
+    vehicles, speed = columns["vehicles"], columns["speed"]
+
+    buckets, _ = group_sum(days * 24 + hours, vehicles)
+    active_days = np.bincount(buckets % 24, minlength=24)
+    total_vehicles = np.bincount(hours, weights=vehicles, minlength=24)
+    weighted_speed = np.bincount(hours, weights=vehicles * speed, minlength=24)
+
+    return [
+        {
+            "hour": f"{hour:02d}:00 - {hour + 1:02d}:00",
+            "vehicle_count": round(float(total_vehicles[hour] / active_days[hour]), 2),
+            "average_speed": round(float(weighted_speed[hour] / total_vehicles[hour]), 2) if total_vehicles[hour] else None
+        }
+        for hour in np.flatnonzero(active_days).tolist()
+    ]
+
+
+def compute_weekly_profile(columns):
+    """
+    Typical traffic per day of week: mean daily vehicles over the dates of that weekday with data,
+    and the vehicle-weighted mean speed.
+    """
+    days, _ = day_and_hour(columns["start"])
+    vehicles, speed = columns["vehicles"], columns["speed"]
+    # 1970-01-01 was a Thursday
+    weekdays = (days + 3) % 7
+
+    unique_days, _ = group_sum(days, vehicles)
+    active_days = np.bincount((unique_days + 3) % 7, minlength=7)
+    total_vehicles = np.bincount(weekdays, weights=vehicles, minlength=7)
+    weighted_speed = np.bincount(weekdays, weights=vehicles * speed, minlength=7)
+
+    return [
+        {
+            "day": WEEKDAYS[weekday],
+            "vehicle_count": round(float(total_vehicles[weekday] / active_days[weekday]), 2),
+            "average_speed": round(float(weighted_speed[weekday] / total_vehicles[weekday]), 2) if total_vehicles[weekday] else None
+        }
+        for weekday in np.flatnonzero(active_days).tolist()
+    ]
+
+
+def compute_camera_percentiles(columns, percentiles=DEFAULT_PERCENTILES):
+    """
+    Per-camera percentiles of record speed and vehicle count.
+    """
+    if not len(columns["cam"]):
+        return []
+    cams, speed_pct = grouped_percentiles(columns["cam"], columns["speed"], percentiles)
+    _, volume_pct = grouped_percentiles(columns["cam"], columns["vehicles"].astype(np.float64), percentiles)
+    _, samples = np.unique(columns["cam"], return_counts=True)
+
+    return [
+        {
+            "traffic_cam_id": int(cam),
+            "samples": int(samples[i]),
+            "speed": {f"p{q}": round(float(speed_pct[i, j]), 2) for j, q in enumerate(percentiles)},
+            "vehicle_count": {f"p{q}": round(float(volume_pct[i, j]), 2) for j, q in enumerate(percentiles)},
+        }
+        for i, cam in enumerate(cams)
+    ]
+
+
+def compute_timeseries(buckets):
+    """
+    Chart points of aggregated buckets: vehicle count and vehicle-weighted mean speed (plain
+    mean of the records when no vehicle passed).
+    """
+    vehicles = buckets["vehicles"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speed = np.where(vehicles > 0, buckets["weighted_speed"] / vehicles, buckets["speed"] / buckets["records"])
+    times = np.char.replace(np.datetime_as_string(buckets["time"].astype("datetime64[s]")), "T", " ")
+    return [
+        {
+            "start_datetime": time,
+            "records": records,
+            "vehicle_count": vehicle_count,
+            "average_speed": round(average_speed, 2)
+        }
+        for time, records, vehicle_count, average_speed in zip(
+            times.tolist(), buckets["records"].tolist(), vehicles.tolist(), speed.tolist())
+    ]
+
+
+# ========== Entry points ==========
+
+@handle_exceptions
+def get_peak_hours_vectorized(start_datetime: datetime, end_datetime: datetime, cam_id: int = None, city: str = None):
+    with session_scope() as session:
+        return compute_peak_hours(load_columns(session, start_datetime, end_datetime, cam_id, city))
+
+
+@handle_exceptions
+def get_hourly_profile(start_datetime: datetime, end_datetime: datetime, cam_id: int = None, city: str = None):
+    with session_scope() as session:
+        return compute_hourly_profile(load_columns(session, start_datetime, end_datetime, cam_id, city))
+
+
+@handle_exceptions
+def get_weekly_profile(start_datetime: datetime, end_datetime: datetime, cam_id: int = None, city: str = None):
+    with session_scope() as session:
+        return compute_weekly_profile(load_columns(session, start_datetime, end_datetime, cam_id, city))
+
+
+@handle_exceptions
+def get_camera_percentiles(start_datetime: datetime, end_datetime: datetime, cam_id: int = None,
+                           city: str = None, percentiles=DEFAULT_PERCENTILES):
+    with session_scope() as session:
+        return compute_camera_percentiles(load_columns(session, start_datetime, end_datetime, cam_id, city),
+                                          percentiles)
+
+
+@handle_exceptions
+@range_cache.cached
+def get_timeseries(start_datetime: datetime, end_datetime: datetime, cam_id: int = None, city: str = None,
+                   points: int = DEFAULT_TIMESERIES_POINTS, resolution: int = None, downsample: str = None):
+    """
+    Vehicle counts and speeds of the range in fixed-size buckets, for charts.
+
+    The bucket size is `resolution` seconds, raised as needed so the range holds at most `points`
+    buckets. With downsample="lttb" the range is bucketed LTTB_OVERSAMPLE times finer and
+    reduced to `points` buckets by LTTB on the vehicle counts, which keeps the spikes that
+    coarser buckets would average out.
+    Returns {"resolution": bucket seconds, "points": [...]}.
+    """
+    if downsample == "lttb":
+        resolution = timeseries_resolution(start_datetime, end_datetime, points * LTTB_OVERSAMPLE, resolution)
+    else:
+        resolution = timeseries_resolution(start_datetime, end_datetime, points, resolution)
+
+    with session_scope() as session:
+        buckets = load_buckets(session, start_datetime, end_datetime, resolution, cam_id, city)
+    if downsample == "lttb":
+        keep = lttb(buckets["time"], buckets["vehicles"], points)
+        buckets = {name: column[keep] for name, column in buckets.items()}
+    return {"resolution": resolution, "points": compute_timeseries(buckets)}
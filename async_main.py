@@ -0,0 +1,401 @@
+"""
+Asyncio serving mode: the routes of main.py on Quart and SQLAlchemy's async engine.
+
+Ingest and /traffic_state run natively on the async engine, so a worker holds thousands of
+idle camera connections without a thread each. Dashboard, export and analytics routes call
+the same repository functions as main.py in a worker thread.
+
+    hypercorn async_main:app --bind 0.0.0.0:5001
+"""
+import asyncio
+import logging
+import math
+
+from quart import Quart, Response, request, jsonify
+from quart_cors import cors
+
+import repository
+import async_repository
+import metrics
+from analytics import (get_peak_hours_vectorized, get_hourly_profile, get_weekly_profile,
+                       get_camera_percentiles, get_timeseries, DEFAULT_TIMESERIES_POINTS)
+from db.async_database import async_engine
+from db.config import (INGEST_MODE, INGEST_SPOOL_DIR, INGEST_FLUSH_SIZE, INGEST_FLUSH_INTERVAL,
+                       INGEST_SPOOL_FSYNC, INGEST_MAX_ATTEMPTS, INGEST_MAX_BACKLOG, SPATIAL_MAX_RADIUS_METERS)
+from db.database import create_tables, db_engine
+from export import EXPORTERS, CONTENT_TYPES
+from ingest_queue import IngestQueue, QueueFull
+from json_provider import FastJSONProvider
+from live import AsyncSubscriber, broadcaster, state_tracker, async_stream_events
+from notifications import NotificationDispatcher, make_sender
+from payloads import (EXPORT_CHUNK_SIZE, RequestError, parse_record_body, parse_batch_body, batch_payload,
+                      parse_datetime_range, parse_range_args, parse_congestion_args, parse_ranking_args,
+                      parse_records_args, parse_page_args, parse_export_format, parse_near_args, parse_bbox_args,
+                      parse_flag, parse_percentiles, parse_timeseries_args, stats_response, page_payload,
+                      records_payload, jams_payload, export_headers, wants_ndjson, stream_ndjson)
+
+app = cors(Quart(__name__))
+app.json = FastJSONProvider(app)
+
+ingest_queue = None
+if INGEST_MODE == "queued":
+    ingest_queue = IngestQueue(INGEST_SPOOL_DIR, INGEST_FLUSH_SIZE, INGEST_FLUSH_INTERVAL, INGEST_SPOOL_FSYNC,
+                               max_attempts=INGEST_MAX_ATTEMPTS, max_backlog=INGEST_MAX_BACKLOG)
+
+    @app.before_serving
+    async def start_ingest_queue():
+        ingest_queue.start()
+
+notification_dispatcher = None
+notification_sender = make_sender()
+if notification_sender is not None:
+    notification_dispatcher = NotificationDispatcher(notification_sender)
+
+    @app.before_serving
+    async def start_notification_dispatcher():
+        notification_dispatcher.start()
+
+# SQL runs on both engines: natively async for the hot paths, in threads for everything else
+metrics.instrument_engine(async_engine.sync_engine)
+metrics.instrument_engine(db_engine)
+metrics.register(metrics.Gauge("range_cache_entries", "Results held by the range query cache.",
+                               lambda: repository.range_cache.stats()["entries"]))
+metrics.register(metrics.Gauge("range_cache_bytes", "Pickled size of the range query cache.",
+                               lambda: repository.range_cache.stats()["bytes"]))
+metrics.register(metrics.Gauge("live_stream_clients", "Clients connected to /stream/traffic_state.",
+                               broadcaster.count))
+if notification_dispatcher is not None:
+    for key, help_text in (("sent", "Jam notifications delivered."),
+                           ("failed", "Failed jam notification deliveries, retried later."),
+                           ("abandoned", "Jam notifications dropped after the last attempt.")):
+        metrics.register(metrics.Gauge(f"notifications_{key}_total", help_text,
+                                       lambda key=key: notification_dispatcher.stats()[key], "counter"))
+if ingest_queue is not None:
+    metrics.register(metrics.Gauge("ingest_queue_depth", "Spooled records not yet written.",
+                                   lambda: ingest_queue.stats()["queue_depth"]))
+    metrics.register(metrics.Gauge("ingest_queue_lag_seconds", "Age of the oldest spooled record.",
+                                   lambda: ingest_queue.stats()["lag_seconds"]))
+
+
+@app.before_request
+async def start_request_metrics():
+    metrics.start_request()
+
+
+@app.after_request
+async def finish_request_metrics(response):
+    metrics.finish_request(request.method, metrics.endpoint_label(request), response.status_code)
+    response.headers['ngrok-skip-browser-warning'] = 'skip-browser-warning'
+    return response
+
+
+@app.after_serving
+async def dispose_async_engine():
+    await async_engine.dispose()
+
+
+async def iterate_in_thread(iterator):
+    """
+    Consume a blocking iterator (a repository generator holding a cursor) from a worker thread.
+    """
+    done = object()
+    while (item := await asyncio.to_thread(next, iterator, done)) is not done:
+        yield item
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_view():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/record', methods=['POST'])
+async def new_traffic_record():
+    try:
+        row = parse_record_body(await request.get_json())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if ingest_queue is not None:
+        try:
+            await asyncio.to_thread(ingest_queue.put, row)
+        except QueueFull as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": str(math.ceil(INGEST_FLUSH_INTERVAL))}
+        except OSError as e:
+            return jsonify({"error": f"Could not spool record: {e}"}), 503
+        return jsonify({"message": "Register queued"}), 202
+
+    try:
+        await async_repository.add_traffic_record(
+            device_id=row['traffic_cam_id'],
+            start_time=row['start_time'],
+            end_time=row['end_time'],
+            vehicle_count=row['vehicle_count'],
+            average_speed=row['average_speed']
+        )
+        return jsonify({"message": "Register received successfully"}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/records/batch', methods=['POST'])
+async def new_traffic_records_batch():
+    try:
+        rows, positions, errors = parse_batch_body(await request.get_json(silent=True))
+    except RequestError as e:
+        return jsonify({"error": str(e)}), e.status
+    try:
+        inserted, rejected = await async_repository.add_traffic_records(rows) if rows else (0, [])
+        return jsonify(batch_payload(inserted, rejected, positions, errors)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/ingest/stats', methods=['GET'])
+async def ingest_stats():
+    if ingest_queue is None:
+        return jsonify({"mode": INGEST_MODE}), 200
+    return jsonify({"mode": INGEST_MODE, **ingest_queue.stats()}), 200
+
+async def conditional_json(payload):
+    """
+    JSON response with a content-hash ETag, answered with 304 when the client already has it.
+    """
+    response = jsonify(payload)
+    await response.add_etag()
+    response.cache_control.no_cache = True
+    return await response.make_conditional(request)
+
+@app.route('/cities', methods=['GET'])
+async def available_cities():
+    try:
+        return await conditional_json({"cities": await asyncio.to_thread(repository.get_available_cities)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/cams', methods=['GET'])
+async def all_cams():
+    try:
+        return await conditional_json({"cams": await asyncio.to_thread(repository.get_cams)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/cams/near', methods=['GET'])
+async def cams_near():
+    try:
+        lat, lng, radius, limit = parse_near_args(request.args, SPATIAL_MAX_RADIUS_METERS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        cams = await asyncio.to_thread(repository.get_cams_near, lat, lng, radius, limit)
+        if parse_flag(request.args, 'include_state'):
+            cams = await asyncio.to_thread(repository.with_traffic_states, cams)
+        return jsonify({"cams": cams}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/cams/bbox', methods=['GET'])
+async def cams_in_bbox():
+    try:
+        bbox = parse_bbox_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        cams = await asyncio.to_thread(repository.get_cams_in_bbox, *bbox)
+        if parse_flag(request.args, 'include_state'):
+            cams = await asyncio.to_thread(repository.with_traffic_states, cams)
+        return jsonify({"cams": cams}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/cams/<string:city>', methods=['GET'])
+async def cams_by_city(city):
+    try:
+        return await conditional_json({"cams": await asyncio.to_thread(repository.get_cams, city)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/traffic_state/<int:traffic_cam_id>', methods=['GET'])
+async def traffic_state(traffic_cam_id):
+    try:
+        state = await async_repository.get_traffic_state(traffic_cam_id)
+        return jsonify({"traffic_state": state.name}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/traffic_state', methods=['GET'])
+async def traffic_state_snapshot():
+    try:
+        states = await asyncio.to_thread(repository.get_traffic_state_snapshot, request.args.get('city'))
+        return await conditional_json({"traffic_states": states})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/stream/traffic_state', methods=['GET'])
+async def stream_traffic_state():
+    city = request.args.get('city')
+    subscriber = broadcaster.subscribe(
+        AsyncSubscriber(repository.camera_filter(city), asyncio.get_running_loop()))
+    try:
+        cams = await asyncio.to_thread(repository.get_cams, city)
+        snapshot = await asyncio.to_thread(state_tracker.snapshot, [cam["id"] for cam in cams],
+                                           repository.load_camera_states)
+    except Exception as e:
+        broadcaster.unsubscribe(subscriber)
+        return jsonify({"error": str(e)}), 500
+    response = Response(async_stream_events(subscriber, snapshot), mimetype='text/event-stream',
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.timeout = None  # the stream stays open until the client leaves
+    return response
+
+@app.route('/stats', methods=['GET'])
+async def get_traffic_stats():
+    try:
+        start_datetime, end_datetime = parse_datetime_range(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        result = await asyncio.to_thread(repository.get_traffic_stats_in_range, start_datetime, end_datetime)
+        payload, status = stats_response(result)
+        return jsonify(payload), status
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/peak_hours', methods=['GET'])
+async def peak_hours():
+    try:
+        start_time, end_time = parse_datetime_range(request.args, 'start', 'end')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        return jsonify({"peak_hours": await asyncio.to_thread(repository.get_peak_hours, start_time, end_time)}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/congestion', methods=['GET'])
+async def get_congestion():
+    try:
+        traffic_cam_id, start_datetime, end_datetime, speed_threshold = parse_congestion_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    result = await asyncio.to_thread(
+        repository.get_speed_based_congestion,
+        traffic_cam_id,
+        start_datetime=start_datetime,
+        end_datetime=end_datetime,
+        speed_threshold=speed_threshold
+    )
+
+    return jsonify(result)
+
+@app.route('/congestion/ranking', methods=['GET'])
+async def congestion_ranking():
+    try:
+        start_datetime, end_datetime, speed_threshold, city = parse_ranking_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        ranking = await asyncio.to_thread(repository.get_congestion_ranking, start_datetime, end_datetime,
+                                          speed_threshold, city)
+        return jsonify({"ranking": ranking}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/traffic_records', methods=['GET'])
+async def get_traffic_records():
+    try:
+        start_datetime, end_datetime, cam_id, city = parse_records_args(request.args)
+        page = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if wants_ndjson(request):
+        batches = repository.iter_traffic_records(start_datetime, end_datetime, cam_id, city)
+        return Response(iterate_in_thread(stream_ndjson(batches)), mimetype='application/x-ndjson')
+
+    if page is not None:
+        records, next_key = await asyncio.to_thread(repository.get_traffic_records_page, start_datetime,
+                                                    end_datetime, *page, cam_id, city)
+        return jsonify(page_payload(records, next_key)), 200
+
+    traffic_records = await asyncio.to_thread(repository.get_traffic_records_in_range, start_datetime,
+                                              end_datetime, cam_id, city)
+    return jsonify(records_payload(traffic_records)), 200
+
+@app.route('/traffic_records/export', methods=['GET'])
+async def export_traffic_records():
+    try:
+        start_datetime, end_datetime, cam_id, city = parse_records_args(request.args)
+        export_format = parse_export_format(request.args)
+    except RequestError as e:
+        return jsonify({"error": str(e)}), e.status
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    batches = repository.iter_traffic_record_rows(start_datetime, end_datetime, cam_id, city, EXPORT_CHUNK_SIZE)
+    return Response(iterate_in_thread(EXPORTERS[export_format](batches)),
+                    mimetype=CONTENT_TYPES[export_format], headers=export_headers(export_format))
+
+@app.route('/traffic_jams', methods=['GET'])
+async def traffic_jams_in_range():
+    try:
+        start_datetime, end_datetime, cam_id, city = parse_range_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        traffic_jams = await asyncio.to_thread(repository.get_traffic_jams_in_range, start_datetime, end_datetime,
+                                               cam_id, city)
+        return jsonify(jams_payload(traffic_jams)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+async def analytics_response(key, compute, *extra):
+    """
+    Run an analytics.py computation over the dashboard range of the request.
+    """
+    try:
+        start_datetime, end_datetime, cam_id, city = parse_range_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        result = await asyncio.to_thread(compute, start_datetime, end_datetime, cam_id, city, *extra)
+        return jsonify({key: result}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/analytics/peak_hours', methods=['GET'])
+async def analytics_peak_hours():
+    return await analytics_response("peak_hours", get_peak_hours_vectorized)
+
+@app.route('/analytics/hourly_profile', methods=['GET'])
+async def analytics_hourly_profile():
+    return await analytics_response("hourly_profile", get_hourly_profile)
+
+@app.route('/analytics/weekly_profile', methods=['GET'])
+async def analytics_weekly_profile():
+    return await analytics_response("weekly_profile", get_weekly_profile)
+
+@app.route('/analytics/percentiles', methods=['GET'])
+async def analytics_percentiles():
+    try:
+        percentiles = parse_percentiles(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return await analytics_response("percentiles", get_camera_percentiles, percentiles)
+
+@app.route('/timeseries', methods=['GET'])
+async def timeseries():
+    try:
+        start_datetime, end_datetime, cam_id, city = parse_range_args(request.args)
+        points, resolution, downsample = parse_timeseries_args(request.args, DEFAULT_TIMESERIES_POINTS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        series = await asyncio.to_thread(get_timeseries, start_datetime, end_datetime, cam_id, city,
+                                         points, resolution, downsample)
+        return jsonify(series), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    create_tables()
+    app.run(host="localhost", port=5001, debug=True)
@@ -0,0 +1,115 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import wraps
+
+from sqlalchemy import desc, select
+
+from db.async_database import AsyncSessionLocal
+from db.config import BASELINE_BY_HOUR_OF_WEEK
+from db.entities import TrafficRecord, SpeedBaseline
+from repository import classify_speed, choose_speed_baseline, insert_traffic_records, notify_ingest
+
+# Async versions of the hot paths of repository.py (ingest and traffic state), used by async_main.py.
+# They share the SQL and the aggregate/jam logic of the sync repository; everything else the async
+# app serves goes through repository.py in a worker thread.
+
+
+@asynccontextmanager
+async def async_session_scope():
+    """
+    Provide a transactional scope around a series of async operations.
+    """
+    session = AsyncSessionLocal()
+    try:
+        yield session
+        await session.commit()
+    except:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
+
+def handle_async_exceptions(func):
+    """
+    handle_exceptions for coroutines.
+    """
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await func(*args, **kwargs)
+        except Exception as e:
+            print(f"Error in {func.__name__}: {e}")
+            raise
+
+    return wrapper
+
+
+# ========== Traffic state ==========
+
+async def latest_reading(traffic_cam_id):
+    async with async_session_scope() as session:
+        result = await session.execute(
+            select(TrafficRecord.start_time, TrafficRecord.average_speed)
+            .where(TrafficRecord.traffic_cam_id == traffic_cam_id)
+            .order_by(desc(TrafficRecord.end_time))
+            .limit(1)
+        )
+        return result.first()
+
+
+async def candidate_baselines(traffic_cam_id):
+    """
+    Every baseline the latest reading of a camera could be compared to, as {hour_of_week: SpeedBaseline}.
+    Loaded without knowing the reading's hour so it can run alongside latest_reading().
+    """
+    query = select(SpeedBaseline).where(SpeedBaseline.traffic_cam_id == traffic_cam_id)
+    if not BASELINE_BY_HOUR_OF_WEEK:
+        query = query.where(SpeedBaseline.hour_of_week == SpeedBaseline.ALL_HOURS)
+    async with async_session_scope() as session:
+        return {b.hour_of_week: b for b in await session.scalars(query)}
+
+
+@handle_async_exceptions
+async def get_traffic_state(traffic_cam_id):
+    """
+    Same as repository.get_traffic_state, running the reading and baseline queries concurrently
+    on two pooled connections.
+    """
+    latest, baselines = await asyncio.gather(latest_reading(traffic_cam_id), candidate_baselines(traffic_cam_id))
+    baseline = choose_speed_baseline(baselines, latest.start_time if latest else None)
+    avg_speed = baseline.mean if baseline else 0
+    current_speed = latest.average_speed if latest else 0
+    return classify_speed(current_speed, avg_speed)
+
+
+# ========== Ingest ==========
+
+@handle_async_exceptions
+async def add_traffic_records(rows: list):
+    """
+    Same as repository.add_traffic_records, on the async engine.
+    Returns the number of inserted rows and a list of (position, error) for skipped rows.
+    """
+    async with async_session_scope() as session:
+        valid_rows, rejected, alerts, ended = await session.run_sync(insert_traffic_records, rows)
+    # listeners are plain functions and may touch the sync engine (metadata cache reloads)
+    await asyncio.to_thread(notify_ingest, valid_rows, alerts, ended)
+    return len(valid_rows), rejected
+
+
+@handle_async_exceptions
+async def add_traffic_record(device_id: int, start_time: datetime, end_time: datetime, vehicle_count: int,
+                             average_speed: float):
+    inserted, rejected = await add_traffic_records([{
+        "traffic_cam_id": device_id,
+        "start_time": start_time,
+        "end_time": end_time,
+        "vehicle_count": vehicle_count,
+        "average_speed": average_speed,
+    }])
+    if rejected:
+        raise ValueError(rejected[0][1])
+    return inserted == 1
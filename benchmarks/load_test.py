@@ -0,0 +1,288 @@
+"""
+Load generation and latency benchmark for the ingest and dashboard endpoints.
+
+Starts the Flask app on a local port against a throwaway SQLite database, seeds it with
+history, then runs simulated cameras posting to /record while dashboard clients query the
+read endpoints. Prints throughput and p50/p95/p99 latency per endpoint and saves the run
+to JSON so results can be compared across commits.
+
+    python benchmarks/load_test.py --cams 200 --days 30 --duration 60 --output bench.json
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import http.client
+import json
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cams", type=int, default=50, help="number of simulated cameras")
+    parser.add_argument("--cities", type=int, default=3, help="number of cities cameras are spread over")
+    parser.add_argument("--days", type=int, default=7, help="days of history seeded before the run")
+    parser.add_argument("--record-minutes", type=int, default=5, help="minutes covered by each record")
+    parser.add_argument("--camera-interval", type=float, default=1.0,
+                        help="seconds between two posts of the same camera during the run")
+    parser.add_argument("--ingest-workers", type=int, default=8, help="threads posting camera records")
+    parser.add_argument("--dashboard-clients", type=int, default=4, help="threads querying read endpoints")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds the load runs")
+    parser.add_argument("--db", help="SQLite file to use (default: a temporary file)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write results to this JSON file")
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    """
+    Point the app at a local SQLite file before it is imported.
+    """
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="traffic-bench-"), "bench.db")
+    os.environ.update(DB_BACKEND="sqlite", SQLITE_PATH=path, DB_ECHO="false", INGEST_MODE="sync")
+    return path
+
+
+def seed(args, rng):
+    """
+    Create the cameras and `days` of history ending now.
+    Returns (camera ids, cities, history start, history end, seeded record count).
+    """
+    from db.database import SessionLocal, create_tables
+    from db.entities import TrafficCam
+    from repository import add_traffic_records
+
+    create_tables()
+    cities = [f"City {i}" for i in range(args.cities)]
+    with SessionLocal() as session:
+        cams = [
+            TrafficCam(location_lat=22.2 + rng.random() / 10, location_lng=-97.9 + rng.random() / 10,
+                       alias=f"Bench cam {i}", city=cities[i % len(cities)])
+            for i in range(args.cams)
+        ]
+        session.add_all(cams)
+        session.commit()
+        cam_ids = [cam.id for cam in cams]
+
+    end = datetime.now().replace(second=0, microsecond=0)
+    start = end - timedelta(days=args.days)
+    step = timedelta(minutes=args.record_minutes)
+    rows, total = [], 0
+    moment = start
+    while moment < end:
+        for cam_id in cam_ids:
+            rows.append({
+                "traffic_cam_id": cam_id,
+                "start_time": moment,
+                "end_time": moment + step,
+                "vehicle_count": rng.randint(0, 60),
+                "average_speed": round(rng.uniform(5, 80), 2),
+            })
+        if len(rows) >= 5000:
+            total += add_traffic_records(rows)[0]
+            rows = []
+        moment += step
+    if rows:
+        total += add_traffic_records(rows)[0]
+    return cam_ids, cities, start, end, total
+
+
+def start_server():
+    """
+    Serve the Flask app with a threaded WSGI server on a free local port.
+    """
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    from main import app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Recorder:
+    """Collects per-endpoint latencies from every client thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, endpoint, seconds, ok):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Client:
+    """Keep-alive HTTP client timing every request it sends."""
+
+    def __init__(self, port, recorder):
+        self.connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        self.recorder = recorder
+
+    def request(self, endpoint, method, path, body=None):
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        started = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+            ok = response.status < 500
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            ok = False
+        self.recorder.record(endpoint, time.perf_counter() - started, ok)
+
+
+def camera_worker(port, recorder, cam_ids, args, stop, rng):
+    """
+    Post one record per camera every `camera_interval` seconds for the cameras of this worker.
+    """
+    client = Client(port, recorder)
+    step = timedelta(minutes=args.record_minutes)
+    moment = datetime.now().replace(microsecond=0)
+    while not stop.is_set():
+        round_started = time.perf_counter()
+        for cam_id in cam_ids:
+            payload = {
+                "traffic_cam_id": cam_id,
+                "start_datetime": moment.isoformat(),
+                "end_datetime": (moment + step).isoformat(),
+                "vehicle_count": rng.randint(0, 60),
+                "average_speed": round(rng.uniform(5, 80), 2),
+            }
+            client.request("POST /record", "POST", "/record", json.dumps(payload))
+            if stop.is_set():
+                return
+        moment += step
+        remaining = args.camera_interval - (time.perf_counter() - round_started)
+        if remaining > 0:
+            stop.wait(remaining)
+
+
+def dashboard_worker(port, recorder, cam_ids, cities, history_start, history_end, stop, rng):
+    """
+    Query random read endpoints over random windows of the seeded history.
+    """
+    client = Client(port, recorder)
+    fmt = "%Y-%m-%dT%H:%M:%S"
+    span = (history_end - history_start).total_seconds()
+    while not stop.is_set():
+        window = timedelta(hours=rng.choice([1, 6, 24, 24 * 7]))
+        start = history_start + timedelta(seconds=rng.uniform(0, max(span - window.total_seconds(), 0)))
+        end = min(start + window, history_end)
+        cam_id, city = rng.choice(cam_ids), rng.choice(cities)
+        iso_range = f"start_datetime={start.strftime(fmt)}&end_datetime={end.strftime(fmt)}"
+        sql_range = (f"start_datetime={start.strftime('%Y-%m-%d+%H:%M:%S')}"
+                     f"&end_datetime={end.strftime('%Y-%m-%d+%H:%M:%S')}")
+        endpoint, path = rng.choice([
+            ("GET /stats", f"/stats?{iso_range}"),
+            ("GET /peak_hours", f"/peak_hours?start={start.strftime(fmt)}&end={end.strftime(fmt)}"),
+            ("GET /traffic_records", f"/traffic_records?{sql_range}&cam_id={cam_id}"),
+            ("GET /congestion", f"/congestion?traffic_cam_id={cam_id}&{iso_range}"),
+            ("GET /traffic_state", f"/traffic_state/{cam_id}"),
+            ("GET /cams", f"/cams/{city.replace(' ', '%20')}"),
+        ])
+        client.request(endpoint, "GET", path)
+
+
+def summarize(recorder, duration):
+    summary = {}
+    for endpoint, values in sorted(recorder.latencies.items()):
+        values = sorted(values)
+        summary[endpoint] = {
+            "requests": len(values),
+            "errors": recorder.errors[endpoint],
+            "throughput_rps": round(len(values) / duration, 2),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+        }
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(__file__), text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    db_path = configure_environment(args)
+
+    print(f"Seeding {args.cams} cameras with {args.days} days of history into {db_path}...")
+    started = time.perf_counter()
+    cam_ids, cities, history_start, history_end, seeded = seed(args, rng)
+    print(f"Seeded {seeded} records in {time.perf_counter() - started:.1f}s")
+
+    server = start_server()
+    recorder = Recorder()
+    stop = threading.Event()
+    threads = []
+    workers = max(1, min(args.ingest_workers, len(cam_ids)))
+    for i in range(workers):
+        threads.append(threading.Thread(
+            target=camera_worker,
+            args=(server.port, recorder, cam_ids[i::workers], args, stop, random.Random(args.seed + i))))
+    for i in range(args.dashboard_clients):
+        threads.append(threading.Thread(
+            target=dashboard_worker,
+            args=(server.port, recorder, cam_ids, cities, history_start, history_end, stop,
+                  random.Random(args.seed + 1000 + i))))
+
+    print(f"Running load for {args.duration:.0f}s...")
+    run_started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - run_started
+    server.shutdown()
+
+    summary = summarize(recorder, elapsed)
+    print(f"\n{'endpoint':<24}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, stats in summary.items():
+        print(f"{endpoint:<24}{stats['requests']:>10}{stats['errors']:>8}{stats['throughput_rps']:>10}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+
+    if args.output:
+        result = {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "parameters": vars(args),
+            "seeded_records": seeded,
+            "duration_s": round(elapsed, 3),
+            "endpoints": summary,
+        }
+        with open(args.output, "w") as output:
+            json.dump(result, output, indent=2)
+        print(f"\nSaved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Microbenchmark of the /traffic_records, /traffic_jams and /cams read paths.
+
+Runs each endpoint against a SQLite database both through the app and through a reference
+copy of the ORM implementation it replaced (full TrafficRecord/TrafficCam objects, strftime
+per row, Flask's standard library JSON encoding). Checks that both produce the same bytes
+and prints the best time of each over a few repetitions.
+
+    python db/populate.py --cams 600 --cities 3 --days 14   # with DB_BACKEND=sqlite SQLITE_PATH=bench.db
+    python benchmarks/read_paths.py --db bench.db --hours 24
+
+Without --db, a temporary database is populated first with --cams and --days.
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import subprocess
+import tempfile
+import time
+from datetime import timedelta
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="populated SQLite file to read (default: populate a temporary one)")
+    parser.add_argument("--cams", type=int, default=300, help="cameras of the temporary database")
+    parser.add_argument("--days", type=float, default=3, help="days of history of the temporary database")
+    parser.add_argument("--hours", type=float, default=24, help="length of the queried range, ending at the newest record")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per endpoint, the best one is reported")
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    """
+    Point the app at the SQLite file before it is imported, with the result cache off so every
+    run reads the database.
+    """
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="traffic-bench-"), "bench.db")
+    os.environ.update(DB_BACKEND="sqlite", SQLITE_PATH=path, DB_ECHO="false", INGEST_MODE="sync",
+                      RESULT_CACHE_MAX_BYTES="0", NOTIFY_SENDER="none")
+    if not args.db:
+        print(f"Populating {path}...")
+        script = os.path.join(os.path.dirname(__file__), "..", "db", "populate.py")
+        subprocess.run([sys.executable, script, "--cams", str(args.cams), "--days", str(args.days)],
+                       check=True, stdout=subprocess.DEVNULL)
+    return path
+
+
+# ================ Reference implementation ================
+
+def orm_traffic_records(start_datetime, end_datetime, city=None):
+    from sqlalchemy.orm import joinedload
+    from db.entities import TrafficRecord, TrafficCam
+    from repository import session_scope, apply_date_range
+
+    with session_scope() as session:
+        query = session.query(TrafficRecord)
+        query = query.join(TrafficCam).options(joinedload(TrafficRecord.traffic_cam))
+        query = apply_date_range(query, start_datetime, end_datetime)
+        if city is not None:
+            query = query.filter(TrafficCam.city == city)
+        return [
+            {
+                "traffic_cam_id": rec.traffic_cam_id,
+                "start_datetime": rec.start_time.strftime('%Y-%m-%d %H:%M:%S'),
+                "end_datetime": rec.end_time.strftime('%Y-%m-%d %H:%M:%S'),
+                "vehicle_count": rec.vehicle_count,
+                "average_speed": rec.average_speed,
+                "alias": rec.traffic_cam.alias
+            }
+            for rec in query.all()
+        ]
+
+
+def orm_traffic_jams(start_datetime, end_datetime):
+    from sqlalchemy import or_
+    from db.entities import TrafficJamAlert
+    from repository import session_scope
+
+    with session_scope() as session:
+        query = session.query(TrafficJamAlert).filter(
+            TrafficJamAlert.event_time <= end_datetime,
+            or_(TrafficJamAlert.ended_at.is_(None), TrafficJamAlert.ended_at >= start_datetime)
+        )
+        return [
+            {
+                "traffic_cam_id": alert.traffic_cam_id,
+                "event_time": alert.event_time.strftime('%Y-%m-%d %H:%M:%S'),
+                "ended_at": alert.ended_at.strftime('%Y-%m-%d %H:%M:%S') if alert.ended_at else None
+            }
+            for alert in query.all()
+        ]
+
+
+def orm_cams():
+    from db.entities import TrafficCam
+    from repository import session_scope
+
+    with session_scope() as session:
+        return [
+            {
+                "id": cam.id,
+                "alias": cam.alias,
+                "city": cam.city,
+                "latitude": float(cam.location_lat),
+                "longitude": float(cam.location_lng)
+            }
+            for cam in session.query(TrafficCam).order_by(TrafficCam.id)
+        ]
+
+
+def stdlib_json(payload):
+    """
+    What jsonify wrote with Flask's default provider outside debug mode.
+    """
+    import json
+    from flask.json.provider import _default
+    return (json.dumps(payload, default=_default, ensure_ascii=True, sort_keys=True, separators=(",", ":"))
+            + "\n").encode()
+
+
+# ================ Benchmark ================
+
+def best_time(func, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    args = parse_args()
+    configure_environment(args)
+
+    from sqlalchemy import func
+    from db.entities import TrafficRecord, TrafficCam
+    from main import app
+    from repository import session_scope, invalidate_metadata_cache
+
+    with session_scope() as session:
+        newest = session.query(func.max(TrafficRecord.end_time)).scalar()
+        city = session.query(TrafficCam.city).order_by(TrafficCam.id).limit(1).scalar()
+    if newest is None:
+        sys.exit("The database has no traffic records")
+    start, end = newest - timedelta(hours=args.hours), newest
+    window = f"start_datetime={start:%Y-%m-%d %H:%M:%S}&end_datetime={end:%Y-%m-%d %H:%M:%S}"
+
+    def traffic_records_payload(records):
+        if not records:
+            return {"message": "No traffic records found in the given range"}
+        return {"traffic_records": records}
+
+    cases = [
+        (f"/traffic_records?{window}",
+         lambda: traffic_records_payload(orm_traffic_records(start, end))),
+        (f"/traffic_records?{window}&city={city}",
+         lambda: traffic_records_payload(orm_traffic_records(start, end, city))),
+        (f"/traffic_jams?{window}",
+         lambda: {"traffic_jams": orm_traffic_jams(start, end)}),
+        ("/cams",
+         lambda: {"cams": orm_cams()}),
+    ]
+
+    client = app.test_client()
+    print(f"Range {start} - {end}, city {city}")
+    print(f"{'endpoint':<28} {'bytes':>11} {'reference':>11} {'current':>11} {'speedup':>8}  same output")
+    mismatches = 0
+    for path, reference in cases:
+        def current():
+            invalidate_metadata_cache()
+            return client.get(path.replace(" ", "%20")).get_data()
+
+        reference_time, expected = best_time(lambda: stdlib_json(reference()), args.repeat)
+        current_time, body = best_time(current, args.repeat)
+        same = body == expected
+        mismatches += not same
+        print(f"{path.split('?')[0] + (' (city)' if 'city=' in path else ''):<28} {len(body):>11,} "
+              f"{reference_time * 1000:>9.1f}ms {current_time * 1000:>9.1f}ms "
+              f"{reference_time / current_time:>7.1f}x  {'yes' if same else 'NO'}")
+    if mismatches:
+        sys.exit(f"{mismatches} endpoint(s) changed their output")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from db.config import (DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME, DB_BACKEND, SQLITE_PATH,
+                       DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_ECHO)
+
+# Async counterpart of db/database.py, used by the asyncio app (async_main.py).
+# Same database and pool settings, with aiosqlite / aiomysql as drivers.
+
+if DB_BACKEND == "sqlite":
+    ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{SQLITE_PATH}"
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=DB_ECHO, connect_args={"timeout": 30})
+
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+else:
+    ASYNC_DATABASE_URL = f"mysql+aiomysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=DB_ECHO,
+                                       pool_size=DB_POOL_SIZE,
+                                       max_overflow=DB_MAX_OVERFLOW,
+                                       pool_recycle=DB_POOL_RECYCLE,
+                                       pool_pre_ping=DB_POOL_PRE_PING)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
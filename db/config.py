@@ -9,3 +9,75 @@ DB_PASSWORD = os.getenv("DB_PASSWORD", "fallback_password")
 DB_HOST     = os.getenv("DB_HOST", "localhost")
 DB_PORT     = os.getenv("DB_PORT", "3306")
 DB_NAME     = os.getenv("DB_NAME", "traffic_detection")
+
+# storage backend: "mysql" or "sqlite" (single file in WAL mode, for edge boxes and benchmarks)
+DB_BACKEND  = os.getenv("DB_BACKEND") or "mysql"
+SQLITE_PATH = os.getenv("SQLITE_PATH") or "traffic_detection.db"
+
+# connection pool (MySQL)
+DB_POOL_SIZE     = int(os.getenv("DB_POOL_SIZE") or 5)
+DB_MAX_OVERFLOW  = int(os.getenv("DB_MAX_OVERFLOW") or 10)
+DB_POOL_RECYCLE  = int(os.getenv("DB_POOL_RECYCLE") or 3600)
+DB_POOL_PRE_PING = (os.getenv("DB_POOL_PRE_PING") or "true").lower() == "true"
+DB_ECHO          = (os.getenv("DB_ECHO") or "false").lower() == "true"
+
+# traffic state classification
+# compare against the camera's hour-of-week baseline once it has enough samples
+BASELINE_BY_HOUR_OF_WEEK = (os.getenv("BASELINE_BY_HOUR_OF_WEEK") or "false").lower() == "true"
+BASELINE_MIN_HOUR_SAMPLES = int(os.getenv("BASELINE_MIN_HOUR_SAMPLES") or 30)
+
+# ingest mode: "sync" writes each record before answering, "queued" answers 202
+# right away and writes in the background from an on-disk spool
+INGEST_MODE = os.getenv("INGEST_MODE") or "sync"
+INGEST_SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR") or "spool"
+INGEST_FLUSH_SIZE = int(os.getenv("INGEST_FLUSH_SIZE") or 500)
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL") or 1.0)
+INGEST_SPOOL_FSYNC = (os.getenv("INGEST_SPOOL_FSYNC") or "true").lower() == "true"
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS") or 8)
+INGEST_MAX_BACKLOG = int(os.getenv("INGEST_MAX_BACKLOG") or 100000)
+
+# seconds camera/city metadata is served from memory before being reloaded
+METADATA_CACHE_TTL = float(os.getenv("METADATA_CACHE_TTL") or 300)
+
+# dashboard range queries whose bounds are multiples of RESULT_CACHE_GRANULARITY seconds (0: all
+# of them) are cached for RESULT_CACHE_TTL seconds in an LRU capped at RESULT_CACHE_MAX_BYTES
+# (0 disables the cache). RESULT_CACHE_TTL bounds how stale a result can be after another app
+# process ingested records it covers
+RESULT_CACHE_GRANULARITY = int(os.getenv("RESULT_CACHE_GRANULARITY") or 60)
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES") or 64 * 1024 * 1024)
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL") or 60)
+
+# statements slower than this are logged and counted on /metrics
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS") or 200)
+
+# jam detection: a camera enters a jam once its speed drops to JAM_ENTER_RATIO of its baseline
+# for at least JAM_MIN_DURATION_SECONDS, and leaves it when speed recovers to JAM_EXIT_RATIO
+JAM_ENTER_RATIO = float(os.getenv("JAM_ENTER_RATIO") or 0.2)
+JAM_EXIT_RATIO = float(os.getenv("JAM_EXIT_RATIO") or 0.5)
+JAM_MIN_DURATION_SECONDS = int(os.getenv("JAM_MIN_DURATION_SECONDS") or 600)
+
+# jam notifications: sender is "log", "telegram" (needs TELEGRAM_BOT_TOKEN) or "none" to leave
+# the outbox to another process; delivery is capped at NOTIFY_RATE_PER_SECOND messages
+NOTIFY_SENDER = os.getenv("NOTIFY_SENDER") or "log"
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+NOTIFY_RATE_PER_SECOND = float(os.getenv("NOTIFY_RATE_PER_SECOND") or 30)
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE") or 100)
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS") or 5)
+NOTIFY_POLL_INTERVAL = float(os.getenv("NOTIFY_POLL_INTERVAL") or 1.0)
+
+# retention: raw records older than this many days are downsampled to hourly records
+RAW_RECORD_RETENTION_DAYS = int(os.getenv("RAW_RECORD_RETENTION_DAYS") or 90)
+
+# camera proximity queries: size in degrees of the spatial grid cells, and the largest
+# radius /cams/near accepts
+SPATIAL_CELL_DEGREES = float(os.getenv("SPATIAL_CELL_DEGREES") or 0.01)
+SPATIAL_MAX_RADIUS_METERS = float(os.getenv("SPATIAL_MAX_RADIUS_METERS") or 50000)
+
+# live traffic state stream: events buffered per client (one per camera) before a slow client
+# is dropped, and seconds between keep-alive comments
+LIVE_CLIENT_BUFFER = int(os.getenv("LIVE_CLIENT_BUFFER") or 1000)
+LIVE_KEEPALIVE_SECONDS = float(os.getenv("LIVE_KEEPALIVE_SECONDS") or 15)
+
+# seconds a camera's in-memory latest state is trusted without an ingest through this process
+# refreshing it, before it is read again from the database
+STATE_SNAPSHOT_TTL = float(os.getenv("STATE_SNAPSHOT_TTL") or 30)
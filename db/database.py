@@ -1,12 +1,30 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-from db.config import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME
+from db.config import (DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME, DB_BACKEND, SQLITE_PATH,
+                       DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_ECHO)
 
-DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+if DB_BACKEND == "sqlite":
+    DATABASE_URL = f"sqlite:///{SQLITE_PATH}"
+    db_engine = create_engine(DATABASE_URL, echo=DB_ECHO,
+                              connect_args={"check_same_thread": False, "timeout": 30})
 
-db_engine = create_engine(DATABASE_URL, echo=True)
+    @event.listens_for(db_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers run while the ingest path writes
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+else:
+    DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    db_engine = create_engine(DATABASE_URL, echo=DB_ECHO,
+                              pool_size=DB_POOL_SIZE,
+                              max_overflow=DB_MAX_OVERFLOW,
+                              pool_recycle=DB_POOL_RECYCLE,
+                              pool_pre_ping=DB_POOL_PRE_PING)
 
 # Base class for declarative entities (the ones from entities.py)
 Base = declarative_base()
@@ -0,0 +1,109 @@
+# SQL expressions that differ between the supported backends (MySQL and SQLite)
+from sqlalchemy import Date, Integer, cast, func, literal, literal_column, type_coerce
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import UnaryExpression
+
+from db.config import DB_BACKEND
+
+SQLITE = DB_BACKEND == "sqlite"
+
+
+def upsert(model, rows, merge):
+    """
+    INSERT `rows` into `model`, resolving primary key conflicts with an update.
+    `merge(incoming)` returns {column name: expression}, where `incoming.<column>` refers to the
+    value the conflicting row tried to insert.
+    """
+    if SQLITE:
+        stmt = sqlite_insert(model).values(rows)
+        keys = [column.name for column in model.__table__.primary_key]
+        return stmt.on_conflict_do_update(index_elements=keys, set_=merge(stmt.excluded))
+    stmt = mysql_insert(model).values(rows)
+    return stmt.on_duplicate_key_update(**merge(stmt.inserted))
+
+
+def insert_new(model, unique_columns):
+    """
+    INSERT into `model` that skips, in the same statement, the rows whose `unique_columns` match a
+    stored row.
+    """
+    if SQLITE:
+        return sqlite_insert(model).on_conflict_do_nothing(index_elements=unique_columns)
+    # a no-op update rather than IGNORE, which would also turn other row errors into warnings
+    return mysql_insert(model).on_duplicate_key_update(id=model.id)
+
+
+def greatest(a, b):
+    return func.max(a, b) if SQLITE else func.greatest(a, b)
+
+
+def least(a, b):
+    return func.min(a, b) if SQLITE else func.least(a, b)
+
+
+def date_of(column):
+    """
+    Calendar date of a datetime column, returned as a datetime.date by both backends.
+    """
+    return type_coerce(func.date(column), Date)
+
+
+def hour_of(column):
+    if SQLITE:
+        return cast(func.strftime("%H", column), Integer)
+    return func.hour(column)
+
+
+def hour_of_week(column):
+    """
+    Hour of the week of a datetime column, 0 being Monday 00h.
+    """
+    if SQLITE:
+        # %w counts from Sunday = 0
+        weekday = (cast(func.strftime("%w", column), Integer) + 6) % 7
+    else:
+        weekday = func.weekday(column)
+    return weekday * 24 + hour_of(column)
+
+
+def hour_floor(column):
+    """
+    A datetime column truncated to the hour, in the backend's native datetime storage format.
+    """
+    if SQLITE:
+        # SQLAlchemy stores SQLite datetimes with microseconds; keep keys comparable
+        return func.strftime("%Y-%m-%d %H:00:00.000000", column)
+    return func.date_format(column, "%Y-%m-%d %H:00:00")
+
+
+def epoch_seconds(column):
+    """
+    Seconds from 1970-01-01 00:00 to a datetime column, taking stored datetimes as naive
+    (no time zone conversion on either backend).
+    """
+    if SQLITE:
+        return cast(func.strftime("%s", column), Integer)
+    return func.timestampdiff(literal_column("SECOND"), literal("1970-01-01 00:00:00"), column)
+
+
+def format_datetime(column):
+    """
+    A datetime column as a 'YYYY-MM-DD HH:MM:SS' string (NULL stays NULL), formatted by the
+    database so result rows skip datetime parsing and strftime.
+    """
+    if SQLITE:
+        return func.strftime("%Y-%m-%d %H:%M:%S", column)
+    return func.date_format(column, "%Y-%m-%d %H:%i:%s")
+
+
+def unindexed(column):
+    """
+    `column` with a unary + on SQLite, which keeps its planner from using an index on it. Without
+    range statistics SQLite may pick a wide range on this column over a narrow one on another;
+    MySQL estimates both ranges and gets the column as is.
+    """
+    if SQLITE:
+        return UnaryExpression(column, operator=operators.custom_op("+"), type_=column.type)
+    return column
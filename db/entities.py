@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Numeric, Index
+from sqlalchemy import Column, Integer, String, Float, Double, DateTime, ForeignKey, Numeric, Index
 from sqlalchemy.orm import relationship
 
 from db.database import Base
@@ -19,6 +19,10 @@ class TrafficCam(Base):
     traffic_records = relationship("TrafficRecord", back_populates="traffic_cam")
     traffic_jam_alerts = relationship("TrafficJamAlert", back_populates="traffic_cam")
 
+    __table_args__ = (
+        Index("ix_traffic_cams_city", "city"),
+    )
+
     def __repr__(self):
         # unambiguous representation, good for debugging
         return (f"<TrafficCam(id={self.id!r}, alias={self.alias!r}, "
@@ -39,17 +43,82 @@ class TrafficRecord(Base):
 
     traffic_cam = relationship("TrafficCam", back_populates="traffic_records")
 
+    __table_args__ = (
+        # latest record of a camera (traffic state)
+        Index("ix_traffic_records_cam_end", "traffic_cam_id", "end_time"),
+        # range scans over every camera or a whole city
+        Index("ix_traffic_records_start_end", "start_time", "end_time"),
+        # keyset pagination of /traffic_records
+        Index("ix_traffic_records_start_id", "start_time", "id"),
+        # one record per camera and period: devices resend records whose upload timed out.
+        # Also serves the range scans of one camera (stats, peak hours, congestion, records)
+        Index("uq_traffic_records_cam_start_end", "traffic_cam_id", "start_time", "end_time", unique=True),
+    )
+
 
 class TrafficJamAlert(Base):
-    """Marks when a traffic jam was detected at a given location at a certain time."""
+    """One traffic jam episode at a given location, from when it started until it cleared."""
     __tablename__ = "traffic_jam_alerts"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     traffic_cam_id = Column(Integer, ForeignKey("traffic_cams.id"), nullable=False)
-    event_time = Column(DateTime, nullable=False)
+    event_time = Column(DateTime, nullable=False, comment="When the jam started")
+    ended_at = Column(DateTime, nullable=True, comment="When the jam cleared, NULL while ongoing")
 
     traffic_cam = relationship("TrafficCam", back_populates="traffic_jam_alerts")
 
+    __table_args__ = (
+        Index("ix_traffic_jam_alerts_event_time", "event_time"),
+        Index("ix_traffic_jam_alerts_cam_event", "traffic_cam_id", "event_time"),
+        # episodes overlapping a range: ongoing ones and those ending after its start
+        Index("ix_traffic_jam_alerts_ended_at", "ended_at"),
+        Index("ix_traffic_jam_alerts_cam_ended", "traffic_cam_id", "ended_at"),
+    )
+
+
+class SpeedBaseline(Base):
+    """Running speed statistics of a camera, used as the reference to classify its traffic state."""
+    __tablename__ = "speed_baselines"
+
+    # Overall baseline of a camera, as opposed to one hour-of-week bucket
+    ALL_HOURS = -1
+
+    traffic_cam_id = Column(Integer, ForeignKey("traffic_cams.id"), primary_key=True)
+    hour_of_week = Column(Integer, primary_key=True, autoincrement=False,
+                          comment="0-167 starting Monday 00h, -1 for all hours")
+    sample_count = Column(Integer, nullable=False, default=0)
+    speed_sum = Column(Double, nullable=False, default=0)
+    speed_sq_sum = Column(Double, nullable=False, default=0)
+
+    @property
+    def mean(self):
+        return self.speed_sum / self.sample_count if self.sample_count else 0
+
+    @property
+    def stddev(self):
+        if not self.sample_count:
+            return 0
+        variance = self.speed_sq_sum / self.sample_count - self.mean ** 2
+        return max(variance, 0) ** 0.5
+
+
+class TrafficHourlyRollup(Base):
+    """Pre-aggregated traffic_records of a camera for one hour, bucketed by record start time."""
+    __tablename__ = "traffic_hourly_rollups"
+
+    traffic_cam_id = Column(Integer, ForeignKey("traffic_cams.id"), primary_key=True)
+    hour_start = Column(DateTime, primary_key=True)
+    vehicle_sum = Column(Integer, nullable=False, default=0)
+    speed_sum = Column(Double, nullable=False, default=0)
+    speed_count = Column(Integer, nullable=False, default=0)
+    speed_min = Column(Float, nullable=False)
+    speed_max = Column(Float, nullable=False)
+
+    __table_args__ = (
+        # the primary key covers one camera; this one covers every camera or a whole city
+        Index("ix_traffic_hourly_rollups_hour", "hour_start"),
+    )
+
 
 # ================ Telegram ================
 class TelegramBotUser(Base):
@@ -70,3 +139,37 @@ class Subscription(Base):
 
     bot_user = relationship("TelegramBotUser", back_populates="subscriptions")
     traffic_cam = relationship("TrafficCam", back_populates="subscriptions")
+
+
+class NotificationOutbox(Base):
+    """A jam notification for one subscriber, written with the alert and delivered by the dispatcher."""
+    __tablename__ = "notification_outbox"
+
+    JAM_STARTED = "jam_started"
+    JAM_ENDED = "jam_ended"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("bot_users.user_id"), nullable=False)
+    traffic_cam_id = Column(Integer, ForeignKey("traffic_cams.id"), nullable=False)
+    alert_id = Column(Integer, ForeignKey("traffic_jam_alerts.id"), nullable=False)
+    kind = Column(String(16), nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    claimed_at = Column(DateTime, nullable=True, comment="Set while a dispatcher is sending it")
+    sent_at = Column(DateTime, nullable=True)
+    last_error = Column(String(255), nullable=True)
+
+    __table_args__ = (
+        # the dispatcher scans unsent rows that are due
+        Index("ix_notification_outbox_pending", "sent_at", "next_attempt_at"),
+    )
+
+
+# ================ Caching ================
+class CacheGeneration(Base):
+    """Counter bumped by bulk data changes, telling every app process to drop its cached results."""
+    __tablename__ = "cache_generations"
+
+    name = Column(String(64), primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
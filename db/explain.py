@@ -0,0 +1,96 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from db.database import SessionLocal, db_engine
+from db.dialect import SQLITE
+from db.entities import TrafficCam
+import repository
+
+
+def capture_statements(fn, *args, **kwargs):
+    """
+    Run a repository function and return every SELECT it sent to the database.
+    """
+    captured = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((statement, parameters))
+
+    event.listen(db_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        fn(*args, **kwargs)
+    finally:
+        event.remove(db_engine, "before_cursor_execute", before_cursor_execute)
+    return captured
+
+
+def explain(statement, parameters):
+    """
+    Return the plan of a statement as a list of (description, is_full_scan) pairs.
+    """
+    with db_engine.connect() as conn:
+        if SQLITE:
+            result = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            return [
+                (row.detail, row.detail.startswith("SCAN") and "INDEX" not in row.detail)
+                for row in result
+            ]
+        result = conn.exec_driver_sql(f"EXPLAIN {statement}", parameters)
+        return [
+            (f"table={row.table} type={row.type} key={row.key} rows={row.rows} extra={row.Extra}",
+             row.type == "ALL")
+            for row in result
+        ]
+
+
+def print_plan(name, fn, *args, **kwargs):
+    print(f"\n=== {name}")
+    full_scans = 0
+    for statement, parameters in capture_statements(fn, *args, **kwargs):
+        print(" ".join(statement.split()))
+        for description, scan in explain(statement, parameters):
+            full_scans += scan
+            print(f"  {'FULL SCAN ' if scan else ''}{description}")
+    return full_scans
+
+
+def main():
+    with SessionLocal() as session:
+        cam = session.query(TrafficCam).first()
+    if cam is None:
+        print("No traffic cameras found, populate the database first.")
+        return
+
+    end = datetime.now()
+    start = end - timedelta(days=30)
+    queries = [
+        ("load_cams", repository.load_cams),
+        ("get_traffic_state", repository.get_traffic_state, cam.id),
+        ("get_traffic_stats_in_range", repository.get_traffic_stats_in_range, start, end),
+        ("get_traffic_stats_in_range(cam)", repository.get_traffic_stats_in_range, start, end, cam.id),
+        ("get_traffic_stats_in_range(city)", repository.get_traffic_stats_in_range, start, end, None, cam.city),
+        ("get_peak_hours", repository.get_peak_hours, start, end),
+        ("get_peak_hours(cam)", repository.get_peak_hours, start, end, cam.id),
+        ("get_speed_based_congestion(cam)", repository.get_speed_based_congestion, cam.id, start, end),
+        ("get_speed_based_congestion(city)", repository.get_speed_based_congestion, None, start, end, 10, cam.city),
+        ("get_traffic_records_in_range", repository.get_traffic_records_in_range, start, end),
+        ("get_traffic_records_in_range(cam)", repository.get_traffic_records_in_range, start, end, cam.id),
+        ("get_traffic_jams_in_range", repository.get_traffic_jams_in_range, start, end),
+        ("get_traffic_jams_in_range(cam)", repository.get_traffic_jams_in_range, start, end, cam.id),
+    ]
+    full_scans = {name: print_plan(name, fn, *args) for name, fn, *args in queries}
+
+    print("\n=== Summary")
+    for name, scans in full_scans.items():
+        print(f"  {name}: {'OK' if not scans else f'{scans} full table scan(s)'}")
+
+
+if __name__ == "__main__":
+    main()
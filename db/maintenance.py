@@ -0,0 +1,84 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+import argparse
+from datetime import timedelta
+
+from dateutil import parser as date_parser
+
+from db.config import RAW_RECORD_RETENTION_DAYS
+from db.database import create_tables
+from db.partitioning import partition_traffic_records, add_traffic_record_partitions
+from repository import (rebuild_speed_baselines, rebuild_hourly_rollups, compact_traffic_records,
+                        bump_cache_generation)
+
+
+def cmd_rebuild_baselines(args):
+    cams = rebuild_speed_baselines()
+    print(f"Rebuilt speed baselines for {cams} traffic cameras.")
+
+
+def cmd_backfill_rollups(args):
+    since = date_parser.isoparse(args.since) if args.since else None
+    buckets = rebuild_hourly_rollups(since)
+    print(f"Rebuilt {buckets} hourly rollup rows" + (f" since {since}." if since else "."))
+
+
+def cmd_compact(args):
+    removed, written = compact_traffic_records(timedelta(days=args.older_than_days), args.batch_size)
+    print(f"Replaced {removed} traffic records older than {args.older_than_days} days "
+          f"with {written} hourly records.")
+
+
+def cmd_partition(args):
+    months = partition_traffic_records(args.months_ahead)
+    print(f"Partitioned traffic_records into {months} months." if months else "traffic_records is already partitioned.")
+
+
+def cmd_add_partitions(args):
+    months = add_traffic_record_partitions(args.months_ahead)
+    print(f"Added {months} monthly partitions.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance tasks for the traffic detection database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = commands.add_parser("rebuild-baselines",
+                                  help="Recompute per-camera speed baselines from traffic_records")
+    rebuild.set_defaults(func=cmd_rebuild_baselines)
+
+    backfill = commands.add_parser("backfill-rollups",
+                                   help="Recompute the hourly rollup from traffic_records")
+    backfill.add_argument("--since", help="Only rebuild hours starting at this ISO 8601 datetime")
+    backfill.set_defaults(func=cmd_backfill_rollups)
+
+    compact = commands.add_parser("compact",
+                                  help="Downsample old traffic_records to one record per camera and hour")
+    compact.add_argument("--older-than-days", type=int, default=RAW_RECORD_RETENTION_DAYS,
+                         help=f"Age of the records to downsample (default {RAW_RECORD_RETENTION_DAYS})")
+    compact.add_argument("--batch-size", type=int, default=5000,
+                         help="Raw records handled per transaction (default 5000)")
+    compact.set_defaults(func=cmd_compact)
+
+    partition = commands.add_parser("partition",
+                                    help="Convert traffic_records to monthly partitions (MySQL)")
+    partition.add_argument("--months-ahead", type=int, default=3, help="Future months to create (default 3)")
+    partition.set_defaults(func=cmd_partition)
+
+    add_partitions = commands.add_parser("add-partitions",
+                                         help="Create the upcoming monthly partitions of traffic_records (MySQL)")
+    add_partitions.add_argument("--months-ahead", type=int, default=3, help="Future months to create (default 3)")
+    add_partitions.set_defaults(func=cmd_add_partitions)
+
+    args = parser.parse_args()
+    create_tables()
+    args.func(args)
+    # running app processes still cache results computed from the old data
+    bump_cache_generation()
+
+
+if __name__ == "__main__":
+    main()
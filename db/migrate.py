@@ -0,0 +1,212 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+from sqlalchemy import and_, delete, func, inspect, literal, or_, select, text, update
+
+from db.database import Base, db_engine
+from db.dialect import SQLITE
+import db.entities  # noqa: F401  (registers the tables on Base.metadata)
+from db.entities import TrafficJamAlert, TrafficRecord
+
+
+def create_missing_tables():
+    """
+    Create the tables that do not exist yet. Existing tables are left untouched.
+    """
+    Base.metadata.create_all(bind=db_engine)
+
+
+def create_missing_indexes():
+    """
+    Create every index declared in the entities that an existing table is missing.
+    """
+    inspector = inspect(db_engine)
+    created = []
+    for table in Base.metadata.sorted_tables:
+        existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            if index.name not in existing:
+                if index.name in INDEX_PREPARATIONS:
+                    INDEX_PREPARATIONS[index.name]()
+                print(f"Creating index {index.name} on {table.name}...")
+                index.create(bind=db_engine)
+                created.append(index.name)
+    return created
+
+
+def drop_obsolete_indexes():
+    """
+    Drop the indexes listed in OBSOLETE_INDEXES that still exist. Runs after the missing
+    indexes are created, so the ones replacing them are already in place.
+    """
+    inspector = inspect(db_engine)
+    preparer = db_engine.dialect.identifier_preparer
+    dropped = []
+    for table_name, index_names in OBSOLETE_INDEXES.items():
+        table = Base.metadata.tables[table_name]
+        existing = {ix["name"] for ix in inspector.get_indexes(table_name)}
+        for name in index_names:
+            if name not in existing:
+                continue
+            print(f"Dropping index {name} on {table_name}...")
+            with db_engine.begin() as conn:
+                if SQLITE:
+                    conn.execute(text(f"DROP INDEX {preparer.quote(name)}"))
+                else:
+                    conn.execute(text(f"DROP INDEX {preparer.quote(name)} ON {preparer.format_table(table)}"))
+            dropped.append(name)
+    return dropped
+
+
+def create_missing_columns():
+    """
+    Add the columns declared in the entities that an existing table is missing.
+    Only nullable columns can be added this way.
+    Returns the (table, column) pairs added.
+    """
+    inspector = inspect(db_engine)
+    preparer = db_engine.dialect.identifier_preparer
+    added = []
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            print(f"Adding column {column.name} to {table.name}...")
+            column_type = column.type.compile(dialect=db_engine.dialect)
+            with db_engine.begin() as conn:
+                conn.execute(text(
+                    f"ALTER TABLE {preparer.format_table(table)} "
+                    f"ADD COLUMN {preparer.format_column(column)} {column_type} NULL"
+                ))
+            added.append((table.name, column.name))
+    return added
+
+
+def close_legacy_jam_alerts():
+    """
+    Alerts written before jam episodes were tracked mark a single moment; close them so they
+    are not taken for ongoing jams.
+    """
+    with db_engine.begin() as conn:
+        closed = conn.execute(
+            update(TrafficJamAlert)
+            .where(TrafficJamAlert.ended_at.is_(None))
+            .values(ended_at=TrafficJamAlert.event_time)
+        ).rowcount
+    print(f"Closed {closed} legacy traffic jam alerts.")
+
+
+def delete_duplicate_traffic_records(chunk_size=500):
+    """
+    Records resent by devices whose upload timed out were stored again; keep the first copy of
+    each (camera, start, end) so the unique index can be built, and rebuild the aggregates the
+    copies inflated.
+    """
+    key = (TrafficRecord.traffic_cam_id, TrafficRecord.start_time, TrafficRecord.end_time)
+    with db_engine.begin() as conn:
+        groups = conn.execute(
+            select(*key, func.min(TrafficRecord.id)).group_by(*key).having(func.count() > 1)
+        ).all()
+        deleted = 0
+        for i in range(0, len(groups), chunk_size):
+            chunk = groups[i:i + chunk_size]
+            copies = or_(*(
+                and_(TrafficRecord.traffic_cam_id == cam_id, TrafficRecord.start_time == start_time,
+                     TrafficRecord.end_time == end_time, TrafficRecord.id != first_id)
+                for cam_id, start_time, end_time, first_id in chunk
+            ))
+            deleted += conn.execute(delete(TrafficRecord).where(copies)).rowcount
+    print(f"Deleted {deleted} duplicate traffic records.")
+    if not deleted:
+        return
+
+    # imported here: the repository pulls in the whole application
+    from repository import floor_hour, rebuild_hourly_rollups, rebuild_speed_baselines
+    since = floor_hour(min(group[1] for group in groups))
+    print(f"Rebuilding hourly rollups since {since} and speed baselines...")
+    rebuild_hourly_rollups(since)
+    rebuild_speed_baselines()
+
+
+def backfill_speed_baselines():
+    # imported here: the repository pulls in the whole application
+    from repository import rebuild_speed_baselines
+    print(f"Computed speed baselines of {rebuild_speed_baselines()} cameras.")
+
+
+def backfill_hourly_rollups():
+    # imported here: the repository pulls in the whole application
+    from repository import rebuild_hourly_rollups
+    print(f"Computed {rebuild_hourly_rollups()} hourly rollups.")
+
+
+def is_empty(conn, table):
+    return conn.execute(select(literal(1)).select_from(table).limit(1)).first() is None
+
+
+def backfill_empty_aggregates():
+    """
+    Fill the aggregate tables that are empty while traffic_records is not. Tables added to an
+    existing database, by this script or by create_tables() at startup, start out empty, and
+    the endpoints reading them would report nothing until they are rebuilt.
+    Returns the names of the tables filled.
+    """
+    tables = Base.metadata.tables
+    with db_engine.connect() as conn:
+        if is_empty(conn, tables[TrafficRecord.__tablename__]):
+            return []
+        empty = [name for name in AGGREGATE_BACKFILLS if is_empty(conn, tables[name])]
+    for name in empty:
+        print(f"Backfilling {name} from traffic_records...")
+        AGGREGATE_BACKFILLS[name]()
+    return empty
+
+
+# data fixes to run right after a column is added
+COLUMN_BACKFILLS = {
+    ("traffic_jam_alerts", "ended_at"): close_legacy_jam_alerts,
+}
+
+# data fixes to run right before an index is created
+INDEX_PREPARATIONS = {
+    "uq_traffic_records_cam_start_end": delete_duplicate_traffic_records,
+}
+
+# indexes made redundant by a newer one, dropped once it exists
+OBSOLETE_INDEXES = {
+    # a prefix of uq_traffic_records_cam_start_end
+    "traffic_records": ["ix_traffic_records_cam_start"],
+}
+
+# tables derived from traffic_records, rebuilt when found empty
+AGGREGATE_BACKFILLS = {
+    "speed_baselines": backfill_speed_baselines,
+    "traffic_hourly_rollups": backfill_hourly_rollups,
+}
+
+
+def main():
+    create_missing_tables()
+    added = create_missing_columns()
+    for key in added:
+        if key in COLUMN_BACKFILLS:
+            COLUMN_BACKFILLS[key]()
+    created = create_missing_indexes()
+    dropped = drop_obsolete_indexes()
+    filled = backfill_empty_aggregates()
+    if added or created or filled:
+        # imported here: the repository pulls in the whole application
+        from repository import bump_cache_generation
+        bump_cache_generation()
+    if added or created or dropped or filled:
+        print(f"Added {len(added)} columns, created {len(created)} indexes, dropped {len(dropped)} indexes "
+              f"and filled {len(filled)} tables.")
+    else:
+        print("Database schema is up to date.")
+
+
+if __name__ == "__main__":
+    main()
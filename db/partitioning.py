@@ -0,0 +1,114 @@
+"""
+Monthly RANGE partitioning of traffic_records (MySQL only).
+
+Range queries on start_time then only touch the months they cover. MySQL requires the
+partitioning column in every unique key and does not support foreign keys on partitioned
+InnoDB tables, so converting the table makes the primary key (id, start_time) and drops the
+foreign key to traffic_cams; the ingest path already rejects unknown camera ids.
+"""
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from db.database import db_engine
+from db.dialect import SQLITE
+
+TABLE = "traffic_records"
+CATCH_ALL = "pmax"
+
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_definition(month):
+    """
+    Partition holding the records that start during `month`.
+    """
+    upper = add_months(month, 1)
+    return f"PARTITION p{month:%Y%m} VALUES LESS THAN (TO_DAYS('{upper:%Y-%m-%d}'))"
+
+
+def monthly_partitions(first_month, last_month):
+    months = []
+    month = first_month
+    while month <= last_month:
+        months.append(partition_definition(month))
+        month = add_months(month, 1)
+    return months
+
+
+def existing_partitions(conn):
+    """
+    Names of the traffic_records partitions, oldest first; empty when the table is not partitioned.
+    """
+    rows = conn.execute(text(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION"
+    ), {"table": TABLE})
+    return [name for (name,) in rows]
+
+
+def require_mysql():
+    if SQLITE:
+        raise RuntimeError("Partitioning is only supported on MySQL")
+
+
+def partition_traffic_records(months_ahead=3):
+    """
+    Convert traffic_records to monthly partitions, from its oldest record to `months_ahead`
+    months from now, plus a catch-all partition. Returns the number of monthly partitions,
+    or 0 if the table was already partitioned.
+    """
+    require_mysql()
+    with db_engine.connect() as conn:
+        if existing_partitions(conn):
+            return 0
+        oldest = conn.execute(text(f"SELECT MIN(start_time) FROM {TABLE}")).scalar()
+        first_month = month_start(oldest or datetime.now())
+        last_month = add_months(month_start(datetime.now()), months_ahead)
+        partitions = monthly_partitions(first_month, last_month)
+
+        for foreign_key in inspect(conn).get_foreign_keys(TABLE):
+            print(f"Dropping foreign key {foreign_key['name']}...")
+            conn.execute(text(f"ALTER TABLE {TABLE} DROP FOREIGN KEY {foreign_key['name']}"))
+        print("Extending the primary key with start_time...")
+        conn.execute(text(f"ALTER TABLE {TABLE} DROP PRIMARY KEY, ADD PRIMARY KEY (id, start_time)"))
+        print(f"Partitioning {TABLE} into {len(partitions)} months...")
+        conn.execute(text(
+            f"ALTER TABLE {TABLE} PARTITION BY RANGE (TO_DAYS(start_time)) ("
+            + ", ".join(partitions + [f"PARTITION {CATCH_ALL} VALUES LESS THAN MAXVALUE"])
+            + ")"
+        ))
+        conn.commit()
+    return len(partitions)
+
+
+def add_traffic_record_partitions(months_ahead=3):
+    """
+    Split the catch-all partition so there is one partition per month up to `months_ahead`
+    months from now. Run it monthly (cron); returns the number of partitions added.
+    """
+    require_mysql()
+    with db_engine.connect() as conn:
+        names = [name for name in existing_partitions(conn) if name != CATCH_ALL]
+        if not names:
+            raise RuntimeError(f"{TABLE} is not partitioned, run the partition command first")
+        newest = datetime.strptime(names[-1], "p%Y%m")
+        last_month = add_months(month_start(datetime.now()), months_ahead)
+        partitions = monthly_partitions(add_months(newest, 1), last_month)
+        if not partitions:
+            return 0
+        conn.execute(text(
+            f"ALTER TABLE {TABLE} REORGANIZE PARTITION {CATCH_ALL} INTO ("
+            + ", ".join(partitions + [f"PARTITION {CATCH_ALL} VALUES LESS THAN MAXVALUE"])
+            + ")"
+        ))
+        conn.commit()
+    return len(partitions)
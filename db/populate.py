@@ -1,130 +1,416 @@
+"""
+Fill the database with synthetic, reproducible traffic data for development and scale testing.
+
+Cameras are spread over several cities. Every camera reports one record per interval, with
+vehicle counts and speeds that follow weekday/weekend diurnal patterns, plus injected jam
+episodes that are also written as traffic_jam_alerts. Records go in with chunked DB-API
+executemany (or MySQL LOAD DATA), and the speed baselines and hourly rollups are rebuilt
+at the end.
+
+    python db/populate.py                                   # 3 cities, 50 cameras, 30 days
+    python db/populate.py --cams 2000 --cities 8 --days 90 --seed 7
+    python db/populate.py --cams 4000 --days 180 --method load-data   # MySQL with local_infile
+"""
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 
+import argparse
+import csv
 import random
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timedelta
 
-from db.database import SessionLocal, Base, db_engine
+import numpy as np
+from sqlalchemy import create_engine, insert, inspect
+
+from db.database import SessionLocal, db_engine, create_tables
+from db.dialect import SQLITE
 from db.entities import (
     TrafficCam,
     TelegramBotUser,
     Subscription,
-    TrafficRecord,
     TrafficJamAlert,
+    TrafficRecord,
 )
+from repository import rebuild_speed_baselines, rebuild_hourly_rollups
 
 # ================ Sample Data ================
-# (latitude, longitude, alias)
-DEVICE_LOCATIONS = [
-    (25.676000, -100.310000, "Calle Francia con Aduana", "Tampico"),
-    (25.690000, -100.320000, "Avenida 1ro de Mayo enfrente del Tec Madero", "Ciudad Madero"),
-    (25.695000, -100.300000, "Calle Juventino Rosas enfrente del Tec Madero Campus 2", "Ciudad Madero"),
+# (city, latitude, longitude)
+CITIES = [
+    ("Tampico", 22.255300, -97.868600),
+    ("Ciudad Madero", 22.276000, -97.832200),
+    ("Altamira", 22.393000, -97.943000),
+    ("Monterrey", 25.686600, -100.316100),
+    ("Guadalajara", 20.659700, -103.349600),
+    ("Ciudad de México", 19.432600, -99.133200),
+    ("Puebla", 19.041400, -98.206300),
+    ("Querétaro", 20.588800, -100.389900),
+    ("Mérida", 20.967400, -89.592600),
+    ("Tijuana", 32.514900, -117.038200),
 ]
 
-USER_IDS = [1001, 1002, 1003, 1004, 1005]
+STREETS = ["Avenida Hidalgo", "Calle Aduana", "Boulevard Adolfo López Mateos", "Avenida Universidad",
+           "Calle Juventino Rosas", "Avenida 1ro de Mayo", "Calzada Independencia", "Avenida Juárez"]
+
+FIRST_USER_ID = 1001
+
+# jam episodes: speed drops to this fraction of free flow, vehicle count to JAM_VOLUME_FACTOR
+JAM_SPEED_FACTOR = (0.05, 0.15)
+JAM_VOLUME_FACTOR = 0.4
+JAM_DURATION_MINUTES = (20, 120)
+
+RECORD_COLUMNS = ("traffic_cam_id", "start_time", "end_time", "vehicle_count", "average_speed")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cams", type=int, default=50, help="number of cameras to create")
+    parser.add_argument("--cities", type=int, default=3, help=f"number of cities (at most {len(CITIES)})")
+    parser.add_argument("--days", type=float, default=30, help="days of history to generate")
+    parser.add_argument("--end", help="ISO 8601 end of the history (default: now)")
+    parser.add_argument("--record-minutes", type=int, default=5, help="minutes covered by each record")
+    parser.add_argument("--jams-per-day", type=float, default=0.3, help="average jam episodes per camera and day")
+    parser.add_argument("--users", type=int, default=100, help="number of bot users")
+    parser.add_argument("--subscriptions", type=int, default=3, help="cameras each bot user subscribes to")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="records per insert transaction")
+    parser.add_argument("--method", choices=("executemany", "load-data"), default="executemany",
+                        help="load-data uses MySQL LOAD DATA LOCAL INFILE (server needs local_infile=1)")
+    parser.add_argument("--keep-indexes", action="store_true",
+                        help="maintain the traffic_records indexes while loading instead of rebuilding them")
+    parser.add_argument("--skip-aggregates", action="store_true",
+                        help="do not rebuild speed baselines and hourly rollups after loading")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
 
-def create_tables():
+
+# ================ Cameras and users ================
+
+def populate_traffic_cams(db, count, cities, rng):
     """
-    Creates or updates all tables defined in the entities.
+    Create `count` cameras scattered around the centers of the first `cities` cities.
+    Returns their ids.
     """
-    Base.metadata.create_all(bind=db_engine)
-    print("Tables created or updated successfully.")
-
-def populate_traffic_cams(db):
-    cams = [
-        TrafficCam(location_lat=lat, location_lng=lng, alias=alias, city=city)
-        for lat, lng, alias, city in DEVICE_LOCATIONS
-    ]
+    cams = []
+    for i in range(count):
+        city, lat, lng = CITIES[i % cities]
+        cams.append(TrafficCam(
+            location_lat=round(lat + rng.gauss(0, 0.03), 6),
+            location_lng=round(lng + rng.gauss(0, 0.03), 6),
+            alias=f"{rng.choice(STREETS)} #{i + 1}",
+            city=city,
+        ))
     db.add_all(cams)
     db.commit()
-    print(f"Inserted {len(cams)} traffic cameras.")
+    print(f"Inserted {len(cams)} traffic cameras in {cities} cities.")
+    return [cam.id for cam in cams]
 
 
-def populate_bot_users(db):
-    users = [TelegramBotUser(user_id=uid) for uid in USER_IDS]
-    db.add_all(users)
+def populate_bot_users(db, count):
+    first = (max((uid for (uid,) in db.query(TelegramBotUser.user_id)), default=FIRST_USER_ID - 1)) + 1
+    users = [{"user_id": uid} for uid in range(first, first + count)]
+    if users:
+        db.execute(insert(TelegramBotUser), users)
     db.commit()
     print(f"Inserted {len(users)} bot users.")
+    return [user["user_id"] for user in users]
 
 
-def populate_subscriptions(db, count=5):
-    cams = db.query(TrafficCam).all()
-    users = db.query(TelegramBotUser).all()
-
-    # build all possible (user_id, traffic_cam_id) pairs
-    all_pairs = [(u.user_id, cam.id) for u in users for cam in cams]
-    # sample without replacement to avoid PK conflicts
-    sampled = random.sample(all_pairs, k=min(count, len(all_pairs)))
-
+def populate_subscriptions(db, user_ids, cam_ids, per_user, rng):
     subs = [
-        Subscription(user_id=uid, traffic_cam_id=cam_id)
-        for uid, cam_id in sampled
+        {"user_id": uid, "traffic_cam_id": cam_id}
+        for uid in user_ids
+        for cam_id in rng.sample(cam_ids, k=min(per_user, len(cam_ids)))
     ]
-    db.add_all(subs)
+    if subs:
+        db.execute(insert(Subscription), subs)
     db.commit()
     print(f"Inserted {len(subs)} subscriptions.")
 
 
-def populate_traffic_records(db, count=20):
-    cams = db.query(TrafficCam).all()
-    now = datetime.utcnow()
-
-    records = []
-    for _ in range(count):
-        cam = random.choice(cams)
-        # pick a random window in the past month
-        end_time = now - timedelta(days=random.randint(0, 30))
-        start_time = end_time - timedelta(minutes=random.randint(5, 15))
-        vehicle_count = random.randint(5, 100)
-        avg_speed = round(random.uniform(20.0, 80.0), 2)
-
-        records.append(
-            TrafficRecord(
-                traffic_cam_id=cam.id,
-                start_time=start_time,
-                end_time=end_time,
-                vehicle_count=vehicle_count,
-                average_speed=avg_speed,
-            )
-        )
+# ================ Traffic model ================
 
-    db.add_all(records)
-    db.commit()
-    print(f"Inserted {len(records)} traffic records.")
-
-
-def populate_traffic_jam_alerts(db, count=5):
-    cams = db.query(TrafficCam).all()
-    now = datetime.utcnow()
-
-    events = []
-    for _ in range(count):
-        cam = random.choice(cams)
-        # random alert in last 10 days
-        event_time = now - timedelta(days=random.randint(0, 10), hours=random.randint(0, 23))
-        events.append(
-            TrafficJamAlert(
-                traffic_cam_id=cam.id,
-                event_time=event_time,
-            )
+def traffic_profile(hours, weekend):
+    """
+    Relative traffic volume (about 1.0 at the weekday rush hours) and congestion (0 to 1) for
+    arrays of fractional hours of the day and weekend flags.
+    """
+    morning = np.exp(-((hours - 8.0) / 1.2) ** 2)
+    evening = np.exp(-((hours - 18.5) / 1.6) ** 2)
+    midday = 0.55 * np.exp(-((hours - 13.5) / 2.5) ** 2)
+    workday = 0.06 + 0.95 * np.maximum(np.maximum(morning, evening), midday)
+    weekend_day = 0.06 + 0.6 * np.exp(-((hours - 14.0) / 3.5) ** 2)
+    volume = np.where(weekend, weekend_day, workday)
+    congestion = np.clip((volume - 0.5) / 0.5, 0.0, 1.0)
+    return volume, congestion
+
+
+def jam_episodes(np_rng, cams, steps, per_day, steps_per_day, min_steps, max_steps, weights):
+    """
+    Draw jam episodes for every camera, more likely when traffic is heavy.
+    Returns arrays (camera index, first step, last step exclusive).
+    """
+    counts = np_rng.poisson(per_day * steps / steps_per_day, size=cams)
+    total = int(counts.sum())
+    cam_index = np.repeat(np.arange(cams), counts)
+    starts = np_rng.choice(steps, size=total, p=weights / weights.sum())
+    ends = np.minimum(starts + np_rng.integers(min_steps, max_steps + 1, size=total), steps)
+    return cam_index, starts, ends
+
+
+class TrafficGenerator:
+    """
+    Vectorized generator of the records of every camera, one block of time steps at a time.
+    """
+
+    def __init__(self, cam_ids, begin, steps, record_minutes, jams_per_day, seed):
+        self.cam_ids = np.array(cam_ids, dtype=np.int64)
+        self.begin = begin
+        self.steps = steps
+        self.interval = timedelta(minutes=record_minutes)
+        self.np_rng = np.random.default_rng(seed)
+
+        cams = len(cam_ids)
+        # per camera: peak vehicles per record and free-flow speed
+        self.capacity = self.np_rng.lognormal(np.log(12 * record_minutes), 0.5, size=cams)
+        self.free_flow = self.np_rng.uniform(40.0, 80.0, size=cams)
+        self.sensitivity = self.np_rng.uniform(0.3, 0.6, size=cams)
+
+        volume, _ = self.profile(np.arange(steps))
+        steps_per_day = 24 * 60 // record_minutes
+        self.jams = jam_episodes(self.np_rng, cams, steps, jams_per_day, steps_per_day,
+                                 max(1, JAM_DURATION_MINUTES[0] // record_minutes),
+                                 max(1, JAM_DURATION_MINUTES[1] // record_minutes), volume ** 2)
+
+    def profile(self, steps):
+        minutes = steps * (self.interval.total_seconds() / 60) + (self.begin.hour * 60 + self.begin.minute)
+        days = self.begin.weekday() + minutes // 1440
+        return traffic_profile((minutes % 1440) / 60.0, days % 7 >= 5)
+
+    def jam_mask(self, first, last):
+        cam_index, starts, ends = self.jams
+        overlapping = (starts < last) & (ends > first)
+        mask = np.zeros((last - first, len(self.cam_ids)), dtype=bool)
+        for cam, start, end in zip(cam_index[overlapping], starts[overlapping], ends[overlapping]):
+            mask[max(start, first) - first:min(end, last) - first, cam] = True
+        return mask
+
+    def block(self, first, last):
+        """
+        Records of steps [first, last) as column arrays, time-major.
+        """
+        steps = np.arange(first, last)
+        volume, congestion = self.profile(steps)
+        jammed = self.jam_mask(first, last)
+        shape = jammed.shape
+
+        expected = volume[:, None] * self.capacity[None, :]
+        expected = np.where(jammed, expected * JAM_VOLUME_FACTOR, expected)
+        vehicles = self.np_rng.poisson(expected)
+
+        speed = self.free_flow[None, :] * (1.0 - congestion[:, None] * self.sensitivity[None, :])
+        speed = speed * self.np_rng.normal(1.0, 0.08, size=shape)
+        speed = np.where(jammed, self.free_flow[None, :] * self.np_rng.uniform(*JAM_SPEED_FACTOR, size=shape), speed)
+        speed = np.clip(np.round(speed, 2), 1.0, None)
+
+        return steps, vehicles, speed
+
+    def alerts(self):
+        """
+        The jam episodes as traffic_jam_alerts rows; episodes lasting until the end stay open.
+        """
+        cam_index, starts, ends = self.jams
+        return [
+            {
+                "traffic_cam_id": int(self.cam_ids[cam]),
+                "event_time": self.begin + self.interval * int(start),
+                "ended_at": self.begin + self.interval * int(end) if end < self.steps else None,
+            }
+            for cam, start, end in zip(cam_index, starts, ends)
+        ]
+
+
+# ================ Loading ================
+
+def datetime_strings(moments):
+    # SQLAlchemy stores SQLite datetimes as text with microseconds; MySQL parses either form
+    fmt = '%Y-%m-%d %H:%M:%S.%f' if SQLITE else '%Y-%m-%d %H:%M:%S'
+    return np.array([moment.strftime(fmt) for moment in moments], dtype=object)
+
+
+def record_rows(generator, steps, vehicles, speed):
+    """
+    Records of a block as DB-API parameter tuples.
+    """
+    cams = len(generator.cam_ids)
+    starts = [generator.begin + generator.interval * int(step) for step in steps]
+    start_strings = datetime_strings(starts)
+    end_strings = datetime_strings([start + generator.interval for start in starts])
+    return list(zip(
+        np.tile(generator.cam_ids, len(steps)).tolist(),
+        np.repeat(start_strings, cams).tolist(),
+        np.repeat(end_strings, cams).tolist(),
+        vehicles.ravel().tolist(),
+        speed.ravel().tolist(),
+    ))
+
+
+def disable_constraint_checks(conn):
+    # the generated records only reference cameras created above
+    if SQLITE:
+        conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+    else:
+        conn.exec_driver_sql("SET foreign_key_checks=0, unique_checks=0")
+
+
+def enable_constraint_checks(conn):
+    if SQLITE:
+        conn.exec_driver_sql("PRAGMA foreign_keys=ON")
+    else:
+        conn.exec_driver_sql("SET foreign_key_checks=1, unique_checks=1")
+
+
+class ExecutemanyLoader:
+    """Inserts each chunk with one DB-API executemany in its own transaction, on one connection."""
+
+    def __init__(self, engine):
+        placeholder = "?" if SQLITE else "%s"
+        self.sql = (f"INSERT INTO traffic_records ({', '.join(RECORD_COLUMNS)}) "
+                    f"VALUES ({', '.join([placeholder] * len(RECORD_COLUMNS))})")
+        self.conn = engine.connect()
+        disable_constraint_checks(self.conn)
+
+    def load(self, rows):
+        self.conn.exec_driver_sql(self.sql, rows)
+        self.conn.commit()
+
+    def close(self):
+        enable_constraint_checks(self.conn)
+        self.conn.close()
+
+
+class LoadDataLoader:
+    """Writes each chunk to a CSV file and loads it with MySQL LOAD DATA LOCAL INFILE."""
+
+    def __init__(self, engine):
+        if SQLITE:
+            raise ValueError("--method load-data requires MySQL")
+        self.engine = create_engine(engine.url, connect_args={"local_infile": True})
+        self.conn = self.engine.connect()
+        disable_constraint_checks(self.conn)
+        self.directory = tempfile.mkdtemp(prefix="traffic-populate-")
+        self.path = os.path.join(self.directory, "chunk.csv")
+
+    def load(self, rows):
+        with open(self.path, "w", newline="") as f:
+            csv.writer(f).writerows(rows)
+        self.conn.exec_driver_sql(
+            f"LOAD DATA LOCAL INFILE '{self.path}' INTO TABLE traffic_records "
+            "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' LINES TERMINATED BY '\\r\\n' "
+            f"({', '.join(RECORD_COLUMNS)})"
         )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rmdir(self.directory)
+        self.engine.dispose()
+
+
+@contextmanager
+def secondary_indexes_dropped(engine):
+    """
+    Drop the secondary indexes of traffic_records for the duration of the load and build them
+    again afterwards, which is several times faster than maintaining them row by row.
+    MySQL keeps uq_traffic_records_cam_start_end, the index backing the camera foreign key.
+    """
+    indexes = [index for index in TrafficRecord.__table__.indexes
+               if SQLITE or index.name != "uq_traffic_records_cam_start_end"]
+    with engine.begin() as conn:
+        existing = {index["name"] for index in inspect(conn).get_indexes(TrafficRecord.__tablename__)}
+        indexes = [index for index in indexes if index.name in existing]
+        for index in indexes:
+            index.drop(conn)
+    try:
+        yield
+    finally:
+        started = time.perf_counter()
+        with engine.begin() as conn:
+            for index in indexes:
+                index.create(conn)
+        print(f"Rebuilt {len(indexes)} traffic_records indexes in {time.perf_counter() - started:.1f}s.")
+
 
-    db.add_all(events)
+def populate_traffic_records(generator, chunk_size, loader):
+    """
+    Generate and insert every record, `chunk_size` records per transaction.
+    Returns the number of records inserted.
+    """
+    steps_per_chunk = max(1, chunk_size // len(generator.cam_ids))
+    inserted = 0
+    started = time.perf_counter()
+    for first in range(0, generator.steps, steps_per_chunk):
+        last = min(first + steps_per_chunk, generator.steps)
+        rows = record_rows(generator, *generator.block(first, last))
+        loader.load(rows)
+        inserted += len(rows)
+        elapsed = time.perf_counter() - started
+        print(f"\r{inserted:,} traffic records ({inserted / elapsed:,.0f} rows/s)", end="", flush=True)
+    print()
+    return inserted
+
+
+def populate_traffic_jam_alerts(db, generator):
+    alerts = generator.alerts()
+    if alerts:
+        db.execute(insert(TrafficJamAlert), alerts)
     db.commit()
-    print(f"Inserted {len(events)} traffic‐jam alerts.")
+    print(f"Inserted {len(alerts)} traffic-jam alerts.")
+
+
+def rebuild_aggregates():
+    started = time.perf_counter()
+    rebuild_speed_baselines()
+    buckets = rebuild_hourly_rollups()
+    print(f"Rebuilt speed baselines and {buckets} hourly rollup rows in {time.perf_counter() - started:.1f}s.")
 
 
 def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    cities = max(1, min(args.cities, len(CITIES)))
+    interval = timedelta(minutes=args.record_minutes)
+    end = datetime.fromisoformat(args.end) if args.end else datetime.now()
+    end = datetime.min + (end - datetime.min) // interval * interval
+    steps = int(timedelta(days=args.days) / interval)
+
     db = SessionLocal()
     try:
         create_tables()
-        populate_traffic_cams(db)
-        populate_bot_users(db)
-        populate_subscriptions(db)
-        populate_traffic_records(db)
-        populate_traffic_jam_alerts(db)
+        cam_ids = populate_traffic_cams(db, args.cams, cities, rng)
+        user_ids = populate_bot_users(db, args.users)
+        populate_subscriptions(db, user_ids, cam_ids, args.subscriptions, rng)
+
+        generator = TrafficGenerator(cam_ids, end - steps * interval, steps, args.record_minutes,
+                                     args.jams_per_day, args.seed)
+        started = time.perf_counter()
+        with secondary_indexes_dropped(db_engine) if not args.keep_indexes else nullcontext():
+            loader = LoadDataLoader(db_engine) if args.method == "load-data" else ExecutemanyLoader(db_engine)
+            try:
+                inserted = populate_traffic_records(generator, args.chunk_size, loader)
+            finally:
+                loader.close()
+        elapsed = time.perf_counter() - started
+        print(f"Loaded {inserted:,} traffic records in {elapsed:.1f}s ({inserted / elapsed:,.0f} rows/s).")
+        populate_traffic_jam_alerts(db, generator)
+
+        if not args.skip_aggregates:
+            rebuild_aggregates()
         print("Database successfully populated!")
     except Exception as e:
         db.rollback()
@@ -134,4 +420,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,136 @@
+import csv
+import io
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional, only needed for the columnar formats
+    pa = pq = None
+
+EXPORT_COLUMNS = ["id", "traffic_cam_id", "alias", "start_time", "end_time", "vehicle_count", "average_speed"]
+
+CONTENT_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+    "csv": "text/csv",
+}
+
+FILE_EXTENSIONS = {
+    "arrow": "arrows",
+    "parquet": "parquet",
+    "csv": "csv",
+}
+
+
+def available_formats():
+    return ["arrow", "parquet", "csv"] if pa is not None else ["csv"]
+
+
+def default_format():
+    return available_formats()[0]
+
+
+class ChunkSink:
+    """
+    Write-only file object collecting the bytes pyarrow writes, so they can be sent
+    to the client as soon as each batch is encoded.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def arrow_schema():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("traffic_cam_id", pa.int32()),
+        ("alias", pa.string()),
+        ("start_time", pa.timestamp("s")),
+        ("end_time", pa.timestamp("s")),
+        ("vehicle_count", pa.int32()),
+        ("average_speed", pa.float64()),
+    ])
+
+
+def to_record_batch(rows, schema):
+    """
+    Transpose a list of result rows into an Arrow record batch.
+    """
+    columns = dict(zip(rows[0]._fields, zip(*rows)))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(columns[field.name], type=field.type) for field in schema],
+        schema=schema
+    )
+
+
+def export_arrow(batches):
+    """
+    Encode row batches as an Arrow IPC stream, one record batch per DB chunk.
+    """
+    schema = arrow_schema()
+    sink = ChunkSink()
+    with pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema) as writer:
+        yield sink.drain()
+        for rows in batches:
+            writer.write_batch(to_record_batch(rows, schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def export_parquet(batches):
+    """
+    Encode row batches as a Parquet file, one row group per DB chunk.
+    """
+    schema = arrow_schema()
+    sink = ChunkSink()
+    with pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema, compression="snappy") as writer:
+        for rows in batches:
+            writer.write_batch(to_record_batch(rows, schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def export_csv(batches):
+    """
+    Encode row batches as CSV with a header line.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in batches:
+        writer.writerows(
+            (row.id, row.traffic_cam_id, row.alias, row.start_time.strftime('%Y-%m-%d %H:%M:%S'),
+             row.end_time.strftime('%Y-%m-%d %H:%M:%S'), row.vehicle_count, row.average_speed)
+            for row in rows
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+EXPORTERS = {
+    "arrow": export_arrow,
+    "parquet": export_parquet,
+    "csv": export_csv,
+}
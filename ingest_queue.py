@@ -0,0 +1,273 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from repository import add_traffic_records
+
+logger = logging.getLogger(__name__)
+
+DATETIME_FIELDS = ("start_time", "end_time")
+DEAD_LETTER_DIR = "dead-letter"
+RETRY_MAX_SECONDS = 60
+
+
+class QueueFull(Exception):
+    """Raised by put when the backlog of unwritten records reached its cap."""
+
+
+def encode_row(row, queued_at):
+    """
+    Serialize a parsed record as one spool line.
+    """
+    line = dict(row, queued_at=queued_at)
+    for field in DATETIME_FIELDS:
+        line[field] = row[field].isoformat()
+    return json.dumps(line) + "\n"
+
+
+def decode_row(line):
+    """
+    Parse a spool line back into (row, queued_at).
+    """
+    row = json.loads(line)
+    queued_at = row.pop("queued_at")
+    for field in DATETIME_FIELDS:
+        row[field] = datetime.fromisoformat(row[field])
+    return row, queued_at
+
+
+class Segment:
+    """A sealed spool file together with the rows it holds, written to the DB in one transaction."""
+
+    def __init__(self, path, rows, first_queued_at):
+        self.path = path
+        self.rows = rows
+        self.first_queued_at = first_queued_at
+        self.attempts = 0
+        self.retry_at = 0.0
+
+
+class IngestQueue:
+    """
+    Write-behind buffer for traffic records.
+
+    Every record is appended to an on-disk spool before it is acknowledged. The spool is
+    split in segments of at most `flush_size` rows; a background thread writes each sealed
+    segment with one bulk transaction and deletes its file once committed. Segments left
+    behind by a crash or a database outage are replayed when the queue starts.
+
+    A segment whose write keeps failing is retried with exponential backoff and, after
+    `max_attempts` failures, moved to the slot's dead-letter directory so it stops blocking
+    the ones behind it; moving the file back into the slot replays it on the next start.
+    Once `max_backlog` rows are waiting, put raises QueueFull instead of growing the backlog.
+    """
+
+    def __init__(self, spool_dir, flush_size=500, flush_interval=1.0, fsync=True, writer=add_traffic_records,
+                 max_attempts=8, max_backlog=100_000):
+        self.spool_dir = spool_dir
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.writer = writer
+        self.max_attempts = max_attempts
+        self.max_backlog = max_backlog
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.segments = deque()
+        self.pending = []
+        self.pending_since = None
+        self.active_file = None
+        self.active_path = None
+        self.next_seq = 0
+        self.slot_dir = None
+        self.slot_lock = None
+        self.thread = None
+
+        self.enqueued = 0
+        self.flushed = 0
+        self.rejected = 0
+        self.failed_flushes = 0
+        self.dead_lettered = 0
+        self.last_flush_error = None
+
+    # ---------- lifecycle ----------
+
+    def start(self):
+        """
+        Claim a spool slot, queue whatever a previous run left in it and start the flusher.
+        """
+        if self.thread is not None:
+            return
+        self.claim_slot()
+        self.replay()
+        self.open_active()
+        self.thread = threading.Thread(target=self.run, name="ingest-flusher", daemon=True)
+        self.thread.start()
+
+    def claim_slot(self):
+        """
+        Lock the first free slot directory, so several worker processes never share spool files.
+        """
+        os.makedirs(self.spool_dir, exist_ok=True)
+        slot = 0
+        while True:
+            slot_dir = os.path.join(self.spool_dir, f"worker-{slot}")
+            os.makedirs(slot_dir, exist_ok=True)
+            lock_file = open(os.path.join(slot_dir, ".lock"), "w")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                slot += 1
+                continue
+            self.slot_dir, self.slot_lock = slot_dir, lock_file
+            return
+
+    def replay(self):
+        """
+        Load every spool file of the slot as a sealed segment, oldest first.
+        """
+        names = sorted(name for name in os.listdir(self.slot_dir) if name.endswith(".jsonl"))
+        for name in names:
+            path = os.path.join(self.slot_dir, name)
+            rows, first_queued_at = [], None
+            with open(path) as spool_file:
+                for line in spool_file:
+                    try:
+                        row, queued_at = decode_row(line)
+                    except (ValueError, KeyError):
+                        continue  # torn write at crash time
+                    rows.append(row)
+                    first_queued_at = first_queued_at or queued_at
+            if rows:
+                self.segments.append(Segment(path, rows, first_queued_at))
+            else:
+                os.remove(path)
+        if names:
+            self.next_seq = int(names[-1].split(".")[0]) + 1
+        if self.segments:
+            logger.info("Replaying %d spooled traffic records from %s", self.depth(), self.slot_dir)
+
+    def open_active(self):
+        self.active_path = os.path.join(self.slot_dir, f"{self.next_seq:012d}.jsonl")
+        self.active_file = open(self.active_path, "a")
+        self.next_seq += 1
+
+    def seal(self):
+        """
+        Close the active spool file and hand its rows to the flusher. Caller holds the lock.
+        """
+        if not self.pending:
+            return
+        self.active_file.close()
+        self.segments.append(Segment(self.active_path, self.pending, self.pending_since))
+        self.pending, self.pending_since = [], None
+        self.open_active()
+
+    # ---------- producer side ----------
+
+    def put(self, row):
+        """
+        Durably queue one parsed record. Raises QueueFull when the backlog is at its cap.
+        """
+        queued_at = time.time()
+        line = encode_row(row, queued_at)
+        with self.lock:
+            if self.depth() >= self.max_backlog:
+                raise QueueFull(f"Ingest backlog is full ({self.max_backlog} records waiting)")
+            self.active_file.write(line)
+            self.active_file.flush()
+            if self.fsync:
+                os.fsync(self.active_file.fileno())
+            self.pending.append(row)
+            self.pending_since = self.pending_since or queued_at
+            self.enqueued += 1
+            if len(self.pending) >= self.flush_size:
+                self.seal()
+                self.wakeup.set()
+
+    # ---------- consumer side ----------
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """
+        Write all sealed segments, stopping at the first failure so it is retried once its
+        backoff has passed.
+        """
+        with self.lock:
+            self.seal()
+        while self.segments:
+            segment = self.segments[0]
+            if segment.retry_at > time.time():
+                return
+            try:
+                inserted, rejected = self.writer(segment.rows)
+            except Exception as e:
+                self.failed_flushes += 1
+                self.last_flush_error = str(e)
+                segment.attempts += 1
+                if segment.attempts >= self.max_attempts:
+                    self.dead_letter(segment)
+                    continue
+                delay = min(self.flush_interval * 2 ** segment.attempts, RETRY_MAX_SECONDS)
+                segment.retry_at = time.time() + delay
+                return
+            for pos, error in rejected:
+                logger.warning("Dropped spooled record %s: %s", segment.rows[pos], error)
+            os.remove(segment.path)
+            with self.lock:
+                self.segments.popleft()
+                self.flushed += inserted
+                self.rejected += len(rejected)
+
+    def dead_letter(self, segment):
+        """
+        Move a segment that failed `max_attempts` times out of the slot.
+        """
+        dead_letter_dir = os.path.join(self.slot_dir, DEAD_LETTER_DIR)
+        os.makedirs(dead_letter_dir, exist_ok=True)
+        path = os.path.join(dead_letter_dir, os.path.basename(segment.path))
+        os.replace(segment.path, path)
+        logger.error("Moved %d spooled records to %s after %d failed writes: %s",
+                     len(segment.rows), path, segment.attempts, self.last_flush_error)
+        with self.lock:
+            self.segments.popleft()
+            self.dead_lettered += len(segment.rows)
+
+    # ---------- counters ----------
+
+    def depth(self):
+        return len(self.pending) + sum(len(segment.rows) for segment in self.segments)
+
+    def lag(self):
+        """
+        Seconds the oldest unwritten record has been waiting.
+        """
+        oldest = [segment.first_queued_at for segment in self.segments]
+        if self.pending_since:
+            oldest.append(self.pending_since)
+        return time.time() - min(oldest) if oldest else 0.0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "queue_depth": self.depth(),
+                "lag_seconds": round(self.lag(), 3),
+                "enqueued": self.enqueued,
+                "flushed": self.flushed,
+                "rejected": self.rejected,
+                "failed_flushes": self.failed_flushes,
+                "dead_lettered": self.dead_lettered,
+                "last_flush_error": self.last_flush_error,
+            }
@@ -0,0 +1,154 @@
+import threading
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+
+from db.config import JAM_ENTER_RATIO, JAM_EXIT_RATIO, JAM_MIN_DURATION_SECONDS
+from db.entities import TrafficJamAlert
+
+CLEAR, PENDING, JAMMED = "clear", "pending", "jammed"
+
+# status: CLEAR, PENDING (slow since `since`, not long enough yet) or JAMMED (alert `alert` open since `since`)
+# last_seen: end time of the latest reading applied, older readings arriving late are ignored
+JamState = namedtuple("JamState", ["status", "since", "alert", "last_seen"])
+
+CLEAR_STATE = JamState(CLEAR, None, None, None)
+
+
+class JamDetector:
+    """
+    Per-camera jam state machine with hysteresis.
+
+    A camera is jammed once its speed stays at or below `enter_ratio` of its baseline for
+    `min_duration`, and clears when its speed climbs back to `exit_ratio` of the baseline.
+    Each episode is a single TrafficJamAlert: inserted when the jam is confirmed, with
+    event_time set to when it started, and closed by setting ended_at.
+
+    New states are staged on the session and only take effect once it commits.
+    """
+
+    def __init__(self, enter_ratio, exit_ratio, min_duration):
+        self.enter_ratio = enter_ratio
+        self.exit_ratio = max(exit_ratio, enter_ratio)
+        self.min_duration = min_duration
+        self.states = {}
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def load(self, session):
+        """
+        Rebuild the camera states from the alerts still open in the database.
+        """
+        open_alerts = (
+            session.query(TrafficJamAlert)
+            .filter(TrafficJamAlert.ended_at.is_(None))
+            .order_by(TrafficJamAlert.event_time)
+        )
+        states = {
+            alert.traffic_cam_id: JamState(JAMMED, alert.event_time, alert.id, None)
+            for alert in open_alerts
+        }
+        with self.lock:
+            self.states = states
+            self.loaded = True
+
+    def reset(self):
+        with self.lock:
+            self.states = {}
+            self.loaded = False
+
+    def step(self, state, row, reference_speed):
+        """
+        Apply one reading to a camera state.
+        Returns the new state and the event it caused: "start", "end" or None.
+        """
+        speed = row["average_speed"]
+        slow = reference_speed > 0 and speed <= reference_speed * self.enter_ratio
+        recovered = reference_speed <= 0 or speed >= reference_speed * self.exit_ratio
+        last_seen = row["end_time"]
+
+        if state.status == JAMMED:
+            if recovered:
+                return JamState(CLEAR, None, None, last_seen), "end"
+            return state._replace(last_seen=last_seen), None
+
+        if state.status == CLEAR:
+            if not slow:
+                return state._replace(last_seen=last_seen), None
+            state = JamState(PENDING, row["start_time"], None, last_seen)
+        elif recovered:
+            return JamState(CLEAR, None, None, last_seen), None
+
+        if row["end_time"] - state.since >= self.min_duration:
+            return JamState(JAMMED, state.since, None, last_seen), "start"
+        return state._replace(last_seen=last_seen), None
+
+    def observe(self, session, rows, reference_speed):
+        """
+        Feed newly inserted records through the state machines of their cameras, in time order.
+        `reference_speed(row)` is the baseline speed the record is compared to.
+
+        Stages an alert for every jam that started and closes those that ended.
+        Returns (started alerts, ended alerts); an episode starting and ending within `rows`
+        is in both.
+        """
+        if not self.loaded:
+            self.load(session)
+        staged = session.info.setdefault("jam_states", {})
+
+        by_cam = defaultdict(list)
+        for row in rows:
+            by_cam[row["traffic_cam_id"]].append(row)
+
+        started, ended, closed = [], [], []
+        for cam_id, cam_rows in by_cam.items():
+            state = staged.get(cam_id) or self.states.get(cam_id, CLEAR_STATE)
+            for row in sorted(cam_rows, key=lambda r: r["start_time"]):
+                if state.last_seen is not None and row["end_time"] <= state.last_seen:
+                    continue
+                previous = state
+                state, change = self.step(state, row, reference_speed(row))
+                if change == "start":
+                    alert = TrafficJamAlert(traffic_cam_id=cam_id, event_time=state.since)
+                    started.append(alert)
+                    state = state._replace(alert=alert)
+                elif change == "end":
+                    if isinstance(previous.alert, TrafficJamAlert):
+                        previous.alert.ended_at = row["start_time"]
+                        ended.append(previous.alert)
+                    else:
+                        closed.append({"id": previous.alert, "ended_at": row["start_time"]})
+                        ended.append(TrafficJamAlert(id=previous.alert, traffic_cam_id=cam_id,
+                                                     event_time=previous.since, ended_at=row["start_time"]))
+            staged[cam_id] = state
+
+        if started:
+            session.add_all(started)
+            session.flush()  # alert ids are kept in the camera states
+            for cam_id, state in staged.items():
+                if isinstance(state.alert, TrafficJamAlert):
+                    staged[cam_id] = state._replace(alert=state.alert.id)
+        if closed:
+            session.execute(update(TrafficJamAlert), closed)
+        return started, ended
+
+    def apply(self, staged):
+        with self.lock:
+            self.states.update(staged)
+
+
+jam_detector = JamDetector(JAM_ENTER_RATIO, JAM_EXIT_RATIO, timedelta(seconds=JAM_MIN_DURATION_SECONDS))
+
+
+@event.listens_for(Session, "after_commit")
+def apply_jam_states(session):
+    staged = session.info.pop("jam_states", None)
+    if staged:
+        jam_detector.apply(staged)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_jam_states(session):
+    session.info.pop("jam_states", None)
@@ -0,0 +1,89 @@
+"""
+JSON provider serializing responses with orjson when it is installed.
+
+Output is byte-for-byte what Flask's default provider writes in compact mode (sorted keys,
+no spaces, ASCII only), so clients and ETags do not change. Payloads orjson would write
+differently fall back to the standard library encoder; the one exception is non-finite
+floats, which come out as null instead of the invalid NaN/Infinity tokens.
+"""
+import codecs
+import re
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COMPACT_SEPARATORS = (",", ":")
+
+# orjson writes floats below 1e-4 without an exponent (0.00001 where json.dumps writes 1e-05)
+# and exponents without zero padding or sign (1e16 vs 1e+16). A false match, such as a string
+# containing "e-", only costs the fallback.
+EXPONENT = re.compile(rb"e[-0-9]")
+SMALL_FRACTION = b"0.0000"
+
+
+def escape_non_ascii(error):
+    """
+    Codec error handler writing characters as json.dumps does with ensure_ascii, astral ones
+    as surrogate pairs.
+    """
+    escaped = []
+    for char in error.object[error.start:error.end]:
+        code = ord(char)
+        if code < 0x10000:
+            escaped.append(f"\\u{code:04x}")
+        else:
+            code -= 0x10000
+            escaped.append(f"\\u{0xd800 | (code >> 10):04x}\\u{0xdc00 | (code & 0x3ff):04x}")
+    return "".join(escaped), error.end
+
+
+codecs.register_error("json_ascii", escape_non_ascii)
+
+if orjson is not None:
+    ORJSON_OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                      | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_SUBCLASS)
+
+
+def refuse(obj):
+    # dates, Decimals, dataclasses and subclasses of builtins are left to Flask's default
+    raise TypeError(f"Object of type {type(obj).__name__} is not handled by orjson")
+
+
+def fast_dumps(obj):
+    """
+    `obj` as compact, key-sorted, ASCII-only JSON, or None when orjson is missing or its
+    output would differ from json.dumps.
+    """
+    if orjson is None:
+        return None
+    try:
+        encoded = orjson.dumps(obj, default=refuse, option=ORJSON_OPTIONS)
+    except TypeError:
+        # also raised for non-string keys, integers past 64 bits and deep nesting
+        return None
+    if EXPONENT.search(encoded) or SMALL_FRACTION in encoded:
+        return None
+    # outside of strings JSON text is plain ASCII, so escaping the whole output is safe
+    if b"\x7f" in encoded:
+        encoded = encoded.replace(b"\x7f", b"\\u007f")
+    if not encoded.isascii():
+        encoded = encoded.decode().encode("ascii", "json_ascii")
+    return encoded.decode("ascii")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    DefaultJSONProvider whose compact output (jsonify outside debug mode) goes through orjson.
+    Works for Quart apps too, which use Flask's provider classes.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if kwargs == {"separators": COMPACT_SEPARATORS} and self.sort_keys and self.ensure_ascii:
+            encoded = fast_dumps(obj)
+            if encoded is not None:
+                return encoded
+        return super().dumps(obj, **kwargs)
@@ -0,0 +1,303 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from db.config import LIVE_CLIENT_BUFFER, LIVE_KEEPALIVE_SECONDS, STATE_SNAPSHOT_TTL
+
+logger = logging.getLogger(__name__)
+
+# Latest reading of a camera and the TrafficStates value it gives. updated_at is the end time
+# of the reading; it and the reading values are None for a camera without records.
+CameraState = namedtuple("CameraState", ["state", "updated_at", "average_speed", "vehicle_count"])
+
+
+# ========== STATE TRACKER ==========
+
+class TrafficStateTracker:
+    """
+    Latest-state snapshot of every camera, kept in memory.
+
+    The ingest transaction stages the state of each camera's newest record on the session;
+    once it commits, the states are applied here and every change of TrafficStates value is
+    published to the broadcaster. Cameras are loaded from the database the first time they
+    are asked for, and again once nothing refreshed them for `ttl` seconds, so records
+    ingested by other processes show up too.
+    """
+
+    def __init__(self, broadcaster, ttl):
+        self.broadcaster = broadcaster
+        self.ttl = ttl
+        self.states = {}
+        self.views = {}
+        self.checked = {}
+        self.lock = threading.Lock()
+
+    def stage(self, session, rows, state_of):
+        """
+        Stage the state of the newest of `rows` of each camera; `state_of(row)` classifies a record.
+        """
+        newest = {}
+        for row in rows:
+            current = newest.get(row["traffic_cam_id"])
+            if current is None or row["end_time"] > current["end_time"]:
+                newest[row["traffic_cam_id"]] = row
+        staged = session.info.setdefault("traffic_states", {})
+        for cam_id, row in newest.items():
+            previous = staged.get(cam_id)
+            if previous is None or row["end_time"] > previous.updated_at:
+                staged[cam_id] = CameraState(state_of(row), row["end_time"], row["average_speed"],
+                                             row["vehicle_count"])
+
+    def apply(self, states):
+        """
+        Record new camera states, ignoring readings older than the one already known, and publish
+        the cameras whose state changed.
+        """
+        now = time.monotonic()
+        changes = []
+        with self.lock:
+            for cam_id, new in states.items():
+                self.checked[cam_id] = now
+                current = self.states.get(cam_id)
+                if current is not None and not is_newer(new, current):
+                    continue
+                self.states[cam_id] = new
+                self.views[cam_id] = camera_view(cam_id, new)
+                # a camera's first state is in the snapshot clients get, only transitions are events
+                if current is not None and current.state != new.state:
+                    changes.append(state_event(cam_id, new, current))
+        if changes:
+            self.broadcaster.publish(changes)
+
+    def refresh(self, cam_ids, loader):
+        """
+        Read the cameras never loaded or not refreshed for `ttl` seconds with
+        `loader(cam_ids)` -> {cam_id: CameraState}.
+        """
+        expired = time.monotonic() - self.ttl
+        with self.lock:
+            stale = [cam_id for cam_id in cam_ids if self.checked.get(cam_id, expired) <= expired]
+        if stale:
+            self.apply(loader(stale))
+
+    def snapshot(self, cam_ids, loader):
+        """
+        Current state of `cam_ids` as {cam_id: CameraState}.
+        """
+        self.refresh(cam_ids, loader)
+        with self.lock:
+            return {cam_id: self.states[cam_id] for cam_id in cam_ids if cam_id in self.states}
+
+    def snapshot_views(self, cam_ids, loader):
+        """
+        Current state of `cam_ids` as a list of JSON-ready dicts (shared, not to be modified), in
+        the order of `cam_ids`.
+        """
+        self.refresh(cam_ids, loader)
+        with self.lock:
+            views = self.views
+            return [views[cam_id] for cam_id in cam_ids if cam_id in views]
+
+    def reset(self):
+        with self.lock:
+            self.states = {}
+            self.views = {}
+            self.checked = {}
+
+
+def is_newer(new, current):
+    """
+    Whether `new` is at least as recent as `current`; a reading always beats having none.
+    """
+    if new.updated_at is None:
+        return current.updated_at is None
+    return current.updated_at is None or new.updated_at >= current.updated_at
+
+
+def camera_view(cam_id, camera):
+    return {
+        "traffic_cam_id": cam_id,
+        "traffic_state": camera.state.name,
+        "average_speed": camera.average_speed,
+        "vehicle_count": camera.vehicle_count,
+        "updated_at": camera.updated_at.strftime('%Y-%m-%d %H:%M:%S') if camera.updated_at else None,
+    }
+
+
+def state_event(cam_id, new, previous=None):
+    return {**camera_view(cam_id, new), "previous_state": previous.state.name if previous is not None else None}
+
+
+# ========== BROADCASTER ==========
+
+class Subscriber:
+    """
+    One stream client. Pending events are kept per camera, newest only, so a slow client
+    holds at most one event per camera; past `buffer_size` cameras it is dropped and has to
+    reconnect for a fresh snapshot.
+    """
+
+    def __init__(self, accepts, buffer_size=LIVE_CLIENT_BUFFER):
+        self.accepts = accepts
+        self.buffer_size = buffer_size
+        self.pending = OrderedDict()
+        self.overflowed = False
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+
+    def push(self, events):
+        with self.lock:
+            if self.overflowed:
+                return
+            for e in events:
+                self.pending.pop(e["traffic_cam_id"], None)
+                self.pending[e["traffic_cam_id"]] = e
+            if len(self.pending) > self.buffer_size:
+                self.overflowed = True
+                self.pending.clear()
+        self.signal()
+
+    def signal(self):
+        self.ready.set()
+
+    def drain(self):
+        """
+        Take the pending events. Returns (events, overflowed).
+        """
+        with self.lock:
+            self.ready.clear()
+            events = list(self.pending.values())
+            self.pending.clear()
+            return events, self.overflowed
+
+    def wait(self, timeout):
+        self.ready.wait(timeout)
+
+
+class AsyncSubscriber(Subscriber):
+    """Subscriber awaited from an asyncio event loop; pushes may come from any thread."""
+
+    def __init__(self, accepts, loop, buffer_size=LIVE_CLIENT_BUFFER):
+        super().__init__(accepts, buffer_size)
+        self.loop = loop
+        self.async_ready = asyncio.Event()
+
+    def signal(self):
+        self.loop.call_soon_threadsafe(self.async_ready.set)
+
+    def drain(self):
+        self.async_ready.clear()
+        return super().drain()
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self.async_ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class Broadcaster:
+    """Fans state-change events out to the subscribers whose filter accepts the camera."""
+
+    def __init__(self):
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, events):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            accepted = [e for e in events if subscriber.accepts(e["traffic_cam_id"])]
+            if accepted:
+                subscriber.push(accepted)
+
+    def count(self):
+        with self.lock:
+            return len(self.subscribers)
+
+
+broadcaster = Broadcaster()
+state_tracker = TrafficStateTracker(broadcaster, STATE_SNAPSHOT_TTL)
+
+
+@event.listens_for(Session, "after_commit")
+def apply_traffic_states(session):
+    staged = session.info.pop("traffic_states", None)
+    if not staged:
+        return
+    # the transaction is already committed: a failure here must not reach the caller
+    try:
+        state_tracker.apply(staged)
+    except Exception:
+        logger.exception("Could not apply the states of %d cameras", len(staged))
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_traffic_states(session):
+    session.info.pop("traffic_states", None)
+
+
+# ========== SERVER-SENT EVENTS ==========
+
+def sse(event_name, data):
+    return f"event: {event_name}\ndata: {json.dumps(data)}\n\n"
+
+
+def snapshot_events(states):
+    return sse("snapshot", [camera_view(cam_id, state) for cam_id, state in sorted(states.items())])
+
+
+def stream_events(subscriber, snapshot, keepalive=LIVE_KEEPALIVE_SECONDS):
+    """
+    SSE body for a thread-served client: the snapshot, then state changes as they happen and
+    a comment line every `keepalive` seconds so proxies keep the connection open.
+    """
+    try:
+        yield snapshot_events(snapshot)
+        while True:
+            subscriber.wait(keepalive)
+            events, overflowed = subscriber.drain()
+            if overflowed:
+                yield sse("overflow", {"error": "Client too slow, reconnect for a new snapshot"})
+                return
+            if not events:
+                yield ": keepalive\n\n"
+            for e in events:
+                yield sse("traffic_state", e)
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+async def async_stream_events(subscriber, snapshot, keepalive=LIVE_KEEPALIVE_SECONDS):
+    """
+    stream_events for an asyncio-served client.
+    """
+    try:
+        yield snapshot_events(snapshot)
+        while True:
+            await subscriber.wait(keepalive)
+            events, overflowed = subscriber.drain()
+            if overflowed:
+                yield sse("overflow", {"error": "Client too slow, reconnect for a new snapshot"})
+                return
+            if not events:
+                yield ": keepalive\n\n"
+            for e in events:
+                yield sse("traffic_state", e)
+    finally:
+        broadcaster.unsubscribe(subscriber)
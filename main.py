@@ -1,12 +1,46 @@
-from flask import Flask, request, jsonify
-from dateutil import parser as date_parser  # for parsing ISO 8601 datetimes
+import logging
+import math
+
+from flask import Flask, Response, request, jsonify
 from repository import *
-from db.database import create_tables
+from db.database import create_tables, db_engine
+from db.config import (INGEST_MODE, INGEST_SPOOL_DIR, INGEST_FLUSH_SIZE, INGEST_FLUSH_INTERVAL,
+                       INGEST_SPOOL_FSYNC, INGEST_MAX_ATTEMPTS, INGEST_MAX_BACKLOG, SPATIAL_MAX_RADIUS_METERS)
+from ingest_queue import IngestQueue, QueueFull
+from live import Subscriber, broadcaster, state_tracker, stream_events
+from notifications import NotificationDispatcher, make_sender
+from analytics import (get_peak_hours_vectorized, get_hourly_profile, get_weekly_profile,
+                       get_camera_percentiles, get_timeseries, DEFAULT_TIMESERIES_POINTS)
+from payloads import (EXPORT_CHUNK_SIZE, RequestError, parse_record_body, parse_batch_body, batch_payload,
+                      parse_datetime_range, parse_range_args, parse_congestion_args, parse_ranking_args,
+                      parse_records_args, parse_page_args, parse_export_format, parse_near_args, parse_bbox_args,
+                      parse_flag, parse_percentiles, parse_timeseries_args, stats_response, page_payload,
+                      records_payload, jams_payload, export_headers, wants_ndjson, stream_ndjson)
+from export import EXPORTERS, CONTENT_TYPES
+from json_provider import FastJSONProvider
 from flask_cors import CORS
+import metrics
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)
 
+# Write-behind ingest: /record only spools the payload, a background thread writes it
+ingest_queue = None
+if INGEST_MODE == "queued":
+    ingest_queue = IngestQueue(INGEST_SPOOL_DIR, INGEST_FLUSH_SIZE, INGEST_FLUSH_INTERVAL, INGEST_SPOOL_FSYNC,
+                               max_attempts=INGEST_MAX_ATTEMPTS, max_backlog=INGEST_MAX_BACKLOG)
+    ingest_queue.start()
+
+# Jam notifications are written to the outbox with the alert and delivered from a background thread
+notification_dispatcher = None
+notification_sender = make_sender()
+if notification_sender is not None:
+    notification_dispatcher = NotificationDispatcher(notification_sender)
+    notification_dispatcher.start()
+
 # Automatically add ngrok header to all responses
 def add_ngrok_header(response):
     response.headers['ngrok-skip-browser-warning'] = 'skip-browser-warning'
@@ -14,83 +48,131 @@ def add_ngrok_header(response):
 
 app.after_request(add_ngrok_header)
 
+metrics.init_app(app, db_engine)
+metrics.register(metrics.Gauge("range_cache_entries", "Results held by the range query cache.",
+                               lambda: range_cache.stats()["entries"]))
+metrics.register(metrics.Gauge("range_cache_bytes", "Pickled size of the range query cache.",
+                               lambda: range_cache.stats()["bytes"]))
+metrics.register(metrics.Gauge("live_stream_clients", "Clients connected to /stream/traffic_state.",
+                               broadcaster.count))
+if notification_dispatcher is not None:
+    for key, help_text in (("sent", "Jam notifications delivered."),
+                           ("failed", "Failed jam notification deliveries, retried later."),
+                           ("abandoned", "Jam notifications dropped after the last attempt.")):
+        metrics.register(metrics.Gauge(f"notifications_{key}_total", help_text,
+                                       lambda key=key: notification_dispatcher.stats()[key], "counter"))
+if ingest_queue is not None:
+    metrics.register(metrics.Gauge("ingest_queue_depth", "Spooled records not yet written.",
+                                   lambda: ingest_queue.stats()["queue_depth"]))
+    metrics.register(metrics.Gauge("ingest_queue_lag_seconds", "Age of the oldest spooled record.",
+                                   lambda: ingest_queue.stats()["lag_seconds"]))
+
 @app.route('/record', methods=['POST'])
 def new_traffic_record():
     data = request.get_json()
-    if not data:
-        return jsonify({"error": "No JSON payload provided"}), 400
+    try:
+        row = parse_record_body(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    required_fields = [
-        "traffic_cam_id",
-        "start_datetime",
-        "end_datetime",
-        "vehicle_count",
-        "average_speed"
-    ]
-    missing_fields = [field for field in required_fields if field not in data]
-    if missing_fields:
-        return jsonify({"error": f"Missing fields: {', '.join(missing_fields)}"}), 400
+    if ingest_queue is not None:
+        try:
+            ingest_queue.put(row)
+        except QueueFull as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": str(math.ceil(INGEST_FLUSH_INTERVAL))}
+        except OSError as e:
+            return jsonify({"error": f"Could not spool record: {e}"}), 503
+        return jsonify({"message": "Register queued"}), 202
 
-    print(f"Received new register: {data}")
+    logger.debug("Received new register: %s", data)
 
     try:
-        start_time = date_parser.isoparse(data['start_datetime'])
-        end_time = date_parser.isoparse(data['end_datetime'])
-
         # Use the repository method to insert the record
         add_traffic_record(
-            device_id=data['traffic_cam_id'],
-            start_time=start_time,
-            end_time=end_time,
-            vehicle_count=data['vehicle_count'],
-            average_speed=data['average_speed']
+            device_id=row['traffic_cam_id'],
+            start_time=row['start_time'],
+            end_time=row['end_time'],
+            vehicle_count=row['vehicle_count'],
+            average_speed=row['average_speed']
         )
 
         return jsonify({"message": "Register received successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/records/batch', methods=['POST'])
+def new_traffic_records_batch():
+    try:
+        rows, positions, errors = parse_batch_body(request.get_json(silent=True))
+    except RequestError as e:
+        return jsonify({"error": str(e)}), e.status
+    try:
+        inserted, rejected = add_traffic_records(rows) if rows else (0, [])
+        return jsonify(batch_payload(inserted, rejected, positions, errors)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/ingest/stats', methods=['GET'])
+def ingest_stats():
+    if ingest_queue is None:
+        return jsonify({"mode": INGEST_MODE}), 200
+    return jsonify({"mode": INGEST_MODE, **ingest_queue.stats()}), 200
+
+def conditional_json(payload):
+    """
+    JSON response with a content-hash ETag, answered with 304 when the client already has it.
+    """
+    response = jsonify(payload)
+    response.add_etag()
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @app.route('/cities', methods=['GET'])
 def available_cities():
     try:
-        cities = get_available_cities()
-        return jsonify({"cities": cities}), 200
+        return conditional_json({"cities": get_available_cities()})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/cams', methods=['GET'])
 def all_cams():
     try:
-        c = get_cams()
-        cams_list = [
-            {
-                "id": cam.id,
-                "alias": cam.alias,
-                "city": cam.city,
-                "latitude": float(cam.location_lat),
-                "longitude": float(cam.location_lng)
-            }
-            for cam in c
-        ]
-        return jsonify({"cams": cams_list}), 200
+        return conditional_json({"cams": get_cams()})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/cams/near', methods=['GET'])
+def cams_near():
+    try:
+        lat, lng, radius, limit = parse_near_args(request.args, SPATIAL_MAX_RADIUS_METERS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        cams = get_cams_near(lat, lng, radius, limit)
+        if parse_flag(request.args, 'include_state'):
+            cams = with_traffic_states(cams)
+        return jsonify({"cams": cams}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/cams/bbox', methods=['GET'])
+def cams_in_bbox():
+    try:
+        bbox = parse_bbox_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        cams = get_cams_in_bbox(*bbox)
+        if parse_flag(request.args, 'include_state'):
+            cams = with_traffic_states(cams)
+        return jsonify({"cams": cams}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/cams/<string:city>', methods=['GET'])
 def cams_by_city(city):
     try:
-        cams = get_cams(city)
-        cams_list = [
-            {
-                "id": cam.id,
-                "alias": cam.alias,
-                "city": cam.city,
-                "latitude": float(cam.location_lat),
-                "longitude": float(cam.location_lng)
-            }
-            for cam in cams
-        ]
-        return jsonify({"cams": cams_list}), 200
+        return conditional_json({"cams": get_cams(city)})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -102,60 +184,60 @@ def traffic_state(traffic_cam_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/stats', methods=['GET'])
-def get_traffic_stats():
+@app.route('/traffic_state', methods=['GET'])
+def traffic_state_snapshot():
     try:
-        start_datetime_str = request.args.get('start_datetime')
-        end_datetime_str = request.args.get('end_datetime')
-
-        if not start_datetime_str or not end_datetime_str:
-            return jsonify({"error": "Both 'start_datetime' and 'end_datetime' are required"}), 400
-
-        start_datetime = date_parser.isoparse(start_datetime_str)
-        end_datetime = date_parser.isoparse(end_datetime_str)
+        return conditional_json({"traffic_states": get_traffic_state_snapshot(request.args.get('city'))})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        result = get_traffic_stats_in_range(start_datetime, end_datetime)
+@app.route('/stream/traffic_state', methods=['GET'])
+def stream_traffic_state():
+    """
+    Server-Sent Events: a snapshot of the cameras' traffic state (optionally of one city), then
+    an event each time an ingested record changes a camera's state.
+    """
+    city = request.args.get('city')
+    subscriber = broadcaster.subscribe(Subscriber(camera_filter(city)))
+    try:
+        snapshot = state_tracker.snapshot([cam["id"] for cam in get_cams(city)], load_camera_states)
+    except Exception as e:
+        broadcaster.unsubscribe(subscriber)
+        return jsonify({"error": str(e)}), 500
+    response = Response(stream_events(subscriber, snapshot), mimetype='text/event-stream',
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.call_on_close(lambda: broadcaster.unsubscribe(subscriber))
+    return response
 
-        if result:
-            return jsonify({
-                "average_speed": result.average_speed,
-                "total_vehicle_count": result.total_vehicle_count
-            }), 200
-        else:
-            return jsonify({"error": "No records found for the given date range"}), 404
+@app.route('/stats', methods=['GET'])
+def get_traffic_stats():
+    try:
+        start_datetime, end_datetime = parse_datetime_range(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        payload, status = stats_response(get_traffic_stats_in_range(start_datetime, end_datetime))
+        return jsonify(payload), status
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/peak_hours', methods=['GET'])
 def peak_hours():
-    start_str = request.args.get('start')
-    end_str = request.args.get('end')
-
-    if not start_str or not end_str:
-        return jsonify({"error": "Missing 'start' or 'end' parameters"}), 400
-
     try:
-        start_time = date_parser.isoparse(start_str)
-        end_time = date_parser.isoparse(end_str)
-
-        peak = get_peak_hours(start_time, end_time)
-
-        return jsonify({"peak_hours": peak}), 200
-
+        start_time, end_time = parse_datetime_range(request.args, 'start', 'end')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        return jsonify({"peak_hours": get_peak_hours(start_time, end_time)}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/congestion', methods=['GET'])
 def get_congestion():
-    traffic_cam_id = request.args.get('traffic_cam_id')
-    start_datetime = request.args.get('start_datetime')
-    end_datetime = request.args.get('end_datetime')
-    speed_threshold = request.args.get('speed_threshold', 10, type=int)  # default threshold
-
-    if traffic_cam_id is not None and not traffic_cam_id.isnumeric():
-        return jsonify({"error": "traffic_cam_id is not numeric"}), 400
-    if traffic_cam_id is not None:
-        traffic_cam_id = int(traffic_cam_id)
+    try:
+        traffic_cam_id, start_datetime, end_datetime, speed_threshold = parse_congestion_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     result = get_speed_based_congestion(
         traffic_cam_id,
@@ -166,50 +248,111 @@ def get_congestion():
 
     return jsonify(result)
 
+@app.route('/congestion/ranking', methods=['GET'])
+def congestion_ranking():
+    try:
+        start_datetime, end_datetime, speed_threshold, city = parse_ranking_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        ranking = get_congestion_ranking(start_datetime, end_datetime, speed_threshold, city)
+        return jsonify({"ranking": ranking}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/traffic_records', methods=['GET'])
 def get_traffic_records():
-    start_datetime = request.args.get('start_datetime')
-    end_datetime = request.args.get('end_datetime')
+    try:
+        start_datetime, end_datetime, cam_id, city = parse_records_args(request.args)
+        page = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    if not start_datetime or not end_datetime:
-        return jsonify({"error": "Both start_datetime and end_datetime are required"}), 400
+    if wants_ndjson(request):
+        batches = iter_traffic_records(start_datetime, end_datetime, cam_id, city)
+        return Response(stream_ndjson(batches), mimetype='application/x-ndjson')
 
-    try:
-        from datetime import datetime
-        start_datetime = datetime.strptime(start_datetime, '%Y-%m-%d %H:%M:%S')
-        end_datetime = datetime.strptime(end_datetime, '%Y-%m-%d %H:%M:%S')
-    except ValueError:
-        return jsonify({"error": "Invalid date format, please use YYYY-MM-DD HH:MM:SS"}), 400
+    if page is not None:
+        records, next_key = get_traffic_records_page(start_datetime, end_datetime, *page, cam_id, city)
+        return jsonify(page_payload(records, next_key)), 200
 
-    traffic_records = get_traffic_records_in_range(start_datetime, end_datetime)
+    traffic_records = get_traffic_records_in_range(start_datetime, end_datetime, cam_id, city)
+    return jsonify(records_payload(traffic_records)), 200
 
-    if not traffic_records:
-        return jsonify({"message": "No traffic records found in the given range"}), 200
+@app.route('/traffic_records/export', methods=['GET'])
+def export_traffic_records():
+    try:
+        start_datetime, end_datetime, cam_id, city = parse_records_args(request.args)
+        export_format = parse_export_format(request.args)
+    except RequestError as e:
+        return jsonify({"error": str(e)}), e.status
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    return jsonify({"traffic_records": traffic_records}), 200
+    batches = iter_traffic_record_rows(start_datetime, end_datetime, cam_id, city, EXPORT_CHUNK_SIZE)
+    return Response(EXPORTERS[export_format](batches),
+                    mimetype=CONTENT_TYPES[export_format], headers=export_headers(export_format))
 
 @app.route('/traffic_jams', methods=['GET'])
 def traffic_jams_in_range():
     try:
-        start_datetime_str = request.args.get('start_datetime')
-        end_datetime_str = request.args.get('end_datetime')
-        speed_threshold = request.args.get('speed_threshold', default=20, type=int)
+        start_datetime, end_datetime, cam_id, city = parse_range_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        traffic_jams = get_traffic_jams_in_range(start_datetime, end_datetime, cam_id, city)
+        return jsonify(jams_payload(traffic_jams)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def analytics_response(key, compute, *extra):
+    """
+    Run an analytics.py computation over the dashboard range of the request.
+    """
+    try:
+        start_datetime, end_datetime, cam_id, city = parse_range_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        result = compute(start_datetime, end_datetime, cam_id, city, *extra)
+        return jsonify({key: result}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        if not start_datetime_str or not end_datetime_str:
-            return jsonify({"error": "Both start_datetime and end_datetime are required"}), 400
+@app.route('/analytics/peak_hours', methods=['GET'])
+def analytics_peak_hours():
+    return analytics_response("peak_hours", get_peak_hours_vectorized)
 
-        start_datetime = date_parser.isoparse(start_datetime_str)
-        end_datetime = date_parser.isoparse(end_datetime_str)
+@app.route('/analytics/hourly_profile', methods=['GET'])
+def analytics_hourly_profile():
+    return analytics_response("hourly_profile", get_hourly_profile)
 
-        traffic_jams = get_traffic_jams_in_range(start_datetime, end_datetime, speed_threshold)
+@app.route('/analytics/weekly_profile', methods=['GET'])
+def analytics_weekly_profile():
+    return analytics_response("weekly_profile", get_weekly_profile)
 
-        if not traffic_jams:
-            return jsonify({"message": "No traffic jams found in the specified date range"}), 200
+@app.route('/analytics/percentiles', methods=['GET'])
+def analytics_percentiles():
+    try:
+        percentiles = parse_percentiles(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return analytics_response("percentiles", get_camera_percentiles, percentiles)
 
-        return jsonify({"traffic_jams": traffic_jams}), 200
+@app.route('/timeseries', methods=['GET'])
+def timeseries():
+    try:
+        start_datetime, end_datetime, cam_id, city = parse_range_args(request.args)
+        points, resolution, downsample = parse_timeseries_args(request.args, DEFAULT_TIMESERIES_POINTS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        series = get_timeseries(start_datetime, end_datetime, cam_id, city, points, resolution, downsample)
+        return jsonify(series), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     create_tables()
     app.run(host="localhost", port=5001, debug=True)
@@ -0,0 +1,242 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from flask import Response, request
+from sqlalchemy import event
+
+from db.config import SLOW_QUERY_THRESHOLD_MS
+from repository import duplicate_records, on_ingest
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels."""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help_text, self.labels = name, help_text, labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, label_values)} {format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time. `metric_type` is "counter" for totals kept elsewhere."""
+
+    def __init__(self, name, help_text, read, metric_type="gauge"):
+        self.name, self.help_text, self.read, self.metric_type = name, help_text, read, metric_type
+
+    def render(self):
+        value = self.read()
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}",
+                f"{self.name} {format_value(value)}"]
+
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally split by labels."""
+
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name, self.help_text, self.buckets, self.labels = name, help_text, buckets, labels
+        self.series = {}  # label values -> [bucket counts, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label_values, (counts, total, count) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = format_labels(self.labels, label_values, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = format_labels(self.labels, label_values, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, label_values)} {format_value(total)}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, label_values)} {count}")
+        return lines
+
+
+# ========== Registry ==========
+
+registry = []
+
+
+def register(metric):
+    registry.append(metric)
+    return metric
+
+
+request_latency = register(Histogram(
+    "http_request_duration_seconds", "Time spent handling a request.",
+    LATENCY_BUCKETS, ("method", "endpoint", "status")))
+request_queries = register(Histogram(
+    "http_request_db_queries", "SQL statements executed per request.",
+    QUERY_COUNT_BUCKETS, ("method", "endpoint")))
+request_db_time = register(Histogram(
+    "http_request_db_seconds", "Time spent in the database per request.",
+    LATENCY_BUCKETS, ("method", "endpoint")))
+sql_queries = register(Counter("db_queries_total", "SQL statements executed."))
+sql_seconds = register(Counter("db_query_seconds_total", "Time spent executing SQL statements."))
+slow_queries = register(Counter("db_slow_queries_total", "SQL statements slower than the slow query threshold."))
+ingested_rows = register(Counter("ingest_rows_total", "Traffic records written to the database."))
+duplicate_rows = register(Gauge("ingest_duplicate_rows_total",
+                                "Traffic records skipped because they were already stored (device retries).",
+                                lambda: duplicate_records.total, "counter"))
+jam_alerts = register(Counter("jam_alerts_total", "Traffic jam episodes started."))
+jam_alerts_ended = register(Counter("jam_alerts_ended_total", "Traffic jam episodes cleared."))
+
+
+@on_ingest
+def count_ingest(rows, alerts, ended):
+    ingested_rows.inc(len(rows))
+    jam_alerts.inc(len(alerts))
+    jam_alerts_ended.inc(len(ended))
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ========== SQL instrumentation ==========
+
+class RequestStats:
+    """SQL work done on behalf of one request."""
+
+    __slots__ = ("started", "queries", "db_time")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+
+
+# a context variable rather than a thread local, so requests served as asyncio tasks
+# (async_main.py) and the threads they delegate to are attributed correctly
+request_stats = ContextVar("request_stats", default=None)
+
+
+def instrument_engine(engine):
+    """
+    Count every statement and its duration, globally and for the request being served.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        sql_queries.inc()
+        sql_seconds.inc(elapsed)
+        stats = request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+        if elapsed * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+            slow_queries.inc()
+            logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, " ".join(statement.split()))
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+        if started:
+            started.pop()
+
+
+# ========== Request hooks ==========
+
+def start_request():
+    """
+    Begin attributing SQL statements to the current request.
+    """
+    stats = RequestStats()
+    request_stats.set(stats)
+    return stats
+
+
+def finish_request(method, endpoint, status):
+    """
+    Record the latency and SQL usage of the current request.
+    """
+    stats = request_stats.get()
+    if stats is None:
+        return
+    request_latency.observe(time.perf_counter() - stats.started, method, endpoint, status)
+    request_queries.observe(stats.queries, method, endpoint)
+    request_db_time.observe(stats.db_time, method, endpoint)
+    request_stats.set(None)
+
+
+def endpoint_label(request):
+    return request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+
+
+def before_request():
+    start_request()
+
+
+def after_request(response):
+    finish_request(request.method, endpoint_label(request), response.status_code)
+    return response
+
+
+def metrics_view():
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+
+def init_app(app, engine):
+    """
+    Instrument a Flask app and its SQLAlchemy engine and serve everything on /metrics.
+    """
+    instrument_engine(engine)
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view, methods=["GET"])
@@ -0,0 +1,349 @@
+import json
+import logging
+import threading
+import time
+import urllib.error
+import urllib.request
+from abc import ABC, abstractmethod
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, insert, or_, update
+from sqlalchemy.orm import Session
+
+from db.config import (METADATA_CACHE_TTL, NOTIFY_SENDER, TELEGRAM_BOT_TOKEN, NOTIFY_RATE_PER_SECOND,
+                       NOTIFY_BATCH_SIZE, NOTIFY_MAX_ATTEMPTS, NOTIFY_POLL_INTERVAL)
+from db.database import SessionLocal
+from db.entities import NotificationOutbox, Subscription, TelegramBotUser, TrafficCam, TrafficJamAlert
+
+logger = logging.getLogger(__name__)
+
+Notification = namedtuple("Notification", ["id", "user_id", "traffic_cam_id", "kind", "text"])
+
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 3600
+# a claim older than this belongs to a dispatcher that died mid-batch, its rows are sent again
+CLAIM_TIMEOUT_SECONDS = 600
+
+
+# ========== SUBSCRIBER INDEX ==========
+
+class SubscriberIndex:
+    """
+    In-memory camera id -> subscribed user ids, loaded in one query.
+    Dropped whenever a Subscription is committed through the ORM, and after `ttl` seconds
+    so changes made by other processes (the bot) are picked up too.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.by_cam = None
+        self.expires = 0
+        self.lock = threading.Lock()
+
+    def subscribers(self, session, cam_id):
+        by_cam = self.by_cam
+        if by_cam is None or time.monotonic() >= self.expires:
+            by_cam = self.load(session)
+        return by_cam.get(cam_id, ())
+
+    def load(self, session):
+        by_cam = defaultdict(list)
+        for cam_id, user_id in session.query(Subscription.traffic_cam_id, Subscription.user_id):
+            by_cam[cam_id].append(user_id)
+        by_cam = {cam_id: tuple(users) for cam_id, users in by_cam.items()}
+        with self.lock:
+            self.by_cam = by_cam
+            self.expires = time.monotonic() + self.ttl
+        return by_cam
+
+    def invalidate(self):
+        with self.lock:
+            self.by_cam = None
+
+
+subscriber_index = SubscriberIndex(METADATA_CACHE_TTL)
+
+
+@event.listens_for(Session, "after_flush")
+def track_subscription_changes(session, flush_context):
+    if any(isinstance(obj, (Subscription, TelegramBotUser)) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info["subscriptions_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def after_notification_commit(session):
+    if session.info.pop("subscriptions_changed", False):
+        subscriber_index.invalidate()
+    if session.info.pop("notifications_staged", False):
+        for dispatcher in dispatchers:
+            dispatcher.wake()
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_notification_changes(session):
+    session.info.pop("subscriptions_changed", None)
+    session.info.pop("notifications_staged", None)
+
+
+# ========== OUTBOX ==========
+
+def stage_notifications(session, started, ended):
+    """
+    Write one outbox row per subscriber of each camera whose jam started or ended, in the
+    transaction that records the alert. Returns the number of rows staged.
+    """
+    now = datetime.now()
+    rows = [
+        {
+            "user_id": user_id,
+            "traffic_cam_id": alert.traffic_cam_id,
+            "alert_id": alert.id,
+            "kind": kind,
+            "created_at": now,
+            "attempts": 0,
+            "next_attempt_at": now,
+        }
+        for kind, alerts in ((NotificationOutbox.JAM_STARTED, started), (NotificationOutbox.JAM_ENDED, ended))
+        for alert in alerts
+        for user_id in subscriber_index.subscribers(session, alert.traffic_cam_id)
+    ]
+    if rows:
+        session.execute(insert(NotificationOutbox), rows)
+        session.info["notifications_staged"] = True
+    return len(rows)
+
+
+def notification_text(kind, alias, city, started_at, ended_at):
+    if kind == NotificationOutbox.JAM_ENDED:
+        return f"Traffic jam cleared at {alias} ({city}) at {ended_at:%H:%M}."
+    return f"Traffic jam at {alias} ({city}) since {started_at:%H:%M}."
+
+
+# ========== SENDERS ==========
+
+class Sender(ABC):
+    """Delivers one notification; raises to have it retried later."""
+
+    @abstractmethod
+    def send(self, notification):
+        ...
+
+
+class LogSender(Sender):
+    def send(self, notification):
+        logger.info("Notify user %s: %s", notification.user_id, notification.text)
+
+
+class StubSender(Sender):
+    """Keeps notifications in memory; fails the first `failures` sends. For tests."""
+
+    def __init__(self, failures=0):
+        self.sent = []
+        self.failures = failures
+        self.lock = threading.Lock()
+
+    def send(self, notification):
+        with self.lock:
+            if self.failures > 0:
+                self.failures -= 1
+                raise RuntimeError("stub failure")
+            self.sent.append(notification)
+
+
+class TelegramSender(Sender):
+    """Sends the text to the user's chat through the Telegram Bot API."""
+
+    def __init__(self, token, timeout=10):
+        self.url = f"https://api.telegram.org/bot{token}/sendMessage"
+        self.timeout = timeout
+
+    def send(self, notification):
+        body = json.dumps({"chat_id": notification.user_id, "text": notification.text}).encode()
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f"Telegram API returned {e.code}: {e.read()[:200]!r}")
+
+
+def make_sender(name=NOTIFY_SENDER):
+    """
+    Build the sender configured by NOTIFY_SENDER, or None to leave the outbox undelivered.
+    """
+    if name == "none":
+        return None
+    if name == "log":
+        return LogSender()
+    if name == "telegram":
+        if not TELEGRAM_BOT_TOKEN:
+            raise ValueError("NOTIFY_SENDER=telegram requires TELEGRAM_BOT_TOKEN")
+        return TelegramSender(TELEGRAM_BOT_TOKEN)
+    raise ValueError(f"Unknown NOTIFY_SENDER '{name}'")
+
+
+# ========== DISPATCHER ==========
+
+class RateLimiter:
+    """Token bucket allowing `rate` operations per second, with bursts of up to `rate`."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) / self.rate)
+
+
+dispatchers = []
+
+
+class NotificationDispatcher:
+    """
+    Background thread delivering the outbox in batches.
+
+    Woken right after a transaction stages notifications, and every `poll_interval` seconds
+    for retries and rows written by other processes. A batch is claimed by setting claimed_at
+    in a short transaction (SELECT ... FOR UPDATE SKIP LOCKED on MySQL), so several app
+    processes can dispatch the same outbox without holding row locks while they send. Failed
+    sends are retried with exponential backoff up to `max_attempts` times.
+    """
+
+    def __init__(self, sender, rate=NOTIFY_RATE_PER_SECOND, batch_size=NOTIFY_BATCH_SIZE,
+                 max_attempts=NOTIFY_MAX_ATTEMPTS, poll_interval=NOTIFY_POLL_INTERVAL):
+        self.sender = sender
+        self.limiter = RateLimiter(rate)
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.wakeup = threading.Event()
+        self.thread = None
+
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.abandoned = 0
+        self.last_error = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        dispatchers.append(self)
+        self.thread = threading.Thread(target=self.run, name="notification-dispatcher", daemon=True)
+        self.thread.start()
+
+    def wake(self):
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+            try:
+                while self.dispatch_batch() == self.batch_size:
+                    pass
+            except Exception as e:
+                with self.lock:
+                    self.last_error = str(e)
+                logger.exception("Error dispatching notifications")
+
+    def dispatch_batch(self):
+        """
+        Deliver up to `batch_size` due notifications. Returns how many were attempted.
+        """
+        rows = self.claim_batch()
+        results = []
+        for outbox, alias, city, started_at, ended_at in rows:
+            notification = Notification(outbox.id, outbox.user_id, outbox.traffic_cam_id, outbox.kind,
+                                        notification_text(outbox.kind, alias, city, started_at, ended_at))
+            self.limiter.acquire()
+            try:
+                self.sender.send(notification)
+            except Exception as e:
+                results.append(self.record_failure(outbox, str(e)))
+                continue
+            results.append({"id": outbox.id, "sent_at": datetime.now(), "claimed_at": None})
+            with self.lock:
+                self.sent += 1
+        if results:
+            with SessionLocal() as session:
+                session.execute(update(NotificationOutbox), results)
+                session.commit()
+        return len(rows)
+
+    def claim_batch(self):
+        """
+        Mark up to `batch_size` due notifications as claimed by this dispatcher and return them
+        with the camera and alert fields of their text.
+        """
+        now = datetime.now()
+        claimable = or_(NotificationOutbox.claimed_at.is_(None),
+                        NotificationOutbox.claimed_at < now - timedelta(seconds=CLAIM_TIMEOUT_SECONDS))
+        with SessionLocal() as session:
+            rows = (
+                session.query(NotificationOutbox, TrafficCam.alias, TrafficCam.city,
+                              TrafficJamAlert.event_time, TrafficJamAlert.ended_at)
+                .join(TrafficCam, NotificationOutbox.traffic_cam_id == TrafficCam.id)
+                .join(TrafficJamAlert, NotificationOutbox.alert_id == TrafficJamAlert.id)
+                .filter(
+                    NotificationOutbox.sent_at.is_(None),
+                    NotificationOutbox.next_attempt_at <= now,
+                    NotificationOutbox.attempts < self.max_attempts,
+                    claimable
+                )
+                .order_by(NotificationOutbox.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True, of=NotificationOutbox)
+                .all()
+            )
+            if not rows:
+                return []
+            ids = [row[0].id for row in rows]
+            # conditional, for SQLite where the rows were read without a lock
+            claimed = session.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.id.in_(ids), claimable)
+                .values(claimed_at=now)
+            ).rowcount
+            if claimed < len(ids):
+                mine = {outbox_id for (outbox_id,) in session.query(NotificationOutbox.id).filter(
+                    NotificationOutbox.id.in_(ids), NotificationOutbox.claimed_at == now
+                )}
+                rows = [row for row in rows if row[0].id in mine]
+            session.commit()
+        return rows
+
+    def record_failure(self, outbox, error):
+        """
+        Count a failed send and return the outbox update scheduling its retry.
+        """
+        attempts = outbox.attempts + 1
+        delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+        with self.lock:
+            self.failed += 1
+            self.last_error = error
+            if attempts >= self.max_attempts:
+                self.abandoned += 1
+                logger.warning("Giving up on notification %s after %d attempts: %s", outbox.id, attempts, error)
+        return {"id": outbox.id, "attempts": attempts, "last_error": error[:255],
+                "next_attempt_at": datetime.now() + timedelta(seconds=delay), "claimed_at": None}
+
+    def stats(self):
+        with self.lock:
+            return {
+                "sent": self.sent,
+                "failed": self.failed,
+                "abandoned": self.abandoned,
+                "last_error": self.last_error,
+            }
@@ -0,0 +1,324 @@
+import base64
+import json
+from datetime import datetime
+
+from dateutil import parser as date_parser  # for parsing ISO 8601 datetimes
+
+from export import EXPORTERS, FILE_EXTENSIONS, available_formats, default_format
+from utils import wall_clock
+
+# Request parsing and response encoding shared by the Flask app (main.py) and the async app (async_main.py)
+
+RECORD_FIELDS = [
+    "traffic_cam_id",
+    "start_datetime",
+    "end_datetime",
+    "vehicle_count",
+    "average_speed"
+]
+
+MAX_BATCH_SIZE = 5000
+MAX_NEAR_RESULTS = 1000
+MAX_TIMESERIES_POINTS = 5000
+DOWNSAMPLE_METHODS = ("lttb",)
+MAX_PAGE_SIZE = 10000
+EXPORT_CHUNK_SIZE = 50000
+DEFAULT_SPEED_THRESHOLD = 10
+RECORD_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class RequestError(ValueError):
+    """
+    A rejected request, with the HTTP status to answer it with.
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_datetime(value):
+    """
+    Parse an ISO 8601 timestamp, of a record or a query range, as the naive wall-clock datetime
+    stored in the database. A UTC offset is dropped, not converted.
+    """
+    return wall_clock(date_parser.isoparse(value))
+
+
+def parse_traffic_record(data):
+    """
+    Validate a record payload and convert it to TrafficRecord column values.
+    Raises ValueError describing the first problem found.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Record must be a JSON object")
+    missing_fields = [field for field in RECORD_FIELDS if field not in data]
+    if missing_fields:
+        raise ValueError(f"Missing fields: {', '.join(missing_fields)}")
+    try:
+        return {
+            "traffic_cam_id": int(data['traffic_cam_id']),
+            "start_time": parse_datetime(data['start_datetime']),
+            "end_time": parse_datetime(data['end_datetime']),
+            "vehicle_count": int(data['vehicle_count']),
+            "average_speed": float(data['average_speed']),
+        }
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid field value: {e}")
+
+
+def parse_record_body(data):
+    """
+    Validate the JSON body of /record. Raises ValueError describing the first problem found.
+    """
+    if not data:
+        raise ValueError("No JSON payload provided")
+    return parse_traffic_record(data)
+
+
+def parse_batch_body(data):
+    """
+    Validate the JSON body of /records/batch, a bare array or {"records": [...]}. Returns the parsed
+    rows, their positions in the batch and the errors of the items that could not be parsed.
+    Raises RequestError when the batch is empty or too large.
+    """
+    if isinstance(data, dict):
+        data = data.get("records")
+    if not isinstance(data, list) or not data:
+        raise RequestError("Expected a non-empty JSON array of records")
+    if len(data) > MAX_BATCH_SIZE:
+        raise RequestError(f"Batch too large, max {MAX_BATCH_SIZE} records", 413)
+
+    rows, positions, errors = [], [], []
+    for index, item in enumerate(data):
+        try:
+            rows.append(parse_traffic_record(item))
+            positions.append(index)
+        except ValueError as e:
+            errors.append({"index": index, "error": str(e)})
+    return rows, positions, errors
+
+
+def batch_payload(inserted, rejected, positions, errors):
+    """
+    Response of /records/batch: the parse errors merged with the rows the repository rejected,
+    in batch order.
+    """
+    errors = errors + [{"index": positions[pos], "error": error} for pos, error in rejected]
+    errors.sort(key=lambda e: e["index"])
+    return {"inserted": inserted, "errors": errors}
+
+
+def parse_datetime_range(args, start_name='start_datetime', end_name='end_datetime'):
+    """
+    Read a required pair of ISO 8601 query parameters. Raises ValueError when one is missing or malformed.
+    """
+    start_str = args.get(start_name)
+    end_str = args.get(end_name)
+    if not start_str or not end_str:
+        raise ValueError(f"Both '{start_name}' and '{end_name}' are required")
+    return parse_datetime(start_str), parse_datetime(end_str)
+
+
+def parse_optional_range(args):
+    """
+    Read the start_datetime/end_datetime query parameters where both may be left out (None).
+    """
+    start_str = args.get('start_datetime')
+    end_str = args.get('end_datetime')
+    return parse_datetime(start_str) if start_str else None, parse_datetime(end_str) if end_str else None
+
+
+def parse_range_args(args):
+    """
+    Read the start_datetime/end_datetime, cam_id and city query parameters of dashboard endpoints.
+    Raises ValueError when the range is missing or malformed.
+    """
+    return (*parse_datetime_range(args), args.get('cam_id', type=int), args.get('city'))
+
+
+def parse_congestion_args(args):
+    """
+    Read the traffic_cam_id, optional range and speed_threshold query parameters of /congestion.
+    """
+    traffic_cam_id = args.get('traffic_cam_id')
+    if traffic_cam_id is not None and not traffic_cam_id.isnumeric():
+        raise ValueError("traffic_cam_id is not numeric")
+    if traffic_cam_id is not None:
+        traffic_cam_id = int(traffic_cam_id)
+    return (traffic_cam_id, *parse_optional_range(args),
+            args.get('speed_threshold', DEFAULT_SPEED_THRESHOLD, type=int))
+
+
+def parse_ranking_args(args):
+    """
+    Read the optional range, speed_threshold and city query parameters of /congestion/ranking.
+    """
+    return (*parse_optional_range(args), args.get('speed_threshold', DEFAULT_SPEED_THRESHOLD, type=int),
+            args.get('city'))
+
+
+def stats_response(result):
+    if not result:
+        return {"error": "No records found for the given date range"}, 404
+    return {"average_speed": result.average_speed, "total_vehicle_count": result.total_vehicle_count}, 200
+
+
+def parse_records_args(args):
+    """
+    Read the start_datetime/end_datetime (YYYY-MM-DD HH:MM:SS), cam_id and city query parameters
+    of /traffic_records and its export. Raises ValueError when the range is missing or malformed.
+    """
+    start_datetime = args.get('start_datetime')
+    end_datetime = args.get('end_datetime')
+    if not start_datetime or not end_datetime:
+        raise ValueError("Both start_datetime and end_datetime are required")
+    try:
+        start_datetime = datetime.strptime(start_datetime, RECORD_TIME_FORMAT)
+        end_datetime = datetime.strptime(end_datetime, RECORD_TIME_FORMAT)
+    except ValueError:
+        raise ValueError("Invalid date format, please use YYYY-MM-DD HH:MM:SS")
+    return start_datetime, end_datetime, args.get('cam_id', type=int), args.get('city')
+
+
+def wants_ndjson(request):
+    return request.args.get('stream') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson'
+
+
+def parse_page_args(args):
+    """
+    Read the limit and cursor query parameters of /traffic_records as (limit, key after which the
+    page starts), or None when neither is given and the whole range is answered at once.
+    """
+    limit = args.get('limit', type=int)
+    cursor = args.get('cursor')
+    if limit is None and cursor is None:
+        return None
+    limit = min(limit or MAX_PAGE_SIZE, MAX_PAGE_SIZE)
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    return limit, after
+
+
+def page_payload(records, next_key):
+    return {"traffic_records": records, "next_cursor": encode_cursor(next_key) if next_key else None}
+
+
+def records_payload(records):
+    if not records:
+        return {"message": "No traffic records found in the given range"}
+    return {"traffic_records": records}
+
+
+def jams_payload(traffic_jams):
+    if not traffic_jams:
+        return {"message": "No traffic jams found in the specified date range"}
+    return {"traffic_jams": traffic_jams}
+
+
+def parse_export_format(args):
+    """
+    Read the format query parameter of /traffic_records/export. Raises RequestError for an unknown
+    format, or with 501 for a columnar format when pyarrow is not installed.
+    """
+    export_format = args.get('format', default_format())
+    if export_format not in EXPORTERS:
+        raise RequestError(f"Unknown format, use one of: {', '.join(EXPORTERS)}")
+    if export_format not in available_formats():
+        raise RequestError(f"Format '{export_format}' requires pyarrow, use 'csv' instead", 501)
+    return export_format
+
+
+def export_headers(export_format):
+    filename = f"traffic_records.{FILE_EXTENSIONS[export_format]}"
+    return {"Content-Disposition": f"attachment; filename={filename}"}
+
+
+def parse_percentiles(args):
+    """
+    Read the comma separated percentiles query parameter of /analytics/percentiles, whole ones as int.
+    """
+    percentiles = [float(p) for p in args.get('percentiles', '50,85,95').split(',')]
+    if not all(0 <= p <= 100 for p in percentiles):
+        raise ValueError("percentiles must be between 0 and 100")
+    return [int(p) if p.is_integer() else p for p in percentiles]
+
+
+def parse_timeseries_args(args, default_points):
+    """
+    Read the points, resolution (seconds) and downsample query parameters of /timeseries.
+    Raises ValueError when one is out of range.
+    """
+    points = args.get('points', default_points, type=int)
+    if not 3 <= points <= MAX_TIMESERIES_POINTS:
+        raise ValueError(f"'points' must be between 3 and {MAX_TIMESERIES_POINTS}")
+    resolution = args.get('resolution', type=int)
+    if resolution is not None and resolution <= 0:
+        raise ValueError("'resolution' must be a positive number of seconds")
+    downsample = args.get('downsample')
+    if downsample is not None and downsample not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"'downsample' must be one of: {', '.join(DOWNSAMPLE_METHODS)}")
+    return points, resolution, downsample
+
+
+def parse_coordinate(args, name, limit):
+    value = args.get(name, type=float)
+    if value is None:
+        raise ValueError(f"'{name}' is required and must be a number")
+    if not -limit <= value <= limit:
+        raise ValueError(f"'{name}' must be between -{limit} and {limit}")
+    return value
+
+
+def parse_near_args(args, max_radius):
+    """
+    Read the lat, lng, radius (meters) and limit query parameters of /cams/near.
+    Raises ValueError when one is missing or out of range.
+    """
+    lat = parse_coordinate(args, 'lat', 90)
+    lng = parse_coordinate(args, 'lng', 180)
+    radius = args.get('radius', type=float)
+    if radius is None or not 0 < radius <= max_radius:
+        raise ValueError(f"'radius' must be a number of meters between 0 and {max_radius:g}")
+    limit = args.get('limit', MAX_NEAR_RESULTS, type=int)
+    if not 0 < limit <= MAX_NEAR_RESULTS:
+        raise ValueError(f"'limit' must be between 1 and {MAX_NEAR_RESULTS}")
+    return lat, lng, radius, limit
+
+
+def parse_bbox_args(args):
+    """
+    Read the min_lat, min_lng, max_lat and max_lng query parameters of /cams/bbox.
+    min_lng greater than max_lng means the box crosses the antimeridian.
+    """
+    min_lat = parse_coordinate(args, 'min_lat', 90)
+    min_lng = parse_coordinate(args, 'min_lng', 180)
+    max_lat = parse_coordinate(args, 'max_lat', 90)
+    max_lng = parse_coordinate(args, 'max_lng', 180)
+    if min_lat > max_lat:
+        raise ValueError("'min_lat' must not be greater than 'max_lat'")
+    return min_lat, min_lng, max_lat, max_lng
+
+
+def parse_flag(args, name):
+    return args.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+def encode_cursor(key):
+    start_time, record_id = key
+    raw = f"{start_time.strftime('%Y-%m-%d %H:%M:%S.%f')}|{record_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    start_time, record_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S.%f'), int(record_id)
+
+
+def stream_ndjson(batches):
+    for batch in batches:
+        yield "".join(json.dumps(record) + "\n" for record in batch)
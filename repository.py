@@ -1,21 +1,39 @@
 import sys
 import os
-from datetime import datetime
-from functools import wraps
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache, wraps
 from contextlib import contextmanager
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, namedtuple
 from math import floor
 
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import Session
 
 # Ensure project root is in path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from sqlalchemy import desc, extract, Integer, func
+from sqlalchemy import (desc, extract, Integer, func, insert, delete, select, literal, or_, and_, case, event,
+                        bindparam, union_all, type_coerce, Float)
+from db.config import (BASELINE_BY_HOUR_OF_WEEK, BASELINE_MIN_HOUR_SAMPLES, METADATA_CACHE_TTL,
+                       RESULT_CACHE_GRANULARITY, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL, SPATIAL_CELL_DEGREES)
 from db.database import SessionLocal
-from db.entities import TrafficRecord, TrafficCam, TrafficJamAlert
+from db.dialect import (SQLITE, upsert, insert_new, greatest, least, date_of, hour_of_week as hour_of_week_expr,
+                        hour_floor, format_datetime, unindexed)
+from db.entities import (TrafficRecord, TrafficCam, TrafficJamAlert, SpeedBaseline, TrafficHourlyRollup,
+                         CacheGeneration)
+from jam_detector import jam_detector
+from live import CameraState, state_tracker
+from notifications import stage_notifications
+from result_cache import RangeResultCache
+from spatial import SpatialGrid
 from utils import TrafficStates
 
+logger = logging.getLogger(__name__)
+
+TrafficStats = namedtuple("TrafficStats", ["average_speed", "total_vehicle_count"])
+
 
 @contextmanager
 def session_scope():
@@ -49,12 +67,12 @@ def handle_exceptions(func):
     return wrapper
 
 
-def apply_filters(query, cam_id=None, city=None):
+def apply_filters(query, cam_id=None, city=None, model=TrafficRecord):
     """
-    Apply optional camera ID and city filters to a Query.
+    Apply optional camera ID and city filters to a Query over `model`.
     """
     if cam_id is not None:
-        query = query.filter(TrafficRecord.traffic_cam_id == cam_id)
+        query = query.filter(model.traffic_cam_id == cam_id)
     if city is not None:
         query = query.join(TrafficCam).filter(TrafficCam.city == city)
     return query
@@ -84,90 +102,822 @@ def record_to_dict(record):
     }
 
 
+# ========== METADATA CACHE ==========
+
+class MetadataCache:
+    """
+    In-process cache for data that rarely changes (cameras, cities).
+    Entries expire after `ttl` seconds and are dropped whenever a TrafficCam is committed.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, loader):
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        value = loader()
+        with self.lock:
+            self.entries[key] = (now + self.ttl, value)
+        return value
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+
+
+metadata_cache = MetadataCache(METADATA_CACHE_TTL)
+
+
+def invalidate_metadata_cache():
+    """
+    Drop cached camera metadata. Call after changing traffic_cams outside of the ORM.
+    """
+    metadata_cache.invalidate()
+
+
+@event.listens_for(Session, "after_flush")
+def track_camera_changes(session, flush_context):
+    if any(isinstance(obj, TrafficCam) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info["cameras_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_on_camera_commit(session):
+    if session.info.pop("cameras_changed", False):
+        invalidate_metadata_cache()
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_camera_changes(session):
+    session.info.pop("cameras_changed", None)
+
+
+# Coordinates are Numeric(9,6): read them as floats rather than through Decimal, rounded back to the
+# column's scale so the response matches float(Decimal)
+CAMS_STATEMENT = select(
+    TrafficCam.id, TrafficCam.alias, TrafficCam.city,
+    type_coerce(TrafficCam.location_lat, Float), type_coerce(TrafficCam.location_lng, Float)
+).order_by(TrafficCam.id)
+
+
+def load_cams():
+    with session_scope() as session:
+        return [
+            {
+                "id": cam_id,
+                "alias": alias,
+                "city": city,
+                "latitude": round(lat, 6),
+                "longitude": round(lng, 6)
+            }
+            for cam_id, alias, city, lat, lng in session.connection().execute(CAMS_STATEMENT).all()
+        ]
+
+
+# ========== RANGE RESULT CACHE ==========
+
+RANGE_CACHE_GENERATION = "range_cache"
+
+
+def read_cache_generation():
+    with session_scope() as session:
+        generation = session.query(CacheGeneration.generation).filter(
+            CacheGeneration.name == RANGE_CACHE_GENERATION
+        ).scalar()
+        return generation or 0
+
+
+def bump_cache_generation():
+    """
+    Make every app process drop its cached range results within a few seconds. Call after
+    changing traffic data outside of the ingest path (maintenance commands, migrations).
+    """
+    range_cache.clear()
+    with session_scope() as session:
+        session.execute(upsert(CacheGeneration, [{"name": RANGE_CACHE_GENERATION, "generation": 1}],
+                               lambda incoming: {"generation": CacheGeneration.generation + 1}))
+
+
+range_cache = RangeResultCache(RESULT_CACHE_GRANULARITY, RESULT_CACHE_MAX_BYTES, ttl=RESULT_CACHE_TTL,
+                               generation=read_cache_generation)
+
+ingest_listeners = []
+
+
+def on_ingest(listener):
+    """
+    Register `listener(rows, alerts, ended)` to be called after ingested records are committed.
+    `alerts` are the jam episodes the records started and `ended` those they closed.
+    """
+    ingest_listeners.append(listener)
+    return listener
+
+
+def notify_ingest(rows, alerts, ended=()):
+    for listener in ingest_listeners:
+        try:
+            listener(rows, alerts, ended)
+        except Exception:
+            logger.exception("Error in ingest listener %s", listener.__name__)
+
+
+@on_ingest
+def invalidate_range_cache(rows, alerts, ended):
+    """
+    Drop the cached results whose camera and window cover the new records or jam episodes.
+    """
+    windows = {}
+    for row in rows:
+        cam_id = row["traffic_cam_id"]
+        start, end = windows.get(cam_id, (row["start_time"], row["end_time"]))
+        windows[cam_id] = (min(start, row["start_time"]), max(end, row["end_time"]))
+    changes = [(cam_id, start, end) for cam_id, (start, end) in windows.items()]
+    changes.extend(
+        (alert.traffic_cam_id, alert.event_time, alert.ended_at or alert.event_time)
+        for alert in (*alerts, *ended)
+    )
+    if not changes:
+        return
+
+    cities = get_cam_cities()
+    for cam_id, start, end in changes:
+        range_cache.invalidate(cam_id, cities.get(cam_id), start, end)
+
+
 # ========== TELEGRAM ==========
 
 @handle_exceptions
 def get_available_cities():
-    with session_scope() as session:
-        result = session.query(TrafficCam.city).all()
-        return [city for (city,) in result]
+    return metadata_cache.get("cities", lambda: sorted({cam["city"] for cam in get_cams()}))
 
 
 @handle_exceptions
 def get_cams(city=None):
+    """
+    Cameras as plain dicts, optionally only those of one city. Served from the metadata cache.
+    """
+    cams = metadata_cache.get("cams", load_cams)
+    if city:
+        return [cam for cam in cams if cam["city"] == city]
+    return cams
+
+
+# ========== CAMERA LOCATIONS ==========
+
+def spatial_index():
+    """
+    Grid index over the camera locations, rebuilt along with the cached camera list.
+    """
+    return metadata_cache.get("spatial_index", lambda: SpatialGrid(get_cams(), SPATIAL_CELL_DEGREES))
+
+
+@handle_exceptions
+def get_cams_near(lat: float, lng: float, radius_meters: float, limit: int = None):
+    """
+    Cameras within `radius_meters` of a point, closest first, each with its "distance" in meters.
+    """
+    return [
+        {**cam, "distance": round(distance, 1)}
+        for distance, cam in spatial_index().near(lat, lng, radius_meters, limit)
+    ]
+
+
+@handle_exceptions
+def get_cams_in_bbox(min_lat: float, min_lng: float, max_lat: float, max_lng: float):
+    """
+    Cameras inside a map viewport, ordered by id.
+    """
+    return spatial_index().within_bbox(min_lat, min_lng, max_lat, max_lng)
+
+
+def with_traffic_states(cams):
+    """
+    Copies of camera dicts with their current "traffic_state" added.
+    """
+    states = get_traffic_states([cam["id"] for cam in cams])
+    return [{**cam, "traffic_state": states[cam["id"]].name} for cam in cams]
+
+
+def get_cam_cities():
+    """
+    {camera id: city}, served from the metadata cache.
+    """
+    return metadata_cache.get("cam_cities", lambda: {cam["id"]: cam["city"] for cam in get_cams()})
+
+
+def camera_filter(city=None):
+    """
+    Predicate on camera ids accepting the cameras of `city`, or every camera.
+    """
+    if not city:
+        return lambda cam_id: True
+    return lambda cam_id: get_cam_cities().get(cam_id) == city
+
+
+def classify_speed(current_speed, avg_speed):
+    """
+    Map a speed reading to a TrafficStates value relative to the camera's average speed.
+    """
+    if current_speed >= avg_speed * 1.2:
+        return TrafficStates.Low
+    if avg_speed * 0.8 <= current_speed <= avg_speed * 1.2:
+        return TrafficStates.Regular
+    if avg_speed * 0.2 < current_speed < avg_speed * 0.8:
+        return TrafficStates.High
+    return TrafficStates.Jam
+
+
+def hour_of_week(moment):
+    """
+    Hour of the week of a datetime, 0 being Monday 00h.
+    """
+    return moment.weekday() * 24 + moment.hour
+
+
+def baseline_hours(moment=None):
+    """
+    Hour-of-week buckets a reading taken at `moment` may be compared to, the overall one first.
+    """
+    hours = [SpeedBaseline.ALL_HOURS]
+    if BASELINE_BY_HOUR_OF_WEEK and moment is not None:
+        hours.append(hour_of_week(moment))
+    return hours
+
+
+def choose_speed_baseline(baselines, moment=None):
+    """
+    Pick from {hour_of_week: SpeedBaseline} the baseline a reading taken at `moment` should be
+    compared to. Falls back to the overall baseline when hour-of-week baselines are disabled
+    or the bucket does not have enough samples yet.
+    """
+    hours = baseline_hours(moment)
+    bucket = baselines.get(hours[-1])
+    if bucket is not None and (len(hours) == 1 or bucket.sample_count >= BASELINE_MIN_HOUR_SAMPLES):
+        return bucket
+    return baselines.get(SpeedBaseline.ALL_HOURS)
+
+
+def lookup_speed_baseline(session, traffic_cam_id, moment=None):
+    """
+    Fetch the baseline a reading taken at `moment` should be compared to.
+    """
+    baselines = {
+        b.hour_of_week: b for b in
+        session.query(SpeedBaseline).filter(
+            SpeedBaseline.traffic_cam_id == traffic_cam_id,
+            SpeedBaseline.hour_of_week.in_(baseline_hours(moment))
+        )
+    }
+    return choose_speed_baseline(baselines, moment)
+
+
+def update_speed_baselines(session, rows):
+    """
+    Fold newly inserted records into the running baselines of their cameras.
+    """
+    totals = defaultdict(lambda: [0, 0.0, 0.0])
+    for row in rows:
+        speed = row["average_speed"]
+        for hour in (SpeedBaseline.ALL_HOURS, hour_of_week(row["start_time"])):
+            total = totals[(row["traffic_cam_id"], hour)]
+            total[0] += 1
+            total[1] += speed
+            total[2] += speed * speed
+    if not totals:
+        return
+
+    rows = [
+        {
+            "traffic_cam_id": cam_id,
+            "hour_of_week": hour,
+            "sample_count": count,
+            "speed_sum": speed_sum,
+            "speed_sq_sum": speed_sq_sum,
+        }
+        for (cam_id, hour), (count, speed_sum, speed_sq_sum) in totals.items()
+    ]
+    session.execute(upsert(SpeedBaseline, rows, lambda incoming: {
+        "sample_count": SpeedBaseline.sample_count + incoming.sample_count,
+        "speed_sum": SpeedBaseline.speed_sum + incoming.speed_sum,
+        "speed_sq_sum": SpeedBaseline.speed_sq_sum + incoming.speed_sq_sum,
+    }))
+
+
+@handle_exceptions
+def rebuild_speed_baselines():
+    """
+    Recompute every camera baseline from the full traffic_records history.
+    """
     with session_scope() as session:
-        q = session.query(TrafficCam)
-        if city:
-            q.filter(TrafficCam.city == city)
-        return q.all()
+        session.query(SpeedBaseline).delete()
+        columns = ["traffic_cam_id", "hour_of_week", "sample_count", "speed_sum", "speed_sq_sum"]
+        aggregates = (
+            func.count(),
+            func.sum(TrafficRecord.average_speed),
+            func.sum(TrafficRecord.average_speed * TrafficRecord.average_speed),
+        )
+        hour_expr = hour_of_week_expr(TrafficRecord.start_time)
+        overall = (
+            select(TrafficRecord.traffic_cam_id, literal(SpeedBaseline.ALL_HOURS), *aggregates)
+            .group_by(TrafficRecord.traffic_cam_id)
+        )
+        per_hour = (
+            select(TrafficRecord.traffic_cam_id, hour_expr, *aggregates)
+            .group_by(TrafficRecord.traffic_cam_id, hour_expr)
+        )
+        for query in (overall, per_hour):
+            session.execute(insert(SpeedBaseline).from_select(columns, query))
+        return session.query(SpeedBaseline).filter(SpeedBaseline.hour_of_week == SpeedBaseline.ALL_HOURS).count()
+
+
+def floor_hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def split_hour_range(start_datetime, end_datetime):
+    """
+    Find the whole hours of [start_datetime, end_datetime] that can be answered from the
+    hourly rollup. Records last minutes, so any record starting before the last hour of the
+    range also ends inside it; that last hour and the partial first hour are left to raw rows.
+    Returns (first_hour, last_hour) with last_hour exclusive, or None if no hour qualifies.
+    """
+    first_hour = floor_hour(start_datetime)
+    if first_hour < start_datetime:
+        first_hour += timedelta(hours=1)
+    last_hour = floor_hour(end_datetime) - timedelta(hours=1)
+    if first_hour >= last_hour:
+        return None
+    return first_hour, last_hour
+
+
+def edge_hours(start_datetime, end_datetime, hours):
+    """
+    The hours overlapping [start_datetime, end_datetime] that are read from raw rows instead of
+    the rollup (see split_hour_range), as (hour_start, share of the hour inside the range).
+    """
+    edges = []
+    hour = floor_hour(start_datetime)
+    while hour <= end_datetime:
+        if hours and hour == hours[0]:
+            hour = hours[1]
+            continue
+        inside = min(end_datetime, hour + timedelta(hours=1)) - max(start_datetime, hour)
+        if inside > timedelta(0):
+            edges.append((hour, inside / timedelta(hours=1)))
+        hour += timedelta(hours=1)
+    return edges
+
+
+def compacted_records(edges):
+    """
+    Condition matching the hourly records compact_traffic_records wrote for the hours of `edges`.
+    """
+    return or_(*(
+        and_(TrafficRecord.start_time == hour, TrafficRecord.end_time == hour + COMPACTED_RECORD_SPAN)
+        for hour, _ in edges
+    ))
+
+
+def raw_edge_filter(query, start_datetime, end_datetime, hours):
+    """
+    Restrict a TrafficRecord query to the range edges not covered by the rollup, leaving out the
+    compacted records of the edge hours: compacted_edge_stats reads those from the rollup.
+    """
+    query = query.filter(
+        TrafficRecord.start_time >= start_datetime,
+        TrafficRecord.end_time <= end_datetime
+    )
+    if hours:
+        query = query.filter(or_(TrafficRecord.start_time < hours[0], TrafficRecord.start_time >= hours[1]))
+    edges = edge_hours(start_datetime, end_datetime, hours)
+    if edges:
+        query = query.filter(~compacted_records(edges))
+    return query
+
+
+def compacted_edge_stats(session, start_datetime, end_datetime, hours, cam_id=None, city=None):
+    """
+    Rollup statistics of the compacted camera-hours at the range edges, which raw_edge_filter leaves
+    out, scaled down to the share of each hour inside the range as if its records were spread evenly.
+    Returns [(hour_start, speed_sum, speed_count, vehicle_sum)] with whole record and vehicle counts.
+    """
+    edges = edge_hours(start_datetime, end_datetime, hours)
+    if not edges:
+        return []
+    compacted = select(TrafficRecord.id).where(
+        TrafficRecord.traffic_cam_id == TrafficHourlyRollup.traffic_cam_id,
+        TrafficRecord.start_time == TrafficHourlyRollup.hour_start,
+        compacted_records(edges)
+    ).exists()
+    query = session.query(
+        TrafficHourlyRollup.hour_start,
+        func.sum(TrafficHourlyRollup.speed_sum),
+        func.sum(TrafficHourlyRollup.speed_count),
+        func.sum(TrafficHourlyRollup.vehicle_sum)
+    ).filter(TrafficHourlyRollup.hour_start.in_([hour for hour, _ in edges]), compacted)
+    query = apply_filters(query, cam_id, city, model=TrafficHourlyRollup)
+    shares = dict(edges)
+    stats = []
+    for hour_start, speed_sum, speed_count, vehicles in query.group_by(TrafficHourlyRollup.hour_start):
+        share = shares[hour_start]
+        records = round(float(speed_count) * share)
+        stats.append((hour_start, float(speed_sum) / float(speed_count) * records, records,
+                      round(float(vehicles) * share)))
+    return stats
+
+
+def update_hourly_rollups(session, rows):
+    """
+    Add newly inserted records to the hourly rollup of their cameras.
+    """
+    buckets = {}
+    for row in rows:
+        key = (row["traffic_cam_id"], floor_hour(row["start_time"]))
+        speed = row["average_speed"]
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = {
+                "traffic_cam_id": key[0],
+                "hour_start": key[1],
+                "vehicle_sum": row["vehicle_count"],
+                "speed_sum": speed,
+                "speed_count": 1,
+                "speed_min": speed,
+                "speed_max": speed,
+            }
+        else:
+            bucket["vehicle_sum"] += row["vehicle_count"]
+            bucket["speed_sum"] += speed
+            bucket["speed_count"] += 1
+            bucket["speed_min"] = min(bucket["speed_min"], speed)
+            bucket["speed_max"] = max(bucket["speed_max"], speed)
+    if not buckets:
+        return
+
+    session.execute(upsert(TrafficHourlyRollup, list(buckets.values()), lambda incoming: {
+        "vehicle_sum": TrafficHourlyRollup.vehicle_sum + incoming.vehicle_sum,
+        "speed_sum": TrafficHourlyRollup.speed_sum + incoming.speed_sum,
+        "speed_count": TrafficHourlyRollup.speed_count + incoming.speed_count,
+        "speed_min": least(TrafficHourlyRollup.speed_min, incoming.speed_min),
+        "speed_max": greatest(TrafficHourlyRollup.speed_max, incoming.speed_max),
+    }))
+
+
+def update_aggregates(session, rows):
+    """
+    Keep every table derived from traffic_records in step with newly inserted rows.
+    """
+    update_speed_baselines(session, rows)
+    update_hourly_rollups(session, rows)
 
 
 @handle_exceptions
-def get_traffic_state(traffic_cam_id):
+def rebuild_hourly_rollups(since: datetime = None):
+    """
+    Recompute the hourly rollup from traffic_records, for the whole history or from `since` on.
+    Hours already downsampled by compact_traffic_records only have their hourly record left,
+    so pass a `since` newer than the retention age to keep their per-record statistics.
+    """
     with session_scope() as session:
-        latest = (
-            session.query(TrafficRecord)
-            .filter(TrafficRecord.traffic_cam_id == traffic_cam_id)
-            .order_by(desc(TrafficRecord.end_time))
-            .first()
+        hour_expr = hour_floor(TrafficRecord.start_time)
+        query = (
+            select(
+                TrafficRecord.traffic_cam_id,
+                hour_expr,
+                func.sum(TrafficRecord.vehicle_count),
+                func.sum(TrafficRecord.average_speed),
+                func.count(),
+                func.min(TrafficRecord.average_speed),
+                func.max(TrafficRecord.average_speed),
+            )
+            .group_by(TrafficRecord.traffic_cam_id, hour_expr)
         )
-        avg_speed = (
-                session.query(func.avg(TrafficRecord.average_speed))
-                .filter(TrafficRecord.traffic_cam_id == traffic_cam_id)
-                .scalar() or 0
+        stale = session.query(TrafficHourlyRollup)
+        if since is not None:
+            since = floor_hour(since)
+            query = query.where(TrafficRecord.start_time >= since)
+            stale = stale.filter(TrafficHourlyRollup.hour_start >= since)
+        stale.delete()
+        columns = ["traffic_cam_id", "hour_start", "vehicle_sum", "speed_sum", "speed_count",
+                   "speed_min", "speed_max"]
+        return session.execute(insert(TrafficHourlyRollup).from_select(columns, query)).rowcount
+
+
+# ========== RETENTION ==========
+
+COMPACTED_RECORD_SPAN = timedelta(hours=1)
+
+
+def is_compacted(row):
+    """
+    Whether a record is already one camera-hour written by compact_traffic_records.
+    """
+    return row.start_time == floor_hour(row.start_time) and row.end_time - row.start_time == COMPACTED_RECORD_SPAN
+
+
+def compaction_batch(session, cutoff, after, batch_size):
+    """
+    Load about `batch_size` records started before `cutoff`, following the (camera, start_time, id)
+    key `after`, extended so that the last camera-hour is complete.
+    """
+    columns = (TrafficRecord.id, TrafficRecord.traffic_cam_id, TrafficRecord.start_time,
+               TrafficRecord.end_time, TrafficRecord.vehicle_count, TrafficRecord.average_speed)
+
+    def following(query, cam_id, start_time, record_id):
+        return query.filter(or_(
+            TrafficRecord.traffic_cam_id > cam_id,
+            and_(TrafficRecord.traffic_cam_id == cam_id, or_(
+                TrafficRecord.start_time > start_time,
+                and_(TrafficRecord.start_time == start_time, TrafficRecord.id > record_id)
+            ))
+        ))
+
+    query = session.query(*columns).filter(TrafficRecord.start_time < cutoff)
+    if after is not None:
+        query = following(query, *after)
+    rows = query.order_by(TrafficRecord.traffic_cam_id, TrafficRecord.start_time, TrafficRecord.id).limit(batch_size).all()
+    if len(rows) == batch_size:
+        last = rows[-1]
+        rest = session.query(*columns).filter(
+            TrafficRecord.traffic_cam_id == last.traffic_cam_id,
+            TrafficRecord.start_time < floor_hour(last.start_time) + timedelta(hours=1)
         )
-        current_speed = latest.average_speed if latest else 0
+        rows += following(rest, last.traffic_cam_id, last.start_time, last.id).all()
+    return rows
+
+
+def compact_rows(session, rows):
+    """
+    Replace the records of every camera-hour in `rows` with a single hourly record.
+    Returns (records removed, hourly records written).
+    """
+    groups = defaultdict(list)
+    for row in rows:
+        groups[(row.traffic_cam_id, floor_hour(row.start_time))].append(row)
+
+    hourly, rollups, replaced = [], [], []
+    for (cam_id, hour), group in groups.items():
+        if len(group) == 1 and is_compacted(group[0]):
+            continue
+        vehicles = sum(row.vehicle_count for row in group)
+        if vehicles:
+            speed = sum(row.average_speed * row.vehicle_count for row in group) / vehicles
+        else:
+            speed = sum(row.average_speed for row in group) / len(group)
+        hourly.append({
+            "traffic_cam_id": cam_id,
+            "start_time": hour,
+            "end_time": hour + COMPACTED_RECORD_SPAN,
+            "vehicle_count": vehicles,
+            "average_speed": speed,
+        })
+        replaced.extend(row.id for row in group)
+        if not any(is_compacted(row) for row in group):
+            # raw rows only: make sure the rollup holds their exact statistics before they go
+            speeds = [row.average_speed for row in group]
+            rollups.append({
+                "traffic_cam_id": cam_id,
+                "hour_start": hour,
+                "vehicle_sum": vehicles,
+                "speed_sum": sum(speeds),
+                "speed_count": len(speeds),
+                "speed_min": min(speeds),
+                "speed_max": max(speeds),
+            })
+    if not hourly:
+        return 0, 0
+
+    if rollups:
+        session.execute(upsert(TrafficHourlyRollup, rollups, lambda incoming: {
+            "vehicle_sum": incoming.vehicle_sum,
+            "speed_sum": incoming.speed_sum,
+            "speed_count": incoming.speed_count,
+            "speed_min": incoming.speed_min,
+            "speed_max": incoming.speed_max,
+        }))
+    session.execute(delete(TrafficRecord).where(TrafficRecord.id.in_(replaced)))
+    session.execute(insert(TrafficRecord), hourly)
+    return len(replaced), len(hourly)
+
+
+@handle_exceptions
+def compact_traffic_records(older_than: timedelta, batch_size: int = 5000):
+    """
+    Downsample the records that started before now - `older_than` (rounded down to the hour)
+    to one record per camera and hour, with vehicle counts summed and the speed weighted by
+    vehicles. Each transaction handles about `batch_size` records, writing the hourly records
+    and deleting the raw ones they replace, so the job can be interrupted and run again.
+
+    Compacted hours keep their per-record statistics in the hourly rollup, which range reads use for
+    whole hours and for compacted hours at their edges. An edge that cuts through a compacted hour
+    counts the share of the hour inside the range, as if its records were spread evenly, so totals
+    and peak hours over a range that does not start and end on the hour can shift slightly.
+    Returns (raw records removed, hourly records written).
+    """
+    cutoff = floor_hour(datetime.now() - older_than)
+    removed = written = 0
+    after = None
+    while True:
+        with session_scope() as session:
+            rows = compaction_batch(session, cutoff, after, batch_size)
+            if not rows:
+                break
+            after = (rows[-1].traffic_cam_id, rows[-1].start_time, rows[-1].id)
+            batch_removed, batch_written = compact_rows(session, rows)
+        removed += batch_removed
+        written += batch_written
+    return removed, written
+
+
+def current_traffic_state(session, traffic_cam_id):
+    """
+    Compute the traffic state of a camera using an already open session.
+    """
+    latest = (
+        session.query(TrafficRecord.start_time, TrafficRecord.average_speed)
+        .filter(TrafficRecord.traffic_cam_id == traffic_cam_id)
+        .order_by(desc(TrafficRecord.end_time))
+        .first()
+    )
+    baseline = lookup_speed_baseline(session, traffic_cam_id, latest.start_time if latest else None)
+    avg_speed = baseline.mean if baseline else 0
+    current_speed = latest.average_speed if latest else 0
+    return classify_speed(current_speed, avg_speed)
 
-        if current_speed >= avg_speed * 1.2:
-            return TrafficStates.Low
-        if avg_speed * 0.8 <= current_speed <= avg_speed * 1.2:
-            return TrafficStates.Regular
-        if avg_speed * 0.2 < current_speed < avg_speed * 0.8:
-            return TrafficStates.High
-        return TrafficStates.Jam
+
+@handle_exceptions
+def get_traffic_state(traffic_cam_id):
+    with session_scope() as session:
+        return current_traffic_state(session, traffic_cam_id)
+
+
+STATE_LOOKUP_CHUNK = 500
+
+
+def load_camera_states(cam_ids):
+    """
+    Latest reading and traffic state of many cameras as {cam_id: CameraState}, with two queries
+    per STATE_LOOKUP_CHUNK cameras instead of two per camera.
+    """
+    cam_ids = list(dict.fromkeys(cam_ids))
+    states = {}
+    with session_scope() as session:
+        for i in range(0, len(cam_ids), STATE_LOOKUP_CHUNK):
+            chunk = cam_ids[i:i + STATE_LOOKUP_CHUNK]
+            newest = (
+                session.query(TrafficRecord.traffic_cam_id, func.max(TrafficRecord.end_time).label("end_time"))
+                .filter(TrafficRecord.traffic_cam_id.in_(chunk))
+                .group_by(TrafficRecord.traffic_cam_id)
+                .subquery()
+            )
+            latest = {
+                row.traffic_cam_id: row
+                for row in session.query(
+                    TrafficRecord.traffic_cam_id, TrafficRecord.start_time, TrafficRecord.end_time,
+                    TrafficRecord.average_speed, TrafficRecord.vehicle_count
+                ).join(newest, and_(
+                    TrafficRecord.traffic_cam_id == newest.c.traffic_cam_id,
+                    TrafficRecord.end_time == newest.c.end_time
+                ))
+            }
+            hours = {hour for row in latest.values() for hour in baseline_hours(row.start_time)}
+            baselines = defaultdict(dict)
+            for baseline in session.query(SpeedBaseline).filter(
+                SpeedBaseline.traffic_cam_id.in_(chunk),
+                SpeedBaseline.hour_of_week.in_(hours or baseline_hours())
+            ):
+                baselines[baseline.traffic_cam_id][baseline.hour_of_week] = baseline
+
+            for cam_id in chunk:
+                row = latest.get(cam_id)
+                baseline = choose_speed_baseline(baselines[cam_id], row.start_time if row else None)
+                state = classify_speed(row.average_speed if row else 0, baseline.mean if baseline else 0)
+                if row is None:
+                    states[cam_id] = CameraState(state, None, None, None)
+                else:
+                    states[cam_id] = CameraState(state, row.end_time, row.average_speed, row.vehicle_count)
+    return states
+
+
+@handle_exceptions
+def get_traffic_states(cam_ids):
+    """
+    Traffic state of many cameras as {cam_id: TrafficStates}, from the in-memory snapshot.
+    """
+    snapshot = state_tracker.snapshot(list(cam_ids), load_camera_states)
+    return {cam_id: camera.state for cam_id, camera in snapshot.items()}
+
+
+@handle_exceptions
+def get_traffic_state_snapshot(city=None):
+    """
+    Latest reading and traffic state of every camera (optionally of one city), ordered by id.
+    Served from the in-memory snapshot that ingest keeps current; the database is only read
+    for cameras not refreshed within STATE_SNAPSHOT_TTL.
+    """
+    return state_tracker.snapshot_views([cam["id"] for cam in get_cams(city)], load_camera_states)
 
 
 # ========== DASHBOARD ==========
 
 
+def sum_values(*values):
+    """
+    Add up SQL aggregates, ignoring the NULLs returned for empty sets.
+    """
+    present = [v for v in values if v is not None]
+    return sum(present[1:], present[0]) if present else None
+
+
 @handle_exceptions
+@range_cache.cached
 def get_traffic_stats_in_range(start_datetime: datetime, end_datetime: datetime, cam_id: int = None, city: str = None):
     with session_scope() as session:
-        query = session.query(
-            func.avg(TrafficRecord.average_speed).label('average_speed'),
-            func.sum(TrafficRecord.vehicle_count).label('total_vehicle_count')
-        )
-        query = query.filter(
-            TrafficRecord.start_time >= start_datetime,
-            TrafficRecord.end_time <= end_datetime
+        hours = split_hour_range(start_datetime, end_datetime)
+
+        raw_q = session.query(
+            func.sum(TrafficRecord.average_speed),
+            func.count(TrafficRecord.id),
+            func.sum(TrafficRecord.vehicle_count)
         )
-        query = apply_filters(query, cam_id, city)
-        return query.first()
+        raw_q = raw_edge_filter(raw_q, start_datetime, end_datetime, hours)
+        speed_sum, speed_count, vehicles = apply_filters(raw_q, cam_id, city).one()
+
+        if hours:
+            rollup_q = session.query(
+                func.sum(TrafficHourlyRollup.speed_sum),
+                func.sum(TrafficHourlyRollup.speed_count),
+                func.sum(TrafficHourlyRollup.vehicle_sum)
+            )
+            rollup_q = rollup_q.filter(
+                TrafficHourlyRollup.hour_start >= hours[0],
+                TrafficHourlyRollup.hour_start < hours[1]
+            )
+            r_speed_sum, r_speed_count, r_vehicles = apply_filters(
+                rollup_q, cam_id, city, model=TrafficHourlyRollup).one()
+            speed_sum = sum_values(speed_sum, r_speed_sum)
+            speed_count = sum_values(speed_count, r_speed_count)
+            vehicles = sum_values(vehicles, r_vehicles)
+
+        for _, e_speed_sum, e_speed_count, e_vehicles in compacted_edge_stats(
+                session, start_datetime, end_datetime, hours, cam_id, city):
+            speed_sum = sum_values(speed_sum, e_speed_sum)
+            speed_count = sum_values(speed_count, e_speed_count)
+            vehicles = sum_values(vehicles, e_vehicles)
+
+        average_speed = float(speed_sum) / float(speed_count) if speed_count else None
+        return TrafficStats(average_speed, vehicles)
 
 
 @handle_exceptions
+@range_cache.cached
 def get_peak_hours(start_datetime: datetime, end_datetime: datetime, cam_id: int = None, city: str = None):
     with session_scope() as session:
+        hours = split_hour_range(start_datetime, end_datetime)
+
         base_q = session.query(
-            func.date(TrafficRecord.start_time).label("day"),
+            date_of(TrafficRecord.start_time).label("day"),
             extract("hour", TrafficRecord.start_time).cast(Integer).label("hour"),
             func.sum(TrafficRecord.vehicle_count).label("vehicles"),
         )
-        base_q = base_q.filter(
-            TrafficRecord.start_time >= start_datetime,
-            TrafficRecord.end_time <= end_datetime
-        )
+        base_q = raw_edge_filter(base_q, start_datetime, end_datetime, hours)
         base_q = apply_filters(base_q, cam_id, city)
         daily_counts = base_q.group_by("day", "hour").all()
 
-        per_day = defaultdict(list)
+        if hours:
+            rollup_q = session.query(
+                TrafficHourlyRollup.hour_start,
+                func.sum(TrafficHourlyRollup.vehicle_sum)
+            )
+            rollup_q = rollup_q.filter(
+                TrafficHourlyRollup.hour_start >= hours[0],
+                TrafficHourlyRollup.hour_start < hours[1]
+            )
+            rollup_q = apply_filters(rollup_q, cam_id, city, model=TrafficHourlyRollup)
+            daily_counts.extend(
+                (hour_start.date(), hour_start.hour, vehicles)
+                for hour_start, vehicles in rollup_q.group_by(TrafficHourlyRollup.hour_start)
+            )
+        daily_counts.extend(
+            (hour_start.date(), hour_start.hour, vehicles)
+            for hour_start, _, _, vehicles in compacted_edge_stats(
+                session, start_datetime, end_datetime, hours, cam_id, city)
+        )
+
+        # an edge hour can have both raw rows and compacted records
+        per_day = defaultdict(Counter)
         for day, hour, vehicles in daily_counts:
-            per_day[day].append((hour, vehicles))
+            per_day[day][hour] += vehicles
 
         daily_peaks = []
-        for lst in per_day.values():
-            max_veh = max(v for (_, v) in lst)
-            daily_peaks.extend([{"hour": h, "vehicles": v} for (h, v) in lst if v == max_veh])
+        for counts in per_day.values():
+            max_veh = max(counts.values())
+            daily_peaks.extend([{"hour": h, "vehicles": v} for (h, v) in counts.items() if v == max_veh])
 
         if not daily_peaks:
             return []
@@ -176,7 +926,8 @@ def get_peak_hours(start_datetime: datetime, end_datetime: datetime, cam_id: int
         max_freq = max(freq.values())
 
         result = []
-        for hour, count in freq.items():
+        # by hour: days come from the raw edges and the rollup in no particular order
+        for hour, count in sorted(freq.items()):
             if count == max_freq:
                 counts = [p["vehicles"] for p in daily_peaks if p["hour"] == hour]
                 avg_veh = sum(counts) / len(counts)
@@ -187,25 +938,64 @@ def get_peak_hours(start_datetime: datetime, end_datetime: datetime, cam_id: int
         return result
 
 
+def congestion_status(total, slow):
+    """
+    Turn total/slow record counts into the congestion payload served by /congestion.
+    """
+    if not total:
+        return {"congestion_percentage": 0, "status": "no data"}
+    perc = (int(slow) / total) * 100
+    return {"congestion_percentage": round(perc, 2), "status": "congested" if perc > 50 else "fluid"}
+
+
+def slow_record_count(speed_threshold):
+    """
+    Conditional aggregate counting the records at or below `speed_threshold`.
+    """
+    return func.sum(case((TrafficRecord.average_speed <= speed_threshold, 1), else_=0))
+
+
 @handle_exceptions
+@range_cache.cached
 def get_speed_based_congestion(traffic_cam_id: int = None, start_datetime: datetime = None,
                                end_datetime: datetime = None,
                                speed_threshold: int = 10, city: str = None):
     with session_scope() as session:
-        query = session.query(TrafficRecord)
+        query = session.query(func.count(TrafficRecord.id), slow_record_count(speed_threshold))
         if traffic_cam_id is not None:
             query = query.filter(TrafficRecord.traffic_cam_id == traffic_cam_id)
         query = apply_date_range(query, start_datetime, end_datetime)
         if city:
             query = query.join(TrafficCam).filter(TrafficCam.city == city)
 
-        total = query.count()
-        if total == 0:
-            return {"congestion_percentage": 0, "status": "no data"}
+        total, slow = query.one()
+        return congestion_status(total, slow)
 
-        low_count = query.filter(TrafficRecord.average_speed <= speed_threshold).count()
-        perc = (low_count / total) * 100
-        return {"congestion_percentage": round(perc, 2), "status": "congested" if perc > 50 else "fluid"}
+
+@handle_exceptions
+@range_cache.cached
+def get_congestion_ranking(start_datetime: datetime = None, end_datetime: datetime = None,
+                           speed_threshold: int = 10, city: str = None):
+    """
+    Congestion percentage of every camera with records in the range, worst first.
+    """
+    with session_scope() as session:
+        total = func.count(TrafficRecord.id)
+        slow = slow_record_count(speed_threshold)
+        query = session.query(
+            TrafficCam.id, TrafficCam.alias, TrafficCam.city, total, slow
+        ).join(TrafficRecord, TrafficRecord.traffic_cam_id == TrafficCam.id)
+        query = apply_date_range(query, start_datetime, end_datetime)
+        if city:
+            query = query.filter(TrafficCam.city == city)
+        query = query.group_by(TrafficCam.id, TrafficCam.alias, TrafficCam.city)
+        query = query.order_by(desc(slow * 100.0 / total), TrafficCam.id)
+
+        return [
+            {"traffic_cam_id": cam_id, "alias": alias, "city": cam_city, "records": count,
+             **congestion_status(count, slow_count)}
+            for cam_id, alias, cam_city, count, slow_count in query
+        ]
 
 
 @handle_exceptions
@@ -214,58 +1004,325 @@ def get_traffic_records_in_range(start_datetime: datetime,
                                  cam_id: int = None,
                                  city: str = None):
     with session_scope() as session:
-        query = session.query(TrafficRecord)
-        query = query.join(TrafficCam).options(joinedload(TrafficRecord.traffic_cam))
+        query = session.query(
+            TrafficRecord.traffic_cam_id,
+            format_datetime(TrafficRecord.start_time),
+            format_datetime(TrafficRecord.end_time),
+            TrafficRecord.vehicle_count,
+            TrafficRecord.average_speed,
+            TrafficCam.alias
+        ).join(TrafficCam)
         query = apply_date_range(query, start_datetime, end_datetime)
-        query = apply_filters(query, cam_id, city)
-        records = query.all()
-        result = []
-        for rec in records:
-            rd = record_to_dict(rec)
-            rd['alias'] = rec.traffic_cam.alias
-            result.append(rd)
+        query = apply_filters(query, cam_id)
+        if city is not None:
+            query = query.filter(TrafficCam.city == city)
+        return record_views(query)
 
-        return result
+
+def record_views(rows):
+    """
+    /traffic_records dicts of (traffic_cam_id, start, end, vehicle_count, average_speed, alias)
+    rows whose datetimes are already formatted.
+    """
+    return [
+        {
+            "traffic_cam_id": cam_id,
+            "start_datetime": start,
+            "end_datetime": end,
+            "vehicle_count": vehicle_count,
+            "average_speed": average_speed,
+            "alias": alias
+        }
+        for cam_id, start, end, vehicle_count, average_speed, alias in rows
+    ]
+
+
+def traffic_record_rows(session, start_datetime, end_datetime, cam_id=None, city=None):
+    """
+    Query the columns served by /traffic_records, ordered by the (start_time, id) keyset.
+    """
+    query = session.query(
+        TrafficRecord.id,
+        TrafficRecord.traffic_cam_id,
+        TrafficRecord.start_time,
+        TrafficRecord.end_time,
+        TrafficRecord.vehicle_count,
+        TrafficRecord.average_speed,
+        TrafficCam.alias
+    ).join(TrafficCam)
+    query = apply_date_range(query, start_datetime, end_datetime)
+    if cam_id is not None:
+        query = query.filter(TrafficRecord.traffic_cam_id == cam_id)
+    if city is not None:
+        query = query.filter(TrafficCam.city == city)
+    return query.order_by(TrafficRecord.start_time, TrafficRecord.id)
+
+
+def rows_to_dicts(rows):
+    """
+    /traffic_records dicts of traffic_record_rows rows. Records of one range share few distinct
+    timestamps, so each is formatted once.
+    """
+    formatted = {}
+
+    def format_time(moment):
+        text = formatted.get(moment)
+        if text is None:
+            text = formatted[moment] = moment.strftime('%Y-%m-%d %H:%M:%S')
+        return text
+
+    return record_views(
+        (row.traffic_cam_id, format_time(row.start_time), format_time(row.end_time), row.vehicle_count,
+         row.average_speed, row.alias)
+        for row in rows
+    )
 
 
 @handle_exceptions
-def get_traffic_jams_in_range(start_datetime: datetime, end_datetime: datetime, cam_id: int = None, city: str = None):
+def get_traffic_records_page(start_datetime: datetime, end_datetime: datetime, limit: int,
+                             after: tuple = None, cam_id: int = None, city: str = None):
+    """
+    Return up to `limit` records following the (start_time, id) key `after`, and the key
+    to resume from, or None once the range is exhausted.
+    """
+    with session_scope() as session:
+        query = traffic_record_rows(session, start_datetime, end_datetime, cam_id, city)
+        if after is not None:
+            after_start, after_id = after
+            query = query.filter(or_(
+                TrafficRecord.start_time > after_start,
+                and_(TrafficRecord.start_time == after_start, TrafficRecord.id > after_id)
+            ))
+        rows = query.limit(limit).all()
+        next_key = (rows[-1].start_time, rows[-1].id) if len(rows) == limit else None
+        return rows_to_dicts(rows), next_key
+
+
+def iter_traffic_record_rows(start_datetime: datetime, end_datetime: datetime, cam_id: int = None,
+                             city: str = None, batch_size: int = 1000):
+    """
+    Stream record rows from a server-side cursor, yielding lists of at most `batch_size` rows.
+    """
     with session_scope() as session:
-        query = session.query(TrafficJamAlert)
-        query = query.filter(
-            TrafficJamAlert.event_time >= start_datetime,
-            TrafficJamAlert.event_time <= end_datetime
+        query = traffic_record_rows(session, start_datetime, end_datetime, cam_id, city)
+        batch = []
+        for row in query.yield_per(batch_size):
+            batch.append(row)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def iter_traffic_records(start_datetime: datetime, end_datetime: datetime, cam_id: int = None,
+                         city: str = None, batch_size: int = 1000):
+    """
+    Same as iter_traffic_record_rows, with every row converted to its /traffic_records dict.
+    """
+    for batch in iter_traffic_record_rows(start_datetime, end_datetime, cam_id, city, batch_size):
+        yield rows_to_dicts(batch)
+
+
+@lru_cache(maxsize=None)
+def traffic_jams_statement(by_cam, by_city):
+    """
+    The /traffic_jams query with or without the camera and city filters, built once with the range,
+    camera and city as bound parameters: building and hashing the statement on every call cost
+    more than running it.
+    """
+    def episodes(ended):
+        query = select(
+            TrafficJamAlert.id.label("alert_id"),
+            TrafficJamAlert.traffic_cam_id,
+            format_datetime(TrafficJamAlert.event_time).label("event_time"),
+            format_datetime(TrafficJamAlert.ended_at).label("ended_at")
         )
-        if cam_id is not None:
-            query = query.filter(TrafficJamAlert.traffic_cam_id == cam_id)
-        if city is not None:
-            query = query.join(TrafficCam).filter(TrafficCam.city == city)
-        alerts = query.all()
+        # the range scan goes over ended_at: event_time <= end matches most of the history
+        query = query.where(unindexed(TrafficJamAlert.event_time) <= bindparam("end_datetime"), ended)
+        if by_cam:
+            query = query.where(TrafficJamAlert.traffic_cam_id == bindparam("cam_id"))
+        if by_city:
+            query = query.join(TrafficCam).where(TrafficCam.city == bindparam("city"))
+        return query
+
+    # every episode overlapping the range: those still ongoing and those that ended after it started
+    return union_all(
+        episodes(TrafficJamAlert.ended_at.is_(None)),
+        episodes(TrafficJamAlert.ended_at >= bindparam("start_datetime"))
+    ).order_by("event_time", "alert_id")
+
+
+@handle_exceptions
+@range_cache.cached
+def get_traffic_jams_in_range(start_datetime: datetime, end_datetime: datetime, cam_id: int = None, city: str = None):
+    statement = traffic_jams_statement(cam_id is not None, city is not None)
+    params = {"start_datetime": start_datetime, "end_datetime": end_datetime, "cam_id": cam_id, "city": city}
+    with session_scope() as session:
         return [
-            {
-                "traffic_cam_id": alert.traffic_cam_id,
-                "event_time": alert.event_time.strftime('%Y-%m-%d %H:%M:%S')
-            }
-            for alert in alerts
+            {"traffic_cam_id": traffic_cam_id, "event_time": event_time, "ended_at": ended_at}
+            for _, traffic_cam_id, event_time, ended_at in session.connection().execute(statement, params).all()
         ]
 
 
 # ========== Traffic Detection ==========
 
+def reference_speeds(session, rows):
+    """
+    Load the speed baselines newly inserted records are compared to, in one query.
+    Returns reference_speed(row), the baseline mean speed of a record (0 without baseline).
+    """
+    cam_ids = {row["traffic_cam_id"] for row in rows}
+    hours = {hour for row in rows for hour in baseline_hours(row["start_time"])}
+    baselines = defaultdict(dict)
+    for baseline in session.query(SpeedBaseline).filter(
+        SpeedBaseline.traffic_cam_id.in_(cam_ids),
+        SpeedBaseline.hour_of_week.in_(hours)
+    ):
+        baselines[baseline.traffic_cam_id][baseline.hour_of_week] = baseline
+
+    def reference_speed(row):
+        baseline = choose_speed_baseline(baselines[row["traffic_cam_id"]], row["start_time"])
+        return baseline.mean if baseline else 0
+
+    return reference_speed
+
+
+def detect_traffic_jams(session, rows):
+    """
+    Run newly inserted records through the jam detector, each compared to its camera's speed baseline,
+    and queue a notification for the subscribers of every jam that started or ended. Also stages
+    the cameras' new traffic state for the live stream.
+    Returns (started alerts, ended alerts).
+    """
+    reference_speed = reference_speeds(session, rows)
+    alerts, ended = jam_detector.observe(session, rows, reference_speed)
+    stage_notifications(session, alerts, ended)
+    state_tracker.stage(session, rows, lambda row: classify_speed(row["average_speed"], reference_speed(row)))
+    return alerts, ended
+
+
+RECORD_KEY = ("traffic_cam_id", "start_time", "end_time")
+RECORD_KEY_COLUMNS = (TrafficRecord.traffic_cam_id, TrafficRecord.start_time, TrafficRecord.end_time)
+
+
+class DuplicateTally:
+    """Records the ingest path skipped because they were already stored or repeated in their batch."""
+
+    def __init__(self):
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def add(self, count):
+        with self.lock:
+            self.total += count
+
+
+duplicate_records = DuplicateTally()
+
+
+@event.listens_for(Session, "after_commit")
+def count_duplicate_records(session):
+    count = session.info.pop("duplicate_records", 0)
+    if count:
+        duplicate_records.add(count)
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_duplicate_records(session):
+    session.info.pop("duplicate_records", None)
+
+
+def record_key(row):
+    return row["traffic_cam_id"], row["start_time"], row["end_time"]
+
+
+def insert_new_records(session, rows):
+    """
+    INSERT `rows` with one statement that skips the records already stored (same camera, start and
+    end), and return the rows it inserted.
+    """
+    connection = session.connection()
+    if SQLITE:
+        # ON CONFLICT DO NOTHING returns only the rows it inserted
+        statement = insert_new(TrafficRecord, list(RECORD_KEY)).returning(*RECORD_KEY_COLUMNS)
+        inserted = {tuple(key) for key in connection.execute(statement, rows)}
+    else:
+        # No RETURNING, and the driver counts the rows ON DUPLICATE KEY UPDATE skipped as matched.
+        # The rows a multi-row INSERT adds take ids from its first auto-increment value on, and in the
+        # transaction's snapshot any other row with such an id is uncommitted or committed later.
+        first_id = connection.execute(insert_new(TrafficRecord, list(RECORD_KEY)).values(rows)).lastrowid
+        if not first_id:
+            return []
+        inserted = {tuple(key) for key in connection.execute(
+            select(*RECORD_KEY_COLUMNS).where(TrafficRecord.id >= first_id)
+        )}
+    return [row for row in rows if record_key(row) in inserted]
+
+
 @handle_exceptions
 def add_traffic_record(device_id: int, start_time: datetime, end_time: datetime, vehicle_count: int,
                        average_speed: float):
+    """
+    Insert one record. Returns False when the camera already sent it (a retried upload).
+    """
+    inserted, rejected = add_traffic_records([{
+        "traffic_cam_id": device_id,
+        "start_time": start_time,
+        "end_time": end_time,
+        "vehicle_count": vehicle_count,
+        "average_speed": average_speed,
+    }])
+    if rejected:
+        raise ValueError(rejected[0][1])
+    return inserted == 1
+
+
+@handle_exceptions
+def add_traffic_records(rows: list):
+    """
+    Insert many records with a single bulk INSERT and one jam check per camera.
+
+    Each row is a dict keyed by TrafficRecord column names. Rows pointing to unknown
+    cameras are skipped instead of failing the whole batch, and records already stored
+    (same camera, start and end) are skipped as duplicates, so device retries are harmless.
+    Returns the number of inserted rows and a list of (position, error) for skipped rows.
+    """
     with session_scope() as session:
-        record = TrafficRecord(
-            traffic_cam_id=device_id,
-            start_time=start_time,
-            end_time=end_time,
-            vehicle_count=vehicle_count,
-            average_speed=average_speed
-        )
-        session.add(record)
-        session.flush()  # Ensure record ID is populated
-        if get_traffic_state(device_id) == TrafficStates.Jam:
-            alert = TrafficJamAlert(traffic_cam_id=device_id, event_time=datetime.now())
-            session.add(alert)
-        return record
+        valid_rows, rejected, alerts, ended = insert_traffic_records(session, rows)
+    notify_ingest(valid_rows, alerts, ended)
+    return len(valid_rows), rejected
+
+
+def insert_traffic_records(session, rows):
+    """
+    Stage the bulk insert, aggregate updates and jam detection of add_traffic_records in an open session.
+    Only records not stored yet are inserted, aggregated and run through jam detection; the
+    duplicates are counted in `duplicate_records` once the session commits.
+    Returns (inserted rows, [(position, error)], started alerts, ended alerts); the caller commits
+    and notifies listeners.
+    """
+    cam_ids = {row["traffic_cam_id"] for row in rows}
+    known_ids = {
+        cam_id for (cam_id,) in
+        session.query(TrafficCam.id).filter(TrafficCam.id.in_(cam_ids))
+    } if cam_ids else set()
+
+    batch_rows, rejected = {}, []
+    for pos, row in enumerate(rows):
+        if row["traffic_cam_id"] not in known_ids:
+            rejected.append((pos, f"Unknown traffic_cam_id {row['traffic_cam_id']}"))
+        else:
+            # the first copy of a record repeated within the batch wins
+            batch_rows.setdefault(record_key(row), row)
+
+    new_rows = insert_new_records(session, list(batch_rows.values())) if batch_rows else []
+    duplicates = len(rows) - len(rejected) - len(new_rows)
+    if duplicates:
+        session.info["duplicate_records"] = session.info.get("duplicate_records", 0) + duplicates
+
+    alerts, ended = [], []
+    if new_rows:
+        update_aggregates(session, new_rows)
+        alerts, ended = detect_traffic_jams(session, new_rows)
+    return new_rows, rejected, alerts, ended
@@ -0,0 +1,204 @@
+import inspect
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from functools import wraps
+
+from utils import wall_clock
+
+logger = logging.getLogger(__name__)
+
+CAM_ARGUMENTS = ("cam_id", "traffic_cam_id")
+GENERATION_CHECK_SECONDS = 5
+
+
+def is_aligned(moment, granularity):
+    """
+    Whether a bound is a multiple of `granularity` seconds (at most one day) since midnight.
+    Anything but a datetime, such as an omitted bound, counts as aligned.
+    """
+    if not isinstance(moment, datetime) or granularity <= 0:
+        return True
+    seconds = moment.hour * 3600 + moment.minute * 60 + moment.second
+    return moment.microsecond == 0 and seconds % min(granularity, 86400) == 0
+
+
+def comparable(moment):
+    return wall_clock(moment) if isinstance(moment, datetime) else None
+
+
+class Scope:
+    """The camera, city and time window a cached result depends on. None means unrestricted."""
+
+    def __init__(self, cam_id, city, start, end):
+        self.cam_id = cam_id
+        self.city = city
+        self.start = comparable(start)
+        self.end = comparable(end)
+
+    def overlaps(self, other):
+        if self.cam_id is not None and other.cam_id is not None and self.cam_id != other.cam_id:
+            return False
+        if self.city is not None and other.city is not None and self.city != other.city:
+            return False
+        if self.start is not None and other.end is not None and other.end < self.start:
+            return False
+        if self.end is not None and other.start is not None and other.start > self.end:
+            return False
+        return True
+
+
+class RangeResultCache:
+    """
+    LRU cache of range query results, bounded by the pickled size of the stored values.
+
+    Results are invalidated by scope: new data for a camera and time window only drops the
+    entries whose camera/city filters and window could include it. That only sees the ingest
+    of this process, so entries also expire after `ttl` seconds, and the whole cache is dropped
+    when `generation()` changes, which bulk jobs such as the maintenance commands use to reach
+    every process. With several app processes a result may therefore be stale for up to `ttl`
+    seconds after another process ingested records it covers, and for up to
+    GENERATION_CHECK_SECONDS after a bulk job.
+    """
+
+    def __init__(self, granularity=60, max_bytes=64 * 1024 * 1024, history=1024, ttl=60, generation=None):
+        self.granularity = granularity
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, size, scope, expires_at)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.generation = generation
+        self.seen_generation = None
+        self.next_generation_check = 0.0
+        # recent invalidations, used to refuse storing results computed while data changed
+        self.invalidations = deque(maxlen=history)
+        self.sequence = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[3] <= time.monotonic():
+                self.size -= self.entries.pop(key)[1]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def begin(self):
+        """
+        Mark the start of a computation; pass the returned token to put().
+        """
+        return self.sequence
+
+    def put(self, key, value, scope, token):
+        try:
+            size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            missed = self.sequence - token
+            if missed > len(self.invalidations):
+                return  # too many invalidations to tell whether this result is stale
+            if any(seq > token and changed.overlaps(scope) for seq, changed in self.invalidations):
+                return
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size, scope, time.monotonic() + self.ttl)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size, _, _) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def invalidate(self, cam_id, city, start, end):
+        """
+        Drop every entry that new data for `cam_id` (in `city`) between `start` and `end` could change.
+        """
+        changed = Scope(cam_id, city, start, end)
+        with self.lock:
+            self.sequence += 1
+            self.invalidations.append((self.sequence, changed))
+            for key in [key for key, (_, _, scope, _) in self.entries.items() if scope.overlaps(changed)]:
+                self.size -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.sequence += 1
+            self.invalidations.append((self.sequence, Scope(None, None, None, None)))
+            self.entries.clear()
+            self.size = 0
+
+    def check_generation(self):
+        """
+        Clear the cache if the generation changed since it was last read, at most every
+        GENERATION_CHECK_SECONDS.
+        """
+        if self.generation is None:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if now < self.next_generation_check:
+                return
+            self.next_generation_check = now + GENERATION_CHECK_SECONDS
+        try:
+            current = self.generation()
+        except Exception as e:
+            logger.warning("Could not read the result cache generation: %s", e)
+            return
+        if current != self.seen_generation:
+            # also on the first read: entries may have been cached while it was failing
+            self.clear()
+            self.seen_generation = current
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.size, "hits": self.hits, "misses": self.misses}
+
+    def cached(self, func):
+        """
+        Decorator caching a repository function taking start_datetime/end_datetime and optional
+        camera/city filters.
+
+        Only calls whose bounds are aligned to `granularity` seconds are cached, which is what
+        dashboards polling fixed windows send; other calls run uncached, so a sliding "last 24
+        hours" window does not fill the cache with entries nobody asks for again. A granularity
+        of 0 caches every call.
+        """
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if self.max_bytes <= 0:
+                return func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = bound.arguments
+            if not all(is_aligned(arguments.get(name), self.granularity)
+                       for name in ("start_datetime", "end_datetime")):
+                return func(*args, **kwargs)
+            self.check_generation()
+
+            key = (func.__name__, tuple(arguments.items()))
+            entry = self.get(key)
+            if entry is not None:
+                return entry[0]
+
+            token = self.begin()
+            value = func(**arguments)
+            cam_id = next((arguments[name] for name in CAM_ARGUMENTS if name in arguments), None)
+            scope = Scope(cam_id, arguments.get("city"), arguments.get("start_datetime"),
+                          arguments.get("end_datetime"))
+            self.put(key, value, scope, token)
+            return value
+
+        return wrapper
@@ -0,0 +1,92 @@
+from collections import defaultdict
+from math import asin, cos, floor, radians, sin, sqrt
+
+EARTH_RADIUS_METERS = 6371008.8
+METERS_PER_DEGREE_LAT = 111320.0
+
+
+def haversine_meters(lat1, lng1, lat2, lng2):
+    """
+    Great-circle distance between two points, in meters.
+    """
+    dlat = radians(lat2 - lat1)
+    dlng = radians(lng2 - lng1)
+    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * asin(min(1.0, sqrt(a)))
+
+
+class SpatialGrid:
+    """
+    Fixed-size lat/lng grid over camera dicts (as returned by get_cams), built once and read-only.
+
+    Each cell holds the cameras inside a `cell_degrees` square, so a radius or viewport query
+    only looks at the cells it overlaps. Queries covering more cells than are occupied walk the
+    occupied cells instead, which keeps country-wide viewports as cheap as a full scan.
+    """
+
+    def __init__(self, cams, cell_degrees):
+        self.cell_degrees = cell_degrees
+        cells = defaultdict(list)
+        for cam in cams:
+            cells[self.cell(cam["latitude"], cam["longitude"])].append(cam)
+        self.cells = dict(cells)
+        self.size = len(cams)
+
+    def cell(self, lat, lng):
+        return floor(lat / self.cell_degrees), floor(lng / self.cell_degrees)
+
+    def cams_in_cells(self, min_lat, min_lng, max_lat, max_lng):
+        """
+        Cameras of every cell overlapping the box, possibly including some just outside it.
+        """
+        low_row, low_col = self.cell(min_lat, min_lng)
+        high_row, high_col = self.cell(max_lat, max_lng)
+        if (high_row - low_row + 1) * (high_col - low_col + 1) > len(self.cells):
+            for (row, col), cams in self.cells.items():
+                if low_row <= row <= high_row and low_col <= col <= high_col:
+                    yield from cams
+            return
+        for row in range(low_row, high_row + 1):
+            for col in range(low_col, high_col + 1):
+                yield from self.cells.get((row, col), ())
+
+    def within_bbox(self, min_lat, min_lng, max_lat, max_lng):
+        """
+        Cameras inside the box, ordered by id. A box whose min_lng is greater than its max_lng
+        crosses the antimeridian.
+        """
+        if min_lng > max_lng:
+            return sorted(
+                self.within_bbox(min_lat, min_lng, max_lat, 180.0) + self.within_bbox(min_lat, -180.0, max_lat, max_lng),
+                key=lambda cam: cam["id"]
+            )
+        cams = [
+            cam for cam in self.cams_in_cells(min_lat, min_lng, max_lat, max_lng)
+            if min_lat <= cam["latitude"] <= max_lat and min_lng <= cam["longitude"] <= max_lng
+        ]
+        cams.sort(key=lambda cam: cam["id"])
+        return cams
+
+    def near(self, lat, lng, radius_meters, limit=None):
+        """
+        Cameras within `radius_meters` of a point, closest first, as (distance in meters, cam) pairs.
+        """
+        dlat = radius_meters / METERS_PER_DEGREE_LAT
+        # longitude degrees shrink towards the poles; past ~89° every longitude is in range
+        shrink = cos(radians(min(abs(lat) + dlat, 89.0)))
+        dlng = min(radius_meters / (METERS_PER_DEGREE_LAT * shrink), 180.0)
+        if dlng >= 180.0:
+            candidates = self.cams_in_cells(lat - dlat, -180.0, lat + dlat, 180.0)
+        elif lng - dlng < -180.0 or lng + dlng > 180.0:
+            candidates = self.within_bbox(lat - dlat, (lng - dlng + 540.0) % 360.0 - 180.0,
+                                          lat + dlat, (lng + dlng + 540.0) % 360.0 - 180.0)
+        else:
+            candidates = self.cams_in_cells(lat - dlat, lng - dlng, lat + dlat, lng + dlng)
+
+        found = []
+        for cam in candidates:
+            distance = haversine_meters(lat, lng, cam["latitude"], cam["longitude"])
+            if distance <= radius_meters:
+                found.append((distance, cam))
+        found.sort(key=lambda pair: (pair[0], pair[1]["id"]))
+        return found[:limit] if limit else found
@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+
+# the app reads its configuration on import: point it at a throwaway SQLite database first
+os.environ.update(
+    DB_BACKEND="sqlite",
+    SQLITE_PATH=os.path.join(tempfile.mkdtemp(prefix="traffic-tests-"), "test.db"),
+    INGEST_MODE="sync",
+    NOTIFY_SENDER="none",
+    RESULT_CACHE_MAX_BYTES="0",
+)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+from db.database import Base, SessionLocal, db_engine
+from db.entities import TrafficCam
+
+
+@pytest.fixture(scope="session", autouse=True)
+def tables():
+    Base.metadata.create_all(bind=db_engine)
+    yield
+    db_engine.dispose()
+
+
+@pytest.fixture
+def session():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
+
+
+@pytest.fixture
+def cam(session):
+    cam = TrafficCam(location_lat=40.4168, location_lng=-3.7038, alias="Gran Via", city="Madrid")
+    session.add(cam)
+    session.flush()
+    return cam
@@ -0,0 +1,75 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from analytics import get_peak_hours_vectorized
+from db.database import SessionLocal
+from db.entities import TrafficCam
+from repository import add_traffic_records, get_peak_hours
+
+DAY = datetime(2024, 5, 6)
+
+
+def records(cam_id, start, counts, minutes=15):
+    return [
+        {"traffic_cam_id": cam_id, "start_time": start + timedelta(minutes=minutes * i),
+         "end_time": start + timedelta(minutes=minutes * (i + 1)), "vehicle_count": count,
+         "average_speed": 40.0}
+        for i, count in enumerate(counts)
+    ]
+
+
+@pytest.fixture(scope="module")
+def cams():
+    """
+    Three cameras in two cities with four days of records between 06:00 and 20:00.
+    """
+    with SessionLocal() as session:
+        cams = [TrafficCam(location_lat=19.43, location_lng=-99.13, alias=f"Reforma {i}", city="CDMX")
+                for i in range(2)]
+        cams.append(TrafficCam(location_lat=20.67, location_lng=-103.35, alias="Chapultepec", city="Guadalajara"))
+        session.add_all(cams)
+        session.commit()
+        ids = [cam.id for cam in cams]
+
+    rng = random.Random(7)
+    rows = []
+    for day in range(4):
+        for cam_id in ids:
+            rows += records(cam_id, DAY + timedelta(days=day, hours=6), [rng.randint(0, 40) for _ in range(14 * 4)])
+    # ties: 08:00 and 12:00 share the peak of one day, and are each the only peak of another day
+    for day, counts in ((10, [100, 0, 0, 0, 100]), (11, [60, 10, 10, 10, 50]), (12, [10, 10, 10, 10, 70])):
+        rows += records(ids[0], DAY + timedelta(days=day, hours=8), counts, minutes=60)
+    inserted, rejected = add_traffic_records(rows)
+    assert (inserted, rejected) == (len(rows), [])
+    return ids
+
+
+@pytest.mark.parametrize("start, end", [
+    (DAY, DAY + timedelta(days=4)),
+    (DAY + timedelta(hours=7, minutes=17, seconds=33), DAY + timedelta(days=3, hours=16, minutes=42, seconds=10)),
+    (DAY + timedelta(hours=9, minutes=5), DAY + timedelta(hours=11, minutes=50)),
+    (DAY + timedelta(days=10), DAY + timedelta(days=13)),
+    (DAY + timedelta(days=20), DAY + timedelta(days=21)),
+])
+@pytest.mark.parametrize("scope", ["all", "cam", "city"])
+def test_vectorized_peak_hours_match_the_repository(cams, start, end, scope):
+    filters = {"all": {}, "cam": {"cam_id": cams[0]}, "city": {"city": "CDMX"}}[scope]
+    expected = get_peak_hours(start, end, **filters)
+    assert get_peak_hours_vectorized(start, end, **filters) == expected
+
+
+def test_peak_hour_ties_are_all_reported(cams):
+    start, end = DAY + timedelta(days=10), DAY + timedelta(days=13)
+    expected = [
+        {"hour": "08:00 - 09:00", "vehicle_count": 80},
+        {"hour": "12:00 - 13:00", "vehicle_count": 85},
+    ]
+    assert get_peak_hours(start, end, cam_id=cams[0]) == expected
+    assert get_peak_hours_vectorized(start, end, cam_id=cams[0]) == expected
+
+
+def test_empty_range_has_no_peak_hours(cams):
+    start, end = DAY + timedelta(days=20), DAY + timedelta(days=21)
+    assert get_peak_hours(start, end) == get_peak_hours_vectorized(start, end) == []
@@ -0,0 +1,43 @@
+import pytest
+
+from db.database import SessionLocal
+from db.entities import TrafficCam
+from main import app
+
+
+@pytest.fixture(scope="module")
+def client():
+    return app.test_client()
+
+
+@pytest.fixture(scope="module")
+def cam_id():
+    with SessionLocal() as session:
+        cam = TrafficCam(location_lat=-34.6037, location_lng=-58.3816, alias="9 de Julio", city="Buenos Aires")
+        session.add(cam)
+        session.commit()
+        return cam.id
+
+
+def test_offset_timestamps_round_trip_through_stats(client, cam_id):
+    response = client.post('/record', json={
+        "traffic_cam_id": cam_id, "start_datetime": "2031-01-06T08:00:00-03:00",
+        "end_datetime": "2031-01-06T08:05:00-03:00", "vehicle_count": 17, "average_speed": 32.5,
+    })
+    assert response.status_code == 200
+
+    # the record is found by the range it was sent in, with or without the offset
+    for start, end in (("2031-01-06T08:00:00-03:00", "2031-01-06T08:05:00-03:00"),
+                       ("2031-01-06T08:00:00", "2031-01-06T08:05:00")):
+        response = client.get('/stats', query_string={"start_datetime": start, "end_datetime": end})
+        assert response.status_code == 200
+        assert response.get_json() == {"average_speed": 32.5, "total_vehicle_count": 17}
+
+    traffic_states = client.get('/traffic_state', query_string={"city": "Buenos Aires"}).get_json()["traffic_states"]
+    assert [state["updated_at"] for state in traffic_states] == ["2031-01-06 08:05:00"]
+
+
+def test_missing_range_is_a_bad_request(client):
+    response = client.get('/stats', query_string={"start_datetime": "2031-01-06T08:00:00"})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Both 'start_datetime' and 'end_datetime' are required"}
@@ -0,0 +1,61 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from db.database import SessionLocal
+from db.entities import TrafficCam, TrafficRecord
+from repository import add_traffic_records, compact_traffic_records, get_peak_hours, get_traffic_stats_in_range
+
+DAY = datetime(2001, 1, 8)
+# ranges that start and end inside an hour, on the five-minute grid of the records
+RANGES = [
+    (DAY + timedelta(hours=7, minutes=15), DAY + timedelta(days=2, hours=16, minutes=45)),
+    (DAY + timedelta(hours=9, minutes=40), DAY + timedelta(hours=11, minutes=20)),
+    (DAY + timedelta(days=1, hours=12, minutes=5), DAY + timedelta(days=1, hours=12, minutes=50)),
+]
+
+
+@pytest.fixture(scope="module")
+def cam_ids():
+    """
+    Two cameras with three days of five-minute records between 06:00 and 20:00, each hour with
+    its own vehicle count and speed, compacted once the module is done with the raw records.
+    """
+    with SessionLocal() as session:
+        cams = [TrafficCam(location_lat=38.72, location_lng=-9.14, alias=f"Avenida {i}", city="Lisboa")
+                for i in range(2)]
+        session.add_all(cams)
+        session.commit()
+        ids = [cam.id for cam in cams]
+
+    rng = random.Random(11)
+    rows = []
+    for day in range(3):
+        for hour in range(6, 20):
+            for cam_id in ids:
+                count, speed = rng.randint(0, 30), rng.uniform(5, 60)
+                start = DAY + timedelta(days=day, hours=hour)
+                rows += [{"traffic_cam_id": cam_id, "start_time": start + timedelta(minutes=5 * i),
+                          "end_time": start + timedelta(minutes=5 * (i + 1)), "vehicle_count": count,
+                          "average_speed": speed} for i in range(12)]
+    assert add_traffic_records(rows) == (len(rows), [])
+    return ids
+
+
+def answers(start, end, cam_id, city):
+    stats = get_traffic_stats_in_range(start, end, cam_id, city)
+    return stats.total_vehicle_count, stats.average_speed, get_peak_hours(start, end, cam_id, city)
+
+
+def test_compaction_keeps_range_answers(cam_ids):
+    scopes = [(None, None), (cam_ids[0], None), (None, "Lisboa")]
+    before = {(r, scope): answers(*r, *scope) for r in RANGES for scope in scopes}
+
+    removed, written = compact_traffic_records(datetime.now() - (DAY + timedelta(days=7)))
+    assert (removed, written) == (3 * 14 * 2 * 12, 3 * 14 * 2)
+    with SessionLocal() as session:
+        assert session.query(TrafficRecord).filter(TrafficRecord.start_time < DAY + timedelta(days=3)).count() == written
+
+    for (r, scope), (vehicles, speed, peaks) in before.items():
+        assert answers(*r, *scope) == (vehicles, pytest.approx(speed), peaks)
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from db.database import SessionLocal
+from db.entities import TrafficCam, TrafficHourlyRollup, TrafficRecord
+from repository import add_traffic_records, duplicate_records
+
+HOUR = datetime(2004, 5, 3, 9)
+
+
+@pytest.fixture(scope="module")
+def cam_id():
+    with SessionLocal() as session:
+        cam = TrafficCam(location_lat=52.52, location_lng=13.405, alias="Unter den Linden", city="Berlin")
+        session.add(cam)
+        session.commit()
+        return cam.id
+
+
+def records(cam_id, minutes):
+    return [{"traffic_cam_id": cam_id, "start_time": HOUR + timedelta(minutes=m),
+             "end_time": HOUR + timedelta(minutes=m + 5), "vehicle_count": 10, "average_speed": 40.0}
+            for m in minutes]
+
+
+def stored(cam_id):
+    with SessionLocal() as session:
+        count = session.query(TrafficRecord).filter(TrafficRecord.traffic_cam_id == cam_id).count()
+        rollup = session.get(TrafficHourlyRollup, (cam_id, HOUR))
+        return count, rollup.vehicle_sum, rollup.speed_count
+
+
+def test_retried_batch_only_inserts_new_records(cam_id):
+    before = duplicate_records.total
+    assert add_traffic_records(records(cam_id, [0, 5, 10])) == (3, [])
+
+    # a retry of the same upload with one new record, one repeated within the batch and an unknown camera
+    batch = records(cam_id, [0, 5, 10, 15, 15]) + records(-1, [0])
+    assert add_traffic_records(batch) == (1, [(5, "Unknown traffic_cam_id -1")])
+
+    assert stored(cam_id) == (4, 40, 4)
+    assert duplicate_records.total - before == 4
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from db.entities import TrafficJamAlert
+from jam_detector import CLEAR, CLEAR_STATE, JAMMED, PENDING, JamDetector
+
+BASELINE = 50.0
+START = datetime(2025, 3, 3, 8, 0)
+
+
+def reading(cam_id, minute, speed, minutes=5):
+    start = START + timedelta(minutes=minute)
+    return {"traffic_cam_id": cam_id, "start_time": start, "end_time": start + timedelta(minutes=minutes),
+            "vehicle_count": 10, "average_speed": speed}
+
+
+@pytest.fixture
+def detector():
+    detector = JamDetector(enter_ratio=0.2, exit_ratio=0.5, min_duration=timedelta(minutes=10))
+    detector.loaded = True  # nothing to load from the test database
+    return detector
+
+
+def run(detector, readings, state=CLEAR_STATE):
+    events = []
+    for row in readings:
+        state, change = detector.step(state, row, BASELINE)
+        events.append(change)
+    return state, events
+
+
+# ---------- step ----------
+
+def test_slow_readings_start_a_jam_once_they_last_min_duration(detector):
+    state, events = run(detector, [reading(1, 0, 8), reading(1, 5, 9)])
+    assert state.status == JAMMED
+    assert state.since == START
+    assert events == [None, "start"]
+
+
+def test_short_slowdown_stays_pending_and_clears_without_alert(detector):
+    state, events = run(detector, [reading(1, 0, 8), reading(1, 3, 30, minutes=2)])
+    assert state.status == CLEAR
+    assert events == [None, None]
+
+    state, _ = run(detector, [reading(1, 0, 8)])
+    assert state.status == PENDING
+
+
+def test_jam_holds_between_enter_and_exit_ratio(detector):
+    state, events = run(detector, [reading(1, 0, 8), reading(1, 5, 8), reading(1, 10, 20), reading(1, 15, 24)])
+    assert state.status == JAMMED
+    assert state.since == START
+    assert events == [None, "start", None, None]
+
+
+def test_jam_clears_once_speed_reaches_exit_ratio(detector):
+    state, events = run(detector, [reading(1, 0, 8), reading(1, 5, 8), reading(1, 10, 25)])
+    assert state.status == CLEAR
+    assert events == [None, "start", "end"]
+
+
+def test_camera_without_baseline_never_jams(detector):
+    state, change = detector.step(CLEAR_STATE, reading(1, 0, 0), 0)
+    assert state.status == CLEAR
+    assert change is None
+
+
+# ---------- observe ----------
+
+def test_observe_inserts_and_closes_one_alert_per_episode(detector, session, cam):
+    started, ended = detector.observe(session, [reading(cam.id, 0, 8), reading(cam.id, 5, 8)], lambda row: BASELINE)
+    assert [alert.event_time for alert in started] == [START]
+    assert ended == []
+    alert_id = started[0].id
+    assert session.info["jam_states"][cam.id].alert == alert_id
+
+    started, ended = detector.observe(session, [reading(cam.id, 10, 40)], lambda row: BASELINE)
+    assert started == []
+    assert [alert.id for alert in ended] == [alert_id]
+    assert session.get(TrafficJamAlert, alert_id).ended_at == START + timedelta(minutes=10)
+
+
+def test_observe_sorts_rows_and_ignores_late_readings(detector, session, cam):
+    # delivered out of order: sorted by start time before being applied
+    started, _ = detector.observe(session, [reading(cam.id, 5, 8), reading(cam.id, 0, 8)], lambda row: BASELINE)
+    assert [alert.event_time for alert in started] == [START]
+
+    # a fast reading older than the last one applied must not clear the jam
+    started, ended = detector.observe(session, [reading(cam.id, 2, 45)], lambda row: BASELINE)
+    assert (started, ended) == ([], [])
+    assert session.info["jam_states"][cam.id].status == JAMMED
+
+
+def test_staged_states_apply_only_on_commit(detector, session, cam):
+    detector.observe(session, [reading(cam.id, 0, 8), reading(cam.id, 5, 8)], lambda row: BASELINE)
+    assert cam.id not in detector.states
+    detector.apply(session.info.pop("jam_states"))
+    assert detector.states[cam.id].status == JAMMED
@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from db.database import SessionLocal
+from db.entities import NotificationOutbox, TelegramBotUser, TrafficCam, TrafficJamAlert
+from notifications import CLAIM_TIMEOUT_SECONDS, NotificationDispatcher, StubSender
+
+USER_ID = 1001
+
+
+@pytest.fixture
+def outbox_id():
+    """
+    One due jam notification, committed so the dispatcher's own sessions see it.
+    """
+    with SessionLocal() as session:
+        cam = TrafficCam(location_lat=41.3874, location_lng=2.1686, alias="Diagonal", city="Barcelona")
+        session.add_all([cam, TelegramBotUser(user_id=USER_ID)])
+        session.flush()
+        alert = TrafficJamAlert(traffic_cam_id=cam.id, event_time=datetime(2025, 3, 3, 8, 15))
+        session.add(alert)
+        session.flush()
+        outbox = NotificationOutbox(user_id=USER_ID, traffic_cam_id=cam.id, alert_id=alert.id,
+                                    kind=NotificationOutbox.JAM_STARTED, created_at=datetime.now(),
+                                    next_attempt_at=datetime.now())
+        session.add(outbox)
+        session.commit()
+        ids = outbox.id, alert.id, cam.id
+    yield ids[0]
+    with SessionLocal() as session:
+        for model, key in zip((NotificationOutbox, TrafficJamAlert, TrafficCam), ids):
+            session.delete(session.get(model, key))
+        session.delete(session.get(TelegramBotUser, USER_ID))
+        session.commit()
+
+
+def load(outbox_id):
+    with SessionLocal() as session:
+        return session.get(NotificationOutbox, outbox_id)
+
+
+def make_due(outbox_id):
+    with SessionLocal() as session:
+        session.get(NotificationOutbox, outbox_id).next_attempt_at = datetime.now()
+        session.commit()
+
+
+def dispatcher(sender, max_attempts=3):
+    return NotificationDispatcher(sender, rate=0, batch_size=10, max_attempts=max_attempts, poll_interval=1)
+
+
+def test_due_notification_is_delivered_once(outbox_id):
+    sender = StubSender()
+    notifier = dispatcher(sender)
+
+    assert notifier.dispatch_batch() == 1
+    assert [(n.id, n.user_id, n.text) for n in sender.sent] == [
+        (outbox_id, USER_ID, "Traffic jam at Diagonal (Barcelona) since 08:15.")
+    ]
+    stored = load(outbox_id)
+    assert stored.sent_at is not None
+    assert stored.claimed_at is None
+    assert notifier.stats()["sent"] == 1
+
+    assert notifier.dispatch_batch() == 0
+    assert len(sender.sent) == 1
+
+
+def test_failed_send_is_retried_after_backoff(outbox_id):
+    sender = StubSender(failures=1)
+    notifier = dispatcher(sender)
+
+    assert notifier.dispatch_batch() == 1
+    stored = load(outbox_id)
+    assert (stored.attempts, stored.sent_at, stored.claimed_at) == (1, None, None)
+    assert stored.last_error == "stub failure"
+    assert stored.next_attempt_at > datetime.now()
+    assert notifier.dispatch_batch() == 0  # still backing off
+
+    make_due(outbox_id)
+    assert notifier.dispatch_batch() == 1
+    assert len(sender.sent) == 1
+    assert load(outbox_id).sent_at is not None
+    assert notifier.stats() == {"sent": 1, "failed": 1, "abandoned": 0, "last_error": "stub failure"}
+
+
+def test_notification_is_abandoned_after_max_attempts(outbox_id):
+    sender = StubSender(failures=10)
+    notifier = dispatcher(sender, max_attempts=2)
+
+    for _ in range(2):
+        make_due(outbox_id)
+        assert notifier.dispatch_batch() == 1
+    make_due(outbox_id)
+    assert notifier.dispatch_batch() == 0
+
+    stored = load(outbox_id)
+    assert (stored.attempts, stored.sent_at) == (2, None)
+    assert sender.sent == []
+    assert notifier.stats()["abandoned"] == 1
+
+
+def test_rows_are_claimed_before_sending(outbox_id):
+    seen = []
+
+    class CheckingSender(StubSender):
+        def send(self, notification):
+            # read from another connection: the claim is committed, no transaction is left open
+            seen.append(load(notification.id).claimed_at)
+            super().send(notification)
+
+    assert dispatcher(CheckingSender()).dispatch_batch() == 1
+    assert seen[0] is not None
+    assert load(outbox_id).claimed_at is None
+
+
+def test_claimed_rows_are_skipped_until_the_claim_expires(outbox_id):
+    sender = StubSender()
+    notifier = dispatcher(sender)
+    with SessionLocal() as session:
+        session.get(NotificationOutbox, outbox_id).claimed_at = datetime.now()
+        session.commit()
+    assert notifier.dispatch_batch() == 0
+
+    with SessionLocal() as session:
+        stale = datetime.now() - timedelta(seconds=CLAIM_TIMEOUT_SECONDS + 1)
+        session.get(NotificationOutbox, outbox_id).claimed_at = stale
+        session.commit()
+    assert notifier.dispatch_batch() == 1
+    assert len(sender.sent) == 1
@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import pytest
+
+from werkzeug.datastructures import MultiDict
+
+from payloads import (MAX_BATCH_SIZE, RequestError, batch_payload, decode_cursor, encode_cursor, parse_batch_body,
+                      parse_page_args, parse_traffic_record)
+
+
+def payload(**overrides):
+    data = {"traffic_cam_id": "3", "start_datetime": "2025-03-03T08:00:00", "end_datetime": "2025-03-03T08:05:00",
+            "vehicle_count": 12, "average_speed": "41.5"}
+    data.update(overrides)
+    return data
+
+
+def test_parse_traffic_record_converts_values():
+    assert parse_traffic_record(payload()) == {
+        "traffic_cam_id": 3,
+        "start_time": datetime(2025, 3, 3, 8, 0),
+        "end_time": datetime(2025, 3, 3, 8, 5),
+        "vehicle_count": 12,
+        "average_speed": 41.5,
+    }
+
+
+def test_timestamps_with_offset_keep_their_wall_clock_time():
+    row = parse_traffic_record(payload(start_datetime="2025-03-03T08:00:00+01:00", end_datetime="2025-03-03T08:05:00Z"))
+    assert row["start_time"] == datetime(2025, 3, 3, 8, 0)
+    assert row["end_time"] == datetime(2025, 3, 3, 8, 5)
+    assert row["start_time"].tzinfo is None and row["end_time"].tzinfo is None
+
+
+@pytest.mark.parametrize("data, message", [
+    ([], "Record must be a JSON object"),
+    ({"traffic_cam_id": 1}, "Missing fields"),
+    (payload(start_datetime="yesterday"), "Invalid field value"),
+    (payload(vehicle_count="many"), "Invalid field value"),
+])
+def test_invalid_payloads_raise_value_error(data, message):
+    with pytest.raises(ValueError, match=message):
+        parse_traffic_record(data)
+
+
+def test_batch_errors_keep_batch_order():
+    rows, positions, errors = parse_batch_body({"records": [payload(), {"traffic_cam_id": 1}, payload()]})
+    assert positions == [0, 2]
+    assert batch_payload(1, [(1, "Unknown traffic_cam_id 3")], positions, errors) == {
+        "inserted": 1,
+        "errors": [{"index": 1, "error": "Missing fields: start_datetime, end_datetime, vehicle_count, average_speed"},
+                   {"index": 2, "error": "Unknown traffic_cam_id 3"}],
+    }
+
+
+@pytest.mark.parametrize("data, status", [([], 400), ({"rows": [payload()]}, 400), ([payload()] * (MAX_BATCH_SIZE + 1), 413)])
+def test_rejected_batches_carry_their_status(data, status):
+    with pytest.raises(RequestError) as excinfo:
+        parse_batch_body(data)
+    assert excinfo.value.status == status
+
+
+def test_page_args():
+    key = (datetime(2025, 3, 3, 8, 0), 41)
+    assert parse_page_args(MultiDict()) is None
+    assert parse_page_args(MultiDict({"limit": "50", "cursor": encode_cursor(key)})) == (50, key)
+    assert decode_cursor(encode_cursor(key)) == key
+    with pytest.raises(ValueError, match="limit must be positive"):
+        parse_page_args(MultiDict({"limit": "-1"}))
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        parse_page_args(MultiDict({"cursor": "zz"}))
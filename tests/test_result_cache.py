@@ -0,0 +1,60 @@
+import time
+from datetime import datetime
+
+from result_cache import RangeResultCache
+
+
+def counting(cache):
+    calls = []
+
+    @cache.cached
+    def stats(start_datetime, end_datetime, cam_id=None, city=None):
+        calls.append((start_datetime, end_datetime, cam_id, city))
+        return len(calls)
+
+    return stats, calls
+
+
+def test_aligned_ranges_are_cached():
+    stats, calls = counting(RangeResultCache(granularity=60))
+    start, end = datetime(2025, 3, 18, 7, 0), datetime(2025, 3, 18, 8, 0)
+    assert stats(start, end) == stats(start, end) == 1
+    assert stats(start, end, cam_id=2) == 2
+
+
+def test_unaligned_ranges_run_with_their_exact_bounds():
+    stats, calls = counting(RangeResultCache(granularity=60))
+    start, end = datetime(2025, 3, 18, 7, 17, 33), datetime(2025, 3, 29, 16, 42, 10)
+    assert stats(start, end) == 1
+    assert stats(start, end) == 2
+    assert calls == [(start, end, None, None)] * 2
+
+
+def test_new_data_drops_only_overlapping_entries():
+    cache = RangeResultCache(granularity=60)
+    stats, calls = counting(cache)
+    morning = (datetime(2025, 3, 18, 7, 0), datetime(2025, 3, 18, 9, 0))
+    evening = (datetime(2025, 3, 18, 17, 0), datetime(2025, 3, 18, 19, 0))
+    stats(*morning, cam_id=1)
+    stats(*evening, cam_id=1)
+    cache.invalidate(1, None, datetime(2025, 3, 18, 8, 0), datetime(2025, 3, 18, 8, 5))
+    assert stats(*evening, cam_id=1) == 2
+    assert stats(*morning, cam_id=1) == 3
+
+
+def test_entries_expire_after_ttl():
+    stats, calls = counting(RangeResultCache(granularity=60, ttl=0.05))
+    start, end = datetime(2025, 3, 18, 7, 0), datetime(2025, 3, 18, 8, 0)
+    stats(start, end)
+    time.sleep(0.1)
+    assert stats(start, end) == 2
+
+
+def test_generation_change_clears_the_cache(monkeypatch):
+    monkeypatch.setattr("result_cache.GENERATION_CHECK_SECONDS", 0)
+    generation = [1]
+    stats, calls = counting(RangeResultCache(granularity=60, generation=lambda: generation[0]))
+    start, end = datetime(2025, 3, 18, 7, 0), datetime(2025, 3, 18, 8, 0)
+    assert stats(start, end) == stats(start, end) == 1
+    generation[0] = 2
+    assert stats(start, end) == 2
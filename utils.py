@@ -6,3 +6,12 @@ class TrafficStates(Enum):
     High = "alto"
     Jam = "atascamiento"
 
+
+def wall_clock(moment):
+    """
+    `moment` as the naive datetime stored in the database: the wall-clock time it was sent with,
+    any UTC offset dropped. Naive datetimes are returned as they are.
+    """
+    if moment is not None and moment.tzinfo is not None:
+        return moment.replace(tzinfo=None)
+    return moment